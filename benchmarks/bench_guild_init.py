@@ -0,0 +1,88 @@
+"""Rows per second of guild initialization for a synthetic 50k members guild.
+
+Compares a per-row ``Table.insert`` loop (on a sample) with ``Table.insert_many``.
+The tables are dropped and created, so point it to a scratch database:
+
+    BENCH_POSTGRES_DB=bench python -m benchmarks.bench_guild_init
+"""
+import asyncio
+import datetime
+import os
+import random
+import time
+
+from bot.settings import POSTGRES_USER, POSTGRES_PASS, POSTGRES_HOST
+from models.models import *
+
+MEMBERS = int(os.getenv('BENCH_MEMBERS', 50_000))
+ROLES = 50
+ROLES_PER_MEMBER = 3
+PER_ROW_SAMPLE = 2_000
+GUILD_ID = 1
+
+
+def synthetic_rows():
+    created_at = datetime.datetime(2020, 1, 1)
+    member_ids = range(10 ** 6, 10 ** 6 + MEMBERS)
+    role_ids = range(10 ** 5, 10 ** 5 + ROLES)
+
+    roles = [{'role_id': role_id, 'guild_id': GUILD_ID} for role_id in role_ids]
+    users = [{'user_id': user_id, 'created_at': created_at} for user_id in member_ids]
+    profiles = [{'user_id': user_id, 'guild_id': GUILD_ID} for user_id in member_ids]
+    user_roles = [
+        {'user_id': user_id, 'guild_id': GUILD_ID, 'role_id': role_id}
+        for user_id in member_ids
+        for role_id in random.sample(role_ids, ROLES_PER_MEMBER)
+    ]
+    return [(Roles, roles), (Users, users), (Profiles, profiles), (UserRoles, user_roles)]
+
+
+async def reset_tables():
+    await Table.delete_all_tables()
+    await Table.create_all_tables()
+    await Guilds.insert(guild_id=GUILD_ID, user_count=MEMBERS)
+
+
+async def bench_per_row(tables):
+    await reset_tables()
+    rows_done = 0
+    start = time.perf_counter()
+    for table, rows in tables:
+        for row in rows[:PER_ROW_SAMPLE]:
+            await table.insert(**row)
+            rows_done += 1
+    return rows_done, time.perf_counter() - start
+
+
+async def bench_insert_many(tables, on_conflict):
+    await reset_tables()
+    rows_done = 0
+    start = time.perf_counter()
+    for table, rows in tables:
+        await table.insert_many(rows, on_conflict=on_conflict)
+        rows_done += len(rows)
+    return rows_done, time.perf_counter() - start
+
+
+async def main():
+    database = os.getenv('BENCH_POSTGRES_DB')
+    if not database:
+        raise SystemExit('set BENCH_POSTGRES_DB to a scratch database')
+
+    await Table.create_pool(user=POSTGRES_USER, password=POSTGRES_PASS, database=database, host=POSTGRES_HOST)
+    tables = synthetic_rows()
+    print(f'synthetic guild: {MEMBERS} members, {sum(len(rows) for _, rows in tables)} rows')
+
+    results = [
+        ('insert per row (sample)', await bench_per_row(tables)),
+        ('insert_many COPY', await bench_insert_many(tables, None)),
+        ('insert_many ignore', await bench_insert_many(tables, 'ignore')),
+    ]
+    for name, (rows, seconds) in results:
+        print(f'{name:<26} {rows:>8} rows {seconds:8.2f} s {rows / seconds:12.0f} rows/s')
+
+    await Table.delete_all_tables()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+"""Materialization cost of 10k rows: per-row type() objects vs the cached slotted record class.
+
+Does not need a database, rows are imitated by a tuple with asyncpg.Record lookups:
+
+    python -m benchmarks.bench_record_materialization
+"""
+import datetime
+import os
+import timeit
+import tracemalloc
+
+from models.models import Profiles
+
+ROWS = int(os.getenv('BENCH_ROWS', 10_000))
+REPEAT = 5
+
+
+class FakeRecord(tuple):
+    """tuple iterating values like asyncpg.Record, with keys() for dict(row)"""
+
+    names = tuple(column.name for column in Profiles.columns)
+    index = {name: i for i, name in enumerate(names)}
+
+    def keys(self):
+        return self.names
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self.index[key]
+        return tuple.__getitem__(self, key)
+
+
+def synthetic_value(column, i, now):
+    """a value of the column python type, foreign keys and other untyped columns get an int"""
+    python = column.column_type.python
+    if python is datetime.datetime:
+        return now
+    if python is datetime.date:
+        return now.date()
+    if python is bool:
+        return bool(i % 2)
+    if python is str:
+        return str(i)
+    if python in (float, datetime.timedelta, bytes, list):
+        return python()
+    return 10 ** 6 + i
+
+
+def synthetic_rows():
+    """rows built from Profiles.columns, so they follow the schema"""
+    now = datetime.datetime(2020, 1, 1)
+    return [
+        FakeRecord(synthetic_value(column, i, now) for column in Profiles.columns)
+        for i in range(ROWS)
+    ]
+
+
+def old_materialize(rows):
+    objects = []
+    for row in rows:
+        obj = type(f'{Profiles.__tablename__}_obj', tuple(Profiles.mro()), dict(row))
+        objects.append(obj())
+    return objects
+
+
+def record_materialize(rows):
+    record_class = Profiles.record_class
+    return [record_class(row) for row in rows]
+
+
+def raw_materialize(rows):
+    return rows
+
+
+def measure(name, func, rows):
+    seconds = min(timeit.repeat(lambda: func(rows), number=1, repeat=REPEAT))
+    tracemalloc.start()
+    objects = func(rows)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    print(f'{name:<16} {seconds * 1000:8.2f} ms {ROWS / seconds:12.0f} rows/s {size / 1024:10.0f} KiB')
+
+
+def main():
+    rows = synthetic_rows()
+    print(f'{ROWS} rows of {Profiles.__tablename__}')
+    measure('type() per row', old_materialize, rows)
+    measure('record_class', record_materialize, rows)
+    measure('raw', raw_materialize, rows)
+
+
+if __name__ == '__main__':
+    main()
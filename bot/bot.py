@@ -3,10 +3,23 @@ import discord
 import sys
 from discord.ext import commands
 
-from bot.settings import DISCORD_BOT_TOKEN
-from utils.get_prefix import get_prefix
+import datetime
+
+from bot.settings import DISCORD_BOT_TOKEN, ACTIVITY_FLUSH_INTERVAL, ACTIVITY_FLUSH_SIZE, \
+    LEADERBOARD_RECONCILE_INTERVAL, SERIES_FLUSH_INTERVAL, SERIES_MINUTE_RETENTION_HOURS, SERIES_HOUR_RETENTION_DAYS, \
+    DAY_STATISTIC_CONCURRENCY, SKETCH_FLUSH_INTERVAL, SKETCH_RETENTION_DAYS
+from utils.get_prefix import get_prefix, PrefixTable
 from utils.logger import logger
-from utils.send_day_statistic import send_day_statistic
+from utils.send_day_statistic import DayStatisticScheduler
+from utils.activity_aggregator import ActivityAggregator
+from utils.activity_series import ActivitySeries
+from utils.active_users import ActiveUsers
+from utils.guild_cache import GuildCache
+from utils.invite_tracker import InviteTracker
+from utils.leaderboards import Leaderboards
+from utils.permission_index import PermissionIndex
+from utils.user_count_renamer import UserCountRenamer
+from utils.voice_sessions import VoiceSessionTracker
 from models.my_orm import Table
 from models.model_utils import *
 
@@ -19,6 +32,22 @@ class MyBot(commands.Bot):
 
         super().__init__(command_prefix=get_prefix)
 
+        self.leaderboards = Leaderboards(interval=LEADERBOARD_RECONCILE_INTERVAL)
+        self.activity = ActivityAggregator(interval=ACTIVITY_FLUSH_INTERVAL, max_pending=ACTIVITY_FLUSH_SIZE,
+                                           leaderboards=self.leaderboards)
+        self.series = ActivitySeries(interval=SERIES_FLUSH_INTERVAL,
+                                     minute_retention=datetime.timedelta(hours=SERIES_MINUTE_RETENTION_HOURS),
+                                     hour_retention=datetime.timedelta(days=SERIES_HOUR_RETENTION_DAYS))
+        self.cached_guilds = GuildCache()
+        self.prefixes = PrefixTable()
+        self.permissions = PermissionIndex()
+        self.invites = InviteTracker(self.leaderboards)
+        self.active_users = ActiveUsers(self.cached_guilds, interval=SKETCH_FLUSH_INTERVAL,
+                                        retention=datetime.timedelta(days=SKETCH_RETENTION_DAYS))
+        self.voice = VoiceSessionTracker(self.activity, self.cached_guilds, self.series, self.active_users)
+        self.user_count = UserCountRenamer(self.cached_guilds)
+        self.day_statistic = DayStatisticScheduler(self, concurrency=DAY_STATISTIC_CONCURRENCY)
+
         cogs = [f'cogs.{i[0:-3]}' for i in os.listdir(path="./cogs") if not i.startswith('__')]
         for extension in cogs:
             try:
@@ -26,8 +55,11 @@ class MyBot(commands.Bot):
             except Exception as ex:
                 logger.error(f'Failed to load extension {ex}.', file=sys.stderr)
 
-        self.bg_task = self.loop.create_task(send_day_statistic(self))
-        self.cached_guilds = {}
+        self.bg_task = self.loop.create_task(self.day_statistic.run())
+        self.activity_task = self.loop.create_task(self.activity.run())
+        self.leaderboards_task = self.loop.create_task(self.leaderboards.run(self.activity.flush))
+        self.series_task = self.loop.create_task(self.series.run())
+        self.active_users_task = self.loop.create_task(self.active_users.run())
 
     async def on_ready(self):
         """listener when bot is ready"""
@@ -35,19 +67,46 @@ class MyBot(commands.Bot):
         game = discord.Game('SJW & BLM')
         await self.change_presence(status=discord.Status.online, activity=game)
 
-        await Table.delete_all_tables()
-        await Table.create_all_tables()
+        await Table.migrate_all_tables()
 
         for guild in self.guilds:
             await guild_init(guild, self)
 
-        await self.refresh_cached_guilds()
+        await self.cached_guilds.load_all()
+        self.prefixes.warm(self.cached_guilds)
+        await self.permissions.load_all()
+        self.voice.rebuild(self.guilds)
+        await self.user_count.load_names()
+        await self.activity.flush()
+        await self.leaderboards.reconcile()
+        await self.day_statistic.load_all()
 
         logger.info(f'{self.user} is ready on {len(self.guilds)} a guilds')
 
-    async def refresh_cached_guilds(self):
-        guild_list = await get_all_guild_from_db()
-        self.cached_guilds = {guild.guild_id: guild for guild in guild_list}
+    async def close(self):
+        """flush pending activity counters before closing connection"""
+
+        try:
+            self.voice.close()
+        except Exception as ex:
+            logger.error(f'Failed to flush voice sessions on close {ex}.')
+        try:
+            self.user_count.close()
+        except Exception as ex:
+            logger.error(f'Failed to stop user count renames on close {ex}.')
+        try:
+            await self.activity.close()
+        except Exception as ex:
+            logger.error(f'Failed to flush activity on close {ex}.')
+        try:
+            await self.series.close()
+        except Exception as ex:
+            logger.error(f'Failed to flush activity series on close {ex}.')
+        try:
+            await self.active_users.close()
+        except Exception as ex:
+            logger.error(f'Failed to flush active users on close {ex}.')
+        await super().close()
 
     def run(self):
         """run bot with catch failed to load extension"""
@@ -2,7 +2,7 @@ import os
 from dotenv import load_dotenv
 
 
-DEFAULT_PREFIX = 'L'
+DEFAULT_PREFIX = '!'
 
 SETTINGS_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = os.path.dirname(SETTINGS_DIR)
@@ -22,3 +22,34 @@ POSTGRES_PASS = os.getenv("POSTGRES_PASS", False)
 POSTGRES_USER = os.getenv("POSTGRES_USER", False)
 POSTGRES_DB = os.getenv("POSTGRES_DB", False)
 POSTGRES_HOST = os.getenv("POSTGRES_HOST", False)
+
+# Activity write-behind conf
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", 10))
+ACTIVITY_FLUSH_SIZE = int(os.getenv("ACTIVITY_FLUSH_SIZE", 1000))
+LEADERBOARD_RECONCILE_INTERVAL = float(os.getenv("LEADERBOARD_RECONCILE_INTERVAL", 900))
+
+# Activity time-series conf
+SERIES_FLUSH_INTERVAL = float(os.getenv("SERIES_FLUSH_INTERVAL", 60))
+SERIES_MINUTE_RETENTION_HOURS = int(os.getenv("SERIES_MINUTE_RETENTION_HOURS", 48))
+SERIES_HOUR_RETENTION_DAYS = int(os.getenv("SERIES_HOUR_RETENTION_DAYS", 60))
+
+# Day statistic conf
+DAY_STATISTIC_CONCURRENCY = int(os.getenv("DAY_STATISTIC_CONCURRENCY", 5))
+
+# Stat pages conf
+STAT_PAGE_TTL = float(os.getenv("STAT_PAGE_TTL", 60))
+
+# Active users sketches conf
+SKETCH_FLUSH_INTERVAL = float(os.getenv("SKETCH_FLUSH_INTERVAL", 60))
+SKETCH_RETENTION_DAYS = int(os.getenv("SKETCH_RETENTION_DAYS", 62))
+
+# Query metrics conf
+QUERY_LOG_SAMPLE_RATE = float(os.getenv("QUERY_LOG_SAMPLE_RATE", 0.01))
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", 0.5))
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", 600))
+
+# Currency exchanger conf
+CURRENCY_API_URL = os.getenv(
+    "CURRENCY_API_URL", "http://data.fixer.io/api/latest?access_key=9c8736a2c2fb0f26f7bd448155798db6")
+CURRENCY_RATES_TTL = float(os.getenv("CURRENCY_RATES_TTL", 3600))
+CURRENCY_SNAPSHOT_PATH = os.getenv("CURRENCY_SNAPSHOT_PATH", os.path.join(DATA_DIR, 'currency_rates.json'))
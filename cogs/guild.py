@@ -24,6 +24,7 @@ class Guild(commands.Cog):
     async def on_guild_role_delete(self, role):
         """listener when send a message in a chat"""
         await del_role(role)
+        self.bot.permissions.remove_role(role.guild.id, role.id)
         logger.info(f'{role.guild}: role {role} delete')
 
     @commands.Cog.listener()
@@ -41,12 +42,20 @@ class Guild(commands.Cog):
     @commands.Cog.listener()
     async def on_guild_join(self, guild):
         """listener when bot adds a new guild"""
-        await guild_init(guild)
+        await guild_init(guild, self.bot)
+        await self.bot.cached_guilds.load(guild.id)
+        self.bot.day_statistic.schedule(guild.id)
         logger.info(f'{self.bot.user} add in {guild}, is {len(self.bot.guilds)} a guild')
 
     @commands.Cog.listener()
     async def on_guild_remove(self, guild):
         """listener when bot remove from a guild"""
+        self.bot.cached_guilds.remove(guild.id)
+        self.bot.prefixes.invalidate(guild.id)
+        self.bot.permissions.remove_guild(guild.id)
+        self.bot.invites.remove_guild(guild.id)
+        self.bot.leaderboards.remove_guild(guild.id)
+        self.bot.day_statistic.unschedule(guild.id)
         logger.info(f'{self.bot.user} remove from a guild {guild}, bot lost on {len(self.bot.guilds)} a guilds')
 
     @commands.command()
@@ -54,27 +63,136 @@ class Guild(commands.Cog):
     async def guild(self, ctx):
         """Command for send info about a user"""
 
-        guild_from_db = await Guilds.get(guild_id=ctx.guild.id)
+        guild_from_db = self.bot.cached_guilds[ctx.guild.id]
 
         emb = discord.Embed(
             title=f'{ctx.guild}: info',
             description=
             f"""***Users***: ``{ctx.guild.member_count}``\n"""
             f"""***Create guild***: ``{ctx.guild.created_at.strftime("%d %h %Y %H:%M:%S")}``\n"""
-            f"""***bot_prefix***: ``{guild_from_db.bot_prefix}``\n\n"""
+            f"""***bot_prefix***: ``{' '.join(guild_from_db.prefixes)}``\n\n"""
 
             f"""***log_channel_id***: ``{guild_from_db.log_channel_id}``\n"""
             f"""***trophy_channel_id***: ``{guild_from_db.trophy_channel_id}``\n"""
             f"""***user_count_channel_id***: ``{guild_from_db.user_count_channel_id}``\n"""
             f"""***price_minutes***: ``{guild_from_db.price_minutes}``\n"""
-            f"""***price_messages***: ``{guild_from_db.price_minutes}``\n"""
+            f"""***price_messages***: ``{guild_from_db.price_messages}``\n"""
             f"""***role_saver***: ``{guild_from_db.role_saver}``\n"""
+            f"""***statistic_time***: ``{format_statistic_time(guild_from_db)}``\n"""
             , color=discord.Colour.gold()
         )
         emb.set_footer(text=ctx.guild)
         emb.set_image(url=ctx.guild.icon_url)
         await ctx.send(embed=emb)
 
+    @commands.command()
+    @commands.check(check_permission)
+    async def prefix(self, ctx, *prefixes: str):
+        """Command for show or set bot prefixes, the first one is the main prefix"""
+
+        if not prefixes:
+            guild_config = self.bot.cached_guilds[ctx.guild.id]
+            await ctx.send(f"prefixes: {' '.join(f'``{p}``' for p in guild_config.prefixes)}")
+            return
+
+        length = Guilds.bot_prefix.column_type.length
+        if any(not p or len(p) > length for p in prefixes):
+            await ctx.send(f'a prefix must be from 1 to {length} characters')
+            return
+
+        prefixes = list(dict.fromkeys(prefixes))
+        await Guilds.update(guild_id=ctx.guild.id, values={'bot_prefix': prefixes[0], 'extra_prefixes': prefixes[1:]})
+        logger.info(f'{ctx.guild}: prefixes changed to {prefixes}')
+        await ctx.send(f"prefixes: {' '.join(f'``{p}``' for p in prefixes)}")
+
+    @commands.command()
+    @commands.check(check_permission)
+    async def statistic_time(self, ctx, time: str = None, utc_offset: str = '+00:00'):
+        """Command for show or set the local time of the day statistic, e.g. ``12:00 +03:00``"""
+
+        if time is None:
+            await ctx.send(f'day statistic at ``{format_statistic_time(self.bot.cached_guilds[ctx.guild.id])}``')
+            return
+
+        minute, offset = parse_minutes(time), parse_minutes(utc_offset.lstrip('+-'))
+        if minute is None or offset is None or minute >= 24 * 60 or offset > 14 * 60:
+            await ctx.send('usage: ``statistic_time HH:MM [+HH:MM]``')
+            return
+        if utc_offset.startswith('-'):
+            offset = -offset
+
+        await Guilds.update(guild_id=ctx.guild.id, values={'statistic_minute': minute, 'utc_offset': offset})
+        logger.info(f'{ctx.guild}: day statistic time changed to {time} {utc_offset}')
+        await ctx.send(f'day statistic at ``{format_statistic_time(self.bot.cached_guilds[ctx.guild.id])}``')
+
+    @commands.command()
+    @commands.check(check_permission)
+    async def user_count_names(self, ctx, *names: str):
+        """Command for show or replace the names of the user count channel"""
+
+        if not names:
+            rows = await UserCountNames.select(UserCountNames.name) \
+                .where(UserCountNames.guild_id == ctx.guild.id).fetch(raw=True)
+            await ctx.send(f"user count names: {' '.join(f'``{name}``' for name, in rows) or '``-``'}")
+            return
+
+        length = UserCountNames.name.column_type.length
+        if any(not name or len(name) > length for name in names):
+            await ctx.send(f'a name must be from 1 to {length} characters')
+            return
+
+        names = list(dict.fromkeys(names))
+        async with MaybeAcquire(None, pool=Table._pool, key=('user_count_names', 'replace')) as con:
+            async with con.transaction():
+                await UserCountNames.delete_(connection=con, guild_id=ctx.guild.id)
+                await UserCountNames.insert_many([{'guild_id': ctx.guild.id, 'name': name} for name in names],
+                                                 connection=con)
+        # the next rename of the channel takes a name of the new pool
+        self.bot.user_count.set_names(ctx.guild.id, names)
+        logger.info(f'{ctx.guild}: user count names changed to {names}')
+        await ctx.send(f"user count names: {' '.join(f'``{name}``' for name in names)}")
+
+    @commands.command()
+    @commands.has_permissions(administrator=True)
+    async def allow(self, ctx, command_name: str, role: discord.Role):
+        """Command for allow a role to run a command"""
+
+        command = self.bot.get_command(command_name)
+        if command is None:
+            await ctx.send(f'command ``{command_name}`` not found')
+            return
+        await self.bot.permissions.grant(ctx.guild.id, command.name, role.id)
+        logger.info(f'{ctx.guild}: role {role} allowed to {command.name}')
+        await ctx.send(f'``{role}`` can use ``{command.name}``')
+
+    @commands.command()
+    @commands.has_permissions(administrator=True)
+    async def deny(self, ctx, command_name: str, role: discord.Role):
+        """Command for take a command away from a role"""
+
+        command = self.bot.get_command(command_name)
+        if command is None:
+            await ctx.send(f'command ``{command_name}`` not found')
+            return
+        await self.bot.permissions.revoke(ctx.guild.id, command.name, role.id)
+        logger.info(f'{ctx.guild}: role {role} denied to {command.name}')
+        await ctx.send(f'``{role}`` can not use ``{command.name}``')
+
+
+def parse_minutes(value: str) -> t.Optional[int]:
+    """minutes of ``HH:MM``"""
+    hours, _, minutes = value.partition(':')
+    if not (hours.isdigit() and minutes.isdigit() and len(minutes) == 2 and int(minutes) < 60):
+        return None
+    return int(hours) * 60 + int(minutes)
+
+
+def format_statistic_time(guild_config) -> str:
+    offset = guild_config.utc_offset or 0
+    sign = '-' if offset < 0 else '+'
+    minute = guild_config.statistic_minute
+    return f'{minute // 60:02d}:{minute % 60:02d} UTC{sign}{abs(offset) // 60:02d}:{abs(offset) % 60:02d}'
+
 
 def setup(bot: commands.Bot) -> None:
     bot.add_cog(Guild(bot))
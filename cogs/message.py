@@ -4,7 +4,6 @@ import discord
 from discord.ext import commands
 import datetime
 
-from database.DB import DB
 from utils.logger import logger
 from utils.check_permission import check_permission
 from models.model_utils import *
@@ -22,12 +21,15 @@ class Message(commands.Cog):
         if message.author.bot:
             return
 
-        guild = await Guilds.get(guild_id=message.guild.id)
-        price = guild.price_messages
-        await Profiles.update(user_id=message.author.id,
-                              guild_id=message.guild.id,
-                              set=[
-                                  f"messages = messages + 1, coins = coins + {price}, day_messages = day_messages + 1"])
+        if not message.guild:
+            return
+
+        guild = self.bot.cached_guilds.get(message.guild.id)
+        price = guild.price_messages if guild else 0
+        self.bot.activity.add_message(message.guild.id, message.author.id, message.channel.id, price)
+        sent_at = message.created_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+        self.bot.series.record_message(message.guild.id, message.channel.id, message.author.id, sent_at)
+        self.bot.active_users.record_message(message.guild.id, message.channel.id, message.author.id, sent_at)
 
     # @commands.Cog.listener()
     # async def on_message_edit(self, before, after):
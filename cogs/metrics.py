@@ -0,0 +1,79 @@
+import asyncio
+
+import discord
+from discord.ext import commands
+
+from bot.settings import METRICS_LOG_INTERVAL
+from models.instrumentation import metrics, log_sink
+from utils.check_permission import check_permission
+from utils.logger import logger
+
+
+class Metrics(commands.Cog):
+    """class for database pool and query statistics"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        metrics.add_sink(log_sink)
+        self.report_task = bot.loop.create_task(self.report_loop())
+
+    def cog_unload(self):
+        self.report_task.cancel()
+        metrics.remove_sink(log_sink)
+
+    async def report_loop(self):
+        """pass a metrics snapshot to the sinks every METRICS_LOG_INTERVAL seconds"""
+        while True:
+            await asyncio.sleep(METRICS_LOG_INTERVAL)
+            try:
+                metrics.report()
+            except Exception as ex:
+                logger.error(f'metrics report failed: {ex}')
+
+    @commands.command()
+    @commands.check(check_permission)
+    async def dbstat(self, ctx, by: str = 'total', limit: int = 10):
+        """Command for send the heaviest database operations, sort by total, p95, max or count"""
+
+        if by not in ('total', 'p95', 'max', 'count'):
+            await ctx.send('sort by one of: total, p95, max, count')
+            return
+
+        pool = metrics.pool
+        lines = [
+            f'***Pool***: ``{pool.in_use}/{pool.size}`` in use, ``{pool.waiting}`` waiting, '
+            f'max ``{pool.max_in_use}`` in use, ``{pool.max_waiting}`` waiting\n'
+        ]
+        for name, stats in metrics.top(limit, by):
+            execution, wait = stats['execution'], stats['wait']
+            lines.append(
+                f"***{name}***: ``{execution['count']}`` × "
+                f"p50 ``{execution['p50'] * 1000:.1f}ms`` p95 ``{execution['p95'] * 1000:.1f}ms`` "
+                f"max ``{execution['max'] * 1000:.1f}ms`` wait p95 ``{wait['p95'] * 1000:.1f}ms`` "
+                f"rows ``{stats['rows']}`` errors ``{stats['errors']}``"
+            )
+
+        activity = self.bot.activity.stats()
+        lines.append(
+            f"\n***Activity***: ``{activity['pending']}`` pending, ``{activity['flush_count']}`` flushes, "
+            f"avg batch ``{activity['avg_batch_size']:.1f}``, max ``{activity['max_flush_seconds'] * 1000:.1f}ms``"
+        )
+
+        modlog = self.bot.get_cog('ModLog')
+        if modlog is not None:
+            caches = modlog.cache_stats()
+            lines.append('***ModLog cache***: ' + ', '.join(
+                f"{name} ``{caches[name]['size']}`` hit ``{caches[name]['hits']}`` miss ``{caches[name]['misses']}``"
+                for name in ('deletes', 'edits')
+            ))
+
+        emb = discord.Embed(
+            title=f'database: top by {by}',
+            description='\n'.join(lines)[:2048],
+            color=discord.Colour.gold()
+        )
+        await ctx.send(embed=emb)
+
+
+def setup(bot: commands.Bot) -> None:
+    bot.add_cog(Metrics(bot))
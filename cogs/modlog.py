@@ -17,6 +17,7 @@ from deepdiff import DeepDiff
 from models.models import *
 from models.model_utils import *
 from utils.icons import Icons
+from utils.message_cache import ExpiringIdSet
 
 
 class Event(Enum):
@@ -50,6 +51,10 @@ GUILD_CHANNEL = t.Union[discord.CategoryChannel, discord.TextChannel, discord.Vo
 CHANNEL_CHANGES_UNSUPPORTED = ("permissions",)
 CHANNEL_CHANGES_SUPPRESSED = ("_overwrites", "position")
 ROLE_CHANGES_UNSUPPORTED = ("colour", "permissions")
+# raw events wait 1 second for the normal ones, ignored ids are used right after ``ignore()``
+CACHE_TTL = 600
+CACHE_SIZE = 10_000
+
 VOICE_STATE_ATTRIBUTES = {
     "channel.name": "Channel",
     "self_stream": "Streaming",
@@ -62,16 +67,21 @@ class ModLog(Cog, name="ModLog"):
 
     def __init__(self, bot: Bot):
         self.bot = bot
-        self._ignored = {event: [] for event in Event}
+        self._ignored = {event: ExpiringIdSet(CACHE_SIZE, CACHE_TTL) for event in Event}
 
-        self._cached_deletes = []
-        self._cached_edits = []
+        self._cached_deletes = ExpiringIdSet(CACHE_SIZE, CACHE_TTL)
+        self._cached_edits = ExpiringIdSet(CACHE_SIZE, CACHE_TTL)
 
     def ignore(self, event: Event, *items: int) -> None:
         """Add event to ignored events to suppress log emission."""
         for item in items:
-            if item not in self._ignored[event]:
-                self._ignored[event].append(item)
+            self._ignored[event].add(item)
+
+    def cache_stats(self) -> dict:
+        """sizes and hit/miss counters of the id caches"""
+        stats = {'deletes': self._cached_deletes.stats(), 'edits': self._cached_edits.stats()}
+        stats.update((f'ignored_{event.value}', ignored.stats()) for event, ignored in self._ignored.items())
+        return stats
 
     async def send_log_message(
             self,
@@ -119,6 +129,8 @@ class ModLog(Cog, name="ModLog"):
                 content = "@everyone"
 
         guild_from_cache = self.bot.cached_guilds.get(guild.id)
+        if guild_from_cache is None or guild_from_cache.log_channel_id is None:
+            return None
         channel_id = guild_from_cache.log_channel_id
         channel = self.bot.get_channel(channel_id)
         log_message = await channel.send(
@@ -185,8 +197,7 @@ class ModLog(Cog, name="ModLog"):
     async def on_guild_channel_update(self, before: GUILD_CHANNEL, after: GuildChannel) -> None:
         """Log channel update event to mod log."""
 
-        if before.id in self._ignored[Event.guild_channel_update]:
-            self._ignored[Event.guild_channel_update].remove(before.id)
+        if self._ignored[Event.guild_channel_update].consume(before.id):
             return
 
         diff = DeepDiff(before, after)
@@ -363,8 +374,7 @@ class ModLog(Cog, name="ModLog"):
     async def on_member_ban(self, guild: discord.Guild, member: discord.Member) -> None:
         """Log ban event to user log."""
 
-        if member.id in self._ignored[Event.member_ban]:
-            self._ignored[Event.member_ban].remove(member.id)
+        if self._ignored[Event.member_ban].consume(member.id):
             return
 
         await self.send_log_message(
@@ -378,34 +388,12 @@ class ModLog(Cog, name="ModLog"):
     async def on_member_join(self, member: discord.Member) -> None:
         """Log member join event to user log."""
 
-        invites_from_db = await Invites.get_many(guild_id=member.guild.id)
-        new_invites = [invite for invite in await member.guild.invites()]
-        new_invites_ids = [inv.id for inv in new_invites]
-        for old_inv in invites_from_db:
-            if old_inv not in new_invites_ids:
-                if old_inv.max_uses == 1:
-                    inv = old_inv
-                    await Invites.delete_(id=inv.id)
-                    await Profiles.update(user_id=inv.user_id,
-                                          guild_id=inv.guild_id,
-                                          set=["invites = invites + 1"])
-            for new_inv in new_invites:
-                if old_inv.id == new_inv.id:
-                    if old_inv.uses < new_inv.uses:
-                        inv = new_inv
-                        await Invites.update(id=inv.id,
-                                             set=["uses = uses + 1"])
-                        await Profiles.update(user_id=inv.inviter.id,
-                                              guild_id=inv.guild.id,
-                                              set=["invites = invites + 1"])
-        try:
-            inviter = inv.inviter
-        except AttributeError:
-            inviter = self.bot.get_user(inv.user_id)
+        inviter_id = await self.bot.invites.attribute_join(member.guild)
+        inviter = self.bot.get_user(inviter_id) if inviter_id else None
 
         message = f'{member.mention}#{member.discriminator}(`{member.id}`)'
         message += f'\n created_at={member.created_at}'
-        field = ('invited by', f'{inviter.mention}')
+        field = ('invited by', inviter.mention if inviter else 'unknown')
         await self.send_log_message(
             Icons.sign_in, discord.Colour.red(),
             "User joined", message,
@@ -418,8 +406,7 @@ class ModLog(Cog, name="ModLog"):
     async def on_member_remove(self, member: discord.Member) -> None:
         """Log member leave event to user log."""
 
-        if member.id in self._ignored[Event.member_remove]:
-            self._ignored[Event.member_remove].remove(member.id)
+        if self._ignored[Event.member_remove].consume(member.id):
             return
 
         await self.send_log_message(
@@ -433,8 +420,7 @@ class ModLog(Cog, name="ModLog"):
     async def on_member_unban(self, guild: discord.Guild, member: discord.User) -> None:
         """Log member unban event to mod log."""
 
-        if member.id in self._ignored[Event.member_unban]:
-            self._ignored[Event.member_unban].remove(member.id)
+        if self._ignored[Event.member_unban].consume(member.id):
             return
 
         member_str = escape_markdown(str(member))
@@ -464,8 +450,7 @@ class ModLog(Cog, name="ModLog"):
     async def on_member_update(self, before: discord.Member, after: discord.Member) -> None:
         """Log member update event to user log."""
 
-        if before.id in self._ignored[Event.member_update]:
-            self._ignored[Event.member_update].remove(before.id)
+        if self._ignored[Event.member_update].consume(before.id):
             return
 
         changes = self.get_role_diff(before.roles, after.roles)
@@ -516,10 +501,9 @@ class ModLog(Cog, name="ModLog"):
         if not message.guild:
             return
 
-        self._cached_deletes.append(message.id)
+        self._cached_deletes.add(message.id)
 
-        if message.id in self._ignored[Event.message_delete]:
-            self._ignored[Event.message_delete].remove(message.id)
+        if self._ignored[Event.message_delete].consume(message.id):
             return
 
         # игнорить ботов
@@ -571,13 +555,11 @@ class ModLog(Cog, name="ModLog"):
 
         await asyncio.sleep(1)  # Подождите здесь на случай, если будет запущено обычное событие
 
-        if event.message_id in self._cached_deletes:
+        if self._cached_deletes.consume(event.message_id):
             # Он был в кеше, и было запущено обычное событие
-            self._cached_deletes.remove(event.message_id)
             return
 
-        if event.message_id in self._ignored[Event.message_delete]:
-            self._ignored[Event.message_delete].remove(event.message_id)
+        if self._ignored[Event.message_delete].consume(event.message_id):
             return
 
         channel = self.bot.get_channel(event.channel_id)
@@ -612,7 +594,7 @@ class ModLog(Cog, name="ModLog"):
         if not msg_before.guild or msg_before.author.bot:
             return
 
-        self._cached_edits.append(msg_before.id)
+        self._cached_edits.add(msg_before.id)
 
         if msg_before.content == msg_after.content:
             return
@@ -688,9 +670,8 @@ class ModLog(Cog, name="ModLog"):
 
         await asyncio.sleep(1)
 
-        if event.message_id in self._cached_edits:
+        if self._cached_edits.consume(event.message_id):
             # сообщение есть в кэше и было запущенно обычное событие, удалить из кэша
-            self._cached_edits.remove(event.message_id)
             return
 
         author = message.author
@@ -731,8 +712,7 @@ class ModLog(Cog, name="ModLog"):
     ) -> None:
         """Log member voice state changes to the voice log channel."""
 
-        if member.id in self._ignored[Event.voice_state_update]:
-            self._ignored[Event.voice_state_update].remove(member.id)
+        if self._ignored[Event.voice_state_update].consume(member.id):
             return
 
         # Исключить все атрибуты канала, кроме имени.
@@ -1,46 +1,56 @@
 import asyncio
 import datetime
+import functools
 
 import discord
-from Cybernator import Paginator
 from discord.ext import commands
 
-from database.DB import DB
+from bot.settings import STAT_PAGE_TTL
+from models.model_utils import *
+from models.reports import DayReport, PeriodReport, get_day_report, get_period_report
 from utils.check_permission import check_permission
-
-START = datetime.datetime.today().date()
-END = START + datetime.timedelta(days=1)
-OLD_START = START - datetime.timedelta(days=1)
-OLD_END = END - datetime.timedelta(days=1)
-
+from utils import activity_series as series
+from utils.active_users import CHANNEL, CHAT, VOICE
+from utils.leaderboards import METRICS
+from utils.paginator import LazyPaginator, PageCache
 
 class Statistic(commands.Cog):
     """Статистика сервер и его участников"""
 
     def __init__(self, bot):
         self.bot = bot
+        # rendered stat pages by guild, repeated stat calls within the ttl reuse them
+        self.pages = PageCache(ttl=STAT_PAGE_TTL)
 
     @commands.command(aliases=['s'])
     @commands.check(check_permission)
     async def stat(self, ctx):
-        day = await self.day(ctx)
-        invites = await self.top_invites(ctx)
-        chat_users = await self.top_users(ctx, 'messages')
-        voice_users = await self.top_users(ctx, 'minutes')
-        chat_channels = await self.top_channels(ctx, 'text')
-        voice_channels = await self.top_channels(ctx, 'voice')
-
-        embeds = [day, invites, chat_users, voice_users, chat_channels, voice_channels]
-        message = await ctx.send(embed=day)
-        page = Paginator(self.bot, message, only=ctx.author, use_more=False, embeds=embeds)
-        await page.start()
+        """Command for send pages of the guild statistic, the first one as soon as it is ready"""
+
+        pages = {
+            'day': lambda: self.day(ctx),
+            'invites': lambda: self.top_invites(ctx),
+            'chat_users': lambda: self.top_users(ctx, 'messages'),
+            'voice_users': lambda: self.top_users(ctx, 'minutes'),
+            'chat_channels': lambda: self.top_channels(ctx, 'text'),
+            'voice_channels': lambda: self.top_channels(ctx, 'voice'),
+        }
+        factories = [functools.partial(self.pages.render, ctx.guild.id, name, factory)
+                     for name, factory in pages.items()]
+        await LazyPaginator(self.bot, factories, only=ctx.author).start(ctx)
 
     async def day(self, ctx):
         emb = await get_embed_day_statistic(self.bot, ctx.guild)
         return emb
 
+    async def leaderboard(self, guild, metric, limit=10):
+        """(user_id, score) from the in-memory leaderboards, the database until they are loaded"""
+        if self.bot.leaderboards.loaded:
+            return dict(self.bot.leaderboards.top(guild.id, metric, limit))
+        return await get_top_users(guild, metric, limit)
+
     async def top_invites(self, ctx):
-        res = await DB.get_top_invites(ctx.guild)
+        res = await self.leaderboard(ctx.guild, 'invites')
 
         emb = discord.Embed(
             title=f'{ctx.guild}:rainbow_flag: Top invites',
@@ -48,19 +58,95 @@ class Statistic(commands.Cog):
             color=discord.Colour.dark_gold(),
         )
 
-        counter = 0
-        for k, v in res.items():
-            counter += 1
-            emb.add_field(name=f'{counter}. {self.bot.get_user(v)}', value=f'{k}', inline=False)
+        for i, (user_id, invites) in enumerate(res.items()):
+            emb.add_field(name=f'{i+1}. {self.bot.get_user(user_id)}', value=f'{invites}', inline=False)
         return emb
 
     @commands.command(aliases=['tc'])
     @commands.check(check_permission)
     async def top_coins(self, ctx):
-        await self.top_users(ctx, 'coins')
+        emb = await self.top_users(ctx, 'coins')
+        await ctx.send(embed=emb)
+
+    @commands.command()
+    @commands.check(check_permission)
+    async def rank(self, ctx, member: discord.Member = None):
+        """Command for send places of a user in the leaderboards"""
+
+        member = member or ctx.author
+        emb = discord.Embed(
+            title=f'{ctx.guild}:rainbow_flag: {member.display_name} rank',
+            description='',
+            color=discord.Colour.dark_gold(),
+        )
+        for metric in METRICS:
+            board = self.bot.leaderboards.board(ctx.guild.id, metric)
+            place = board.rank(member.id)
+            value = f'{place} of {len(board)} ({board.score(member.id)})' if place else '-'
+            emb.add_field(name=metric, value=value, inline=True)
+        await ctx.send(embed=emb)
+
+    @commands.command(aliases=['a'])
+    @commands.check(check_permission)
+    async def activity(self, ctx, days: int = 7):
+        """Command for send guild activity of the last days and its busiest hour (UTC)"""
+
+        days = max(1, min(days, 31))
+        await self.bot.series.flush()
+        end = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) \
+            + datetime.timedelta(days=1)
+        start = end - datetime.timedelta(days=days)
+        messages, minutes = await self.bot.series.by_day(ctx.guild.id, series.GUILD, ctx.guild.id, start, end)
+        hour_messages, hour_minutes = await self.bot.series.by_hour_of_day(
+            ctx.guild.id, series.GUILD, ctx.guild.id, start, end)
+        last_hour = self.bot.series.recent(ctx.guild.id, series.GUILD, ctx.guild.id, 60)
+        today = guild_today(self.bot, ctx.guild.id)
+        first_day = today - datetime.timedelta(days=days - 1)
+        chat_users = await self.bot.active_users.guild_users(ctx.guild.id, CHAT, first_day, today)
+        voice_users = await self.bot.active_users.guild_users(ctx.guild.id, VOICE, first_day, today)
+        hour_totals = hour_messages + hour_minutes
+        busiest_hour = f'{int(hour_totals.argmax()):02d}:00' if hour_totals.sum() else 'no activity'
+
+        emb = discord.Embed(
+            title=f'{ctx.guild}:rainbow_flag: Activity for {days} days',
+            description=
+            f'***Messages***: ``{int(messages.sum())}``\n'
+            f'***Minutes in voices***: ``{int(minutes.sum())}``\n'
+            f'***Unique users***: ``{chat_users}`` in chats, ``{voice_users}`` in voices\n'
+            f'***Busiest hour (UTC)***: ``{busiest_hour}``\n'
+            f'***Last hour***: ``{last_hour[0]}`` messages, ``{last_hour[1]}`` minutes\n',
+            color=discord.Colour.dark_gold(),
+        )
+        for i in range(days):
+            day = (start + datetime.timedelta(days=i)).strftime('%d.%m')
+            emb.add_field(name=day, value=f'{messages[i]} / {minutes[i]}', inline=True)
+        await ctx.send(embed=emb)
+
+    @commands.command(aliases=['w'])
+    @commands.check(check_permission)
+    async def week(self, ctx):
+        """Command for send summary of the last 7 days"""
+        await self.period(ctx, 7)
+
+    @commands.command(aliases=['m'])
+    @commands.check(check_permission)
+    async def month(self, ctx):
+        """Command for send summary of the last 30 days"""
+        await self.period(ctx, 30)
+
+    async def period(self, ctx, days):
+        end = guild_today(self.bot, ctx.guild.id)
+        report = await get_period_report(ctx.guild.id, end - datetime.timedelta(days=days - 1), end)
+        channel_users = {}
+        if report.start is not None and report.start <= end:
+            for kind, entries in ((CHAT, report.top_text_channels), (VOICE, report.top_voice_channels)):
+                if entries:
+                    channel_users.update(await self.bot.active_users.count(
+                        ctx.guild.id, CHANNEL, [entry.channel_id for entry in entries], kind, report.start, end))
+        await ctx.send(embed=format_period_report(self.bot, ctx.guild, report, channel_users))
 
     async def top_users(self, ctx, object):
-        top_users = await DB.get_top_users(ctx.guild, object, 10)
+        top_users = await self.leaderboard(ctx.guild, object)
 
         emb = discord.Embed(
             title=f'{ctx.guild}:rainbow_flag: Top users by {object}',
@@ -75,7 +161,7 @@ class Statistic(commands.Cog):
         return emb
 
     async def top_channels(self, ctx, type_channel):
-        top_channels = await DB.get_top_channels(ctx.guild, type_channel, 10)
+        top_channels = await get_top_channels(ctx.guild, type_channel, 10)
 
         emb = discord.Embed(
             title=f'{ctx.guild}:rainbow_flag: Top {type_channel} channels:keyboard:',
@@ -86,152 +172,96 @@ class Statistic(commands.Cog):
         for i, channel in enumerate(top_channels):
             emb.add_field(name=f'{i+1}. {self.bot.get_channel(channel)}', value=f'{top_channels[channel]}', inline=False)
 
-        await ctx.send(embed=emb)
-
-
-async def get_embed_day_statistic(bot, guild):
-    today = datetime.datetime.today().date()
-    join_remove_day_guild = await DB.get_join_remove_day_guild(guild)
-
-    max_new_user_minutes = await DB.get_top_new_users(guild, 'day_minutes')
-    if max_new_user_minutes:
-        row_max_new_user_minutes = f"""***Best new user in voices***: ``{bot.get_user(max_new_user_minutes[0])}`` - ``{(max_new_user_minutes[1])}`` minutes\n"""
-    else:
-        row_max_new_user_minutes = ''
+        return emb
 
-    max_new_user_messages = await DB.get_top_new_users(guild, 'day_messages')
-    if max_new_user_messages:
-        row_max_new_user_messages = f"""***Best new user in chats***: ``{bot.get_user(max_new_user_messages[0])}`` - ``{(max_new_user_messages[1])}`` messages\n"""
-    else:
-        row_max_new_user_messages = ''
 
-    top_text_channel_day = await DB.get_top_channel_day(guild, 'text')
+def guild_today(bot, guild_id):
+    """the local date of a guild, the server date until the guild is cached"""
+    guild_config = bot.cached_guilds.get(guild_id)
+    return guild_config.today if guild_config else datetime.date.today()
 
-    if len(top_text_channel_day) >= 1:
-        row_text_channel = f'***Top-3 text channel***:\n'
-        name_last_channel = await DB.get_name_last_channel(list(top_text_channel_day.keys())[0])
-        if name_last_channel:
-            row_text_channel_1 = f'***1. ***: ``{name_last_channel}`` - ``{list(top_text_channel_day.values())[0]}``\n'
-        else:
-            row_text_channel_1 = f'***1. ***: ``{bot.get_channel(list(top_text_channel_day.keys())[0])}`` - ``{list(top_text_channel_day.values())[0]}``\n'
-    else:
-        row_text_channel = ''
-        row_text_channel_1 = ''
-
-    if len(top_text_channel_day) >= 2:
-        name_last_channel = await DB.get_name_last_channel(list(top_text_channel_day.keys())[1])
-        if name_last_channel:
-            row_text_channel_2 = f'***1. ***: ``{name_last_channel}`` - ``{list(top_text_channel_day.values())[1]}``\n'
-        else:
-            row_text_channel_2 = f'***1. ***: ``{bot.get_channel(list(top_text_channel_day.keys())[1])}`` - ``{list(top_text_channel_day.values())[1]}``\n'
-    else:
-        row_text_channel_2 = ''
-
-    if len(top_text_channel_day) >= 3:
-        name_last_channel = await DB.get_name_last_channel(list(top_text_channel_day.keys())[2])
-        if name_last_channel:
-            row_text_channel_3 = f'***1. ***: ``{name_last_channel}`` - ``{list(top_text_channel_day.values())[2]}``\n'
-        else:
-            row_text_channel_3 = f'***1. ***: ``{bot.get_channel(list(top_text_channel_day.keys())[2])}`` - ``{list(top_text_channel_day.values())[2]}``\n'
-    else:
-        row_text_channel_3 = ''
-    total_messages = 0
-    for k, v in top_text_channel_day.items():
-        total_messages = total_messages + v
 
+async def get_embed_day_statistic(bot, guild, day=None, include_day=True):
+    if day is None:
+        day = guild_today(bot, guild.id)
+    report = await get_day_report(guild.id, day=day, include_day=include_day)
+    return format_day_report(bot, guild, report, day)
 
-    top_minutes_channel_day = await DB.get_top_channel_day(guild, 'voice')
 
-    if len(top_minutes_channel_day) >= 1:
-        row_voice_channel = f'***Top-3 voice channel***:\n'
+def format_top(title, rows):
+    if not rows:
+        return ''
+    return f'***{title}***:\n' + ''.join(f'***{i}. ***: ``{name}`` - ``{value}``\n' for i, (name, value) in enumerate(rows, 1))
 
 
-        row_voice_channel_1 = f'***1. ***: ``{bot.get_channel(list(top_minutes_channel_day.keys())[0])}`` - ``{list(top_minutes_channel_day.values())[0]}``\n'
-    else:
-        row_voice_channel = ''
-        row_voice_channel_1 = ''
-    if len(top_minutes_channel_day) >= 2:
-        row_voice_channel_2 = f'***2. ***: ``{bot.get_channel(list(top_minutes_channel_day.keys())[1])}`` - ``{list(top_minutes_channel_day.values())[1]}``\n'
-    else:
-        row_voice_channel_2 = ''
+def channel_rows(bot, entries, users=None):
+    """(name, value) of channels, ``users`` adds distinct users by channel id"""
+    if users is None:
+        return [(entry.name or bot.get_channel(entry.channel_id), entry.value) for entry in entries]
+    return [(entry.name or bot.get_channel(entry.channel_id), f'{entry.value}, {users.get(entry.channel_id, 0)} users')
+            for entry in entries]
 
-    if len(top_minutes_channel_day) >= 3:
-        row_voice_channel_3 = f'***3. ***: ``{bot.get_channel(list(top_minutes_channel_day.keys())[2])}`` - ``{list(top_minutes_channel_day.values())[2]}``\n'
-    else:
-        row_voice_channel_3 = ''
-    total_minutes = 0
-    for k, v in top_minutes_channel_day.items():
-        total_minutes = total_minutes + v
 
+def user_rows(bot, entries):
+    return [(bot.get_user(entry.user_id), entry.value) for entry in entries]
 
 
-    top_users_in_voices = await DB.get_top_users( guild, 'day_minutes', 3)
+def format_day_report(bot, guild, report: DayReport, today: datetime.date) -> discord.Embed:
 
-    if len(top_users_in_voices) >= 1:
-        row_voice_user = f'***Top-3 user in voice channel***:\n'
-        row_voice_user_1 = f'***1. ***: ``{bot.get_user(list(top_users_in_voices.keys())[0])}`` - ``{list(top_users_in_voices.values())[0]}``\n'
+    if report.best_new_voice:
+        row_max_new_user_minutes = f"""***Best new user in voices***: ``{bot.get_user(report.best_new_voice.user_id)}`` - ``{report.best_new_voice.value}`` minutes\n"""
     else:
-        row_voice_user = ''
-        row_voice_user_1 = ''
-    if len(top_users_in_voices) >= 2:
-        row_voice_user_2 = f'***2. ***: ``{bot.get_user(list(top_users_in_voices.keys())[1])}`` - ``{list(top_users_in_voices.values())[1]}``\n'
-    else:
-        row_voice_user_2 = ''
-    if len(top_users_in_voices) >= 3:
-        row_voice_user_3 = f'***3. ***: ``{bot.get_user(list(top_users_in_voices.keys())[2])}`` - ``{list(top_users_in_voices.values())[2]}``\n'
-    else:
-        row_voice_user_3 = ''
-
-
-
-    top_users_in_chats = await DB.get_top_users( guild, 'day_messages', 3)
+        row_max_new_user_minutes = ''
 
-    if len(top_users_in_chats) >= 1:
-        row_text_user = f'***Top-3 user in text channel***:\n'
-        row_text_user_1 = f'***1. ***: ``{bot.get_user(list(top_users_in_chats.keys())[0])}`` - ``{list(top_users_in_chats.values())[0]}``\n'
-    else:
-        row_text_user = ''
-        row_text_user_1 = ''
-    if len(top_users_in_chats) >= 2:
-        row_text_user_2 = f'***2. ***: ``{bot.get_user(list(top_users_in_chats.keys())[1])}`` - ``{list(top_users_in_chats.values())[1]}``\n'
+    if report.best_new_chat:
+        row_max_new_user_messages = f"""***Best new user in chats***: ``{bot.get_user(report.best_new_chat.user_id)}`` - ``{report.best_new_chat.value}`` messages\n"""
     else:
-        row_text_user_2 = ''
-    if len(top_users_in_chats) >= 3:
-        row_text_user_3 = f'***3. ***: ``{bot.get_user(list(top_users_in_chats.keys())[2])}`` - ``{list(top_users_in_chats.values())[2]}``\n'
-    else:
-        row_text_user_3 = ''
+        row_max_new_user_messages = ''
 
     embed = discord.Embed(
         title=f'{guild} :rainbow_flag: Summary day ({today.strftime("%d.%m.%Y")}):',
         description=
         f'***All users***: ``{guild.member_count}``\n'
-        f'***Change all users***: + ``{join_remove_day_guild[0]}`` - ``{join_remove_day_guild[1]}`` = ``{join_remove_day_guild[0] - join_remove_day_guild[1]}``\n'
+        f'***Change all users***: + ``{report.joins}`` - ``{report.removes}`` = ``{report.members_change}``\n'
         f'{row_max_new_user_minutes}'
         f'{row_max_new_user_messages}'
 
-        f'\n***Unique users in voices***: ``{len(top_users_in_voices)}``\n'
-        f'***Total minutes in voices***: ``{total_minutes}``\n'
-        f'{row_voice_channel}'
-        f'{row_voice_channel_1}'
-        f'{row_voice_channel_2}'
-        f'{row_voice_channel_3}'
-
-        f'{row_voice_user}'
-        f'{row_voice_user_1}'
-        f'{row_voice_user_2}'
-        f'{row_voice_user_3}'
-
-        f'\n***Unique users in chats***: ``{len(top_users_in_chats)}``\n'
-        f'***Total messages in chats***: ``{total_messages}``\n'
-        f'{row_text_channel}'
-        f'{row_text_channel_1}'
-        f'{row_text_channel_2}'
-        f'{row_text_channel_3}'
-
-        f'{row_text_user}'
-        f'{row_text_user_1}'
-        f'{row_text_user_2}'
-        f'{row_text_user_3}'
+        f'\n***Unique users in voices***: ``{report.voice_users}``\n'
+        f'***Total minutes in voices***: ``{report.total_minutes}``\n'
+        f'{format_top("Top-3 voice channel", channel_rows(bot, report.top_voice_channels))}'
+        f'{format_top("Top-3 user in voice channel", user_rows(bot, report.top_voice_users))}'
+
+        f'\n***Unique users in chats***: ``{report.chat_users}``\n'
+        f'***Total messages in chats***: ``{report.total_messages}``\n'
+        f'{format_top("Top-3 text channel", channel_rows(bot, report.top_text_channels))}'
+        f'{format_top("Top-3 user in text channel", user_rows(bot, report.top_chat_users))}'
+        , color=discord.Colour.dark_gold()
+    )
+    return embed
+
+
+def format_period_report(bot, guild, report: PeriodReport, channel_users=None) -> discord.Embed:
+    if report.start is None or report.start > report.end:
+        return discord.Embed(
+            title=f'{guild} :rainbow_flag: Summary',
+            description='No daily snapshots for this period yet',
+            color=discord.Colour.dark_gold(),
+        )
+
+    embed = discord.Embed(
+        title=f'{guild} :rainbow_flag: Summary {report.start.strftime("%d.%m.%Y")} - {report.end.strftime("%d.%m.%Y")}:',
+        description=
+        f'***Change all users***: + ``{report.joins}`` - ``{report.removes}`` = ``{report.members_change}``\n'
+
+        f'\n***Unique users in voices***: ``{report.voice_users}``\n'
+        f'***Total minutes in voices***: ``{report.total_minutes}``\n'
+        f'{format_top("Top-3 voice channel", channel_rows(bot, report.top_voice_channels, channel_users))}'
+        f'{format_top("Top-3 user in voice channel", user_rows(bot, report.top_voice_users))}'
+
+        f'\n***Unique users in chats***: ``{report.chat_users}``\n'
+        f'***Total messages in chats***: ``{report.total_messages}``\n'
+        f'{format_top("Top-3 text channel", channel_rows(bot, report.top_text_channels, channel_users))}'
+        f'{format_top("Top-3 user in text channel", user_rows(bot, report.top_chat_users))}'
         , color=discord.Colour.dark_gold()
     )
     return embed
@@ -8,11 +8,15 @@ class Test(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        self.exchanger = CurrencyExchanger()
+
+    def cog_unload(self):
+        self.bot.loop.create_task(self.exchanger.close())
 
     @commands.command()
     async def cur(self, ctx: commands.Context, *args):
         string = ''.join(args)
-        res = await CurrencyExchanger.exchange(string)
+        res = await self.exchanger.exchange(string)
         embed = Embed(
             description=res
         )
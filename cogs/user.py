@@ -8,6 +8,7 @@ from discord.utils import escape_markdown
 from utils.logger import logger
 from utils.check_permission import check_permission
 from models.model_utils import *
+from models.reports import get_user_day
 
 
 class User(commands.Cog):
@@ -36,7 +37,9 @@ class User(commands.Cog):
 
     async def get_embed_info_user(self, member: discord.Member) -> discord.Embed:
         color_embed = discord.Colour.gold()
-        profile_user = await Profiles.get(user_id=member.id)
+        profile_user = await Profiles.get(user_id=member.id, guild_id=member.guild.id)
+        guild_config = self.bot.cached_guilds.get(member.guild.id)
+        _, day_minutes = await get_user_day(member.guild.id, member.id, guild_config.today if guild_config else None)
         roles = ','.join(rol.name for rol in member.roles if str(rol.name) != '@everyone')
         text = (
             f"**Name**: {member.mention} \n"
@@ -46,7 +49,7 @@ class User(commands.Cog):
             f"**Join in guild**: {str(profile_user.joined_at)[0:-10]} \n"
             f"**Create account**:  {str(member.created_at)[0:-10]} \n\n"
             f"**coins**: {profile_user.coins} \n"
-            f"**minutes**: {profile_user.minutes} (today: {profile_user.day_minutes})\n"
+            f"**minutes**: {profile_user.minutes} (today: {day_minutes})\n"
             f"**level**: {profile_user.level} \n"
             f"**Roles**:  {roles} \n"
             f"**Joins**:  {profile_user.joins}``\n"
@@ -61,13 +64,8 @@ class User(commands.Cog):
 
         return embed
 
-    async def refresh_user_count_channel(self, guild: discord.Guild) -> None:
-        words = await UserCountNames.get_many(guild_id=guild.id)
-        words = [w.name for w in words]
-        user_count_channel_id = self.bot.cached_guilds.get(guild.id).user_count_channel_id
-        if user_count_channel_id:
-            name = random.choice(words) if words else ''
-            await self.bot.get_channel(user_count_channel_id).edit(name=f'{name}: {guild.member_count}')
+    def refresh_user_count_channel(self, guild: discord.Guild) -> None:
+        self.bot.user_count.request(guild)
 
     @commands.Cog.listener()
     async def on_member_update(self, before: discord.Member, after: discord.Member) -> None:
@@ -78,7 +76,8 @@ class User(commands.Cog):
                 # if role war added
                 new_role_id = list(set(after_roles_ids) - set(before_roles_ids))[0]
                 new_role = next(rol for rol in after.roles if rol.id == new_role_id)
-                await UserRoles.insert(user_id=after.id, guild_id=after.guild.id, role_id=new_role.id)
+                await UserRoles.insert(user_id=after.id, guild_id=after.guild.id, role_id=new_role.id,
+                                       on_conflict='ignore')
             else:
                 # if role war deleted
                 remove_role_id = list(set(before_roles_ids) - set(after_roles_ids))[0]
@@ -89,40 +88,50 @@ class User(commands.Cog):
     async def on_member_join(self, member: discord.Member) -> None:
         """Listener when user join in a guild"""
 
-        await add_user_in_db(member, member.guild)
-
-        guild_from_db = await Guilds.get(guild_id=member.guild.id)
-        role_saver = guild_from_db.role_saver
-        if role_saver:
-            user_roles = await UserRoles.get_many(guild_id=member.guild.id, user_id=member.id)
-            if user_roles:
-                for rol in user_roles:
-                    role = discord.utils.get(member.guild.roles, id=rol.role_id)
-                    if role.name == '@everyone':
-                        continue
-                    else:
-                        await member.add_roles(role)
-
-        await Profiles.update(user_id=member.id,
-                              guild_id=member.guild.id,
-                              set=["joins = joins + 1"])
-        await Guilds.update(guild_id=member.guild.id,
-                            set=["day_joins = day_joins + 1"])
-
-        await self.refresh_user_count_channel(member.guild)
+        async with Table.batch() as b:
+            b.insert(Users, user_id=member.id, created_at=member.created_at, on_conflict='ignore')
+            b.insert(Profiles, user_id=member.id, guild_id=member.guild.id, joined_at=member.joined_at,
+                     on_conflict='ignore')
+            b.update(Profiles, user_id=member.id, guild_id=member.guild.id, increments={"joins": 1})
+            b.update(Guilds, guild_id=member.guild.id, increments={"joins": 1})
+
+            guild_config = self.bot.cached_guilds.get(member.guild.id)
+            user_roles = None
+            if guild_config and guild_config.role_saver:
+                user_roles = await UserRoles.get_many(connection=b.connection,
+                                                      guild_id=member.guild.id, user_id=member.id)
+
+        if user_roles:
+            for rol in user_roles:
+                role = discord.utils.get(member.guild.roles, id=rol.role_id)
+                if role is None or role.name == '@everyone':
+                    continue
+                else:
+                    await member.add_roles(role)
+
+        self.refresh_user_count_channel(member.guild)
 
     @commands.Cog.listener()
     async def on_member_remove(self, member):
         """Listener when user remove in a guild"""
-        await self.refresh_user_count_channel(member.guild)
+        await Guilds.update(guild_id=member.guild.id, increments={"removes": 1})
+        self.refresh_user_count_channel(member.guild)
         logger.info(f'{member.guild}: user {member} remove from guild')
 
     @commands.Cog.listener()
     async def on_invite_create(self, invite):
         """Listener when user create invite in a guild"""
+        self.bot.invites.add(invite)
         await add_invite_in_db(invite)
         logger.info(f'{invite.guild}: user {invite.inviter} create invite')
 
+    @commands.Cog.listener()
+    async def on_invite_delete(self, invite):
+        """Listener when invite is deleted or used up in a guild"""
+        self.bot.invites.remove(invite)
+        await Invites.delete_(id=invite.id)
+        logger.info(f'{invite.guild}: invite {invite.id} delete')
+
     @commands.command(aliases=['i'])
     @commands.check(check_permission)
     async def info(self, ctx, member: discord.Member = None):
@@ -138,48 +147,11 @@ class User(commands.Cog):
     @commands.Cog.listener()
     async def on_voice_state_update(
             self, member: discord.Member,
-            after: discord.VoiceState,
-            before: discord.VoiceState
+            before: discord.VoiceState,
+            after: discord.VoiceState
     ) -> None:
         """listener when change user voice status"""
-
-        channel_before = 'Null' if before.channel is None else before.channel.id
-        user_profile = await Profiles.get(user_id=member.id, guild_id=member.guild.id)
-        last_channel = user_profile.channel_id
-        old_time = user_profile.change_voice_status
-
-        new_time = datetime.datetime.now()
-        if not last_channel:
-            await Profiles.update(user_id=member.id, guild_id=member.guild.id,
-                                  set=[f"channel_id = {channel_before}",
-                                       f"change_voice_status = '{new_time}'"])
-
-        if last_channel and not before.afk and not after.afk:
-            delta_time = new_time - old_time
-            minutes = round(delta_time.seconds / 60)
-            if 1 <= minutes <= 180:
-                await Profiles.update(user_id=member.id, guild_id=member.guild.id,
-                                      set=[f"channel_id = {channel_before}",
-                                           f"change_voice_status = '{new_time}'",
-                                           f"minutes = minutes + {minutes}",
-                                           f"coins = coins + {minutes} * {user_profile.price_minutes}",
-                                           f"day_minutes = day_minutes + 1"])
-                logger.info(f'{member.guild}: user {member} seated {minutes} minutes in channel {before.channel}')
-            elif minutes > 180:
-                await Profiles.update(user_id=member.id, guild_id=member.guild.id,
-                                      set=[f"channel_id = {channel_before}",
-                                           f"change_voice_status = '{new_time}'",
-                                           f"minutes = minutes + {minutes}",
-                                           f"coins = coins + {180} * {user_profile.price_minutes}",
-                                           f"day_minutes = day_minutes + 1"])
-                logger.info(f'{member.guild}: user {member} seated over 180 minutes in channel {before.channel}')
-            else:
-                await Profiles.update(user_id=member.id, guild_id=member.guild.id,
-                                      set=[f"channel_id = {channel_before}",
-                                           f"change_voice_status = '{new_time}'"])
-                logger.info(f'{member.guild}: {member} seated less than one a minutes in channel {before.channel}')
-        else:
-            logger.info(f'{member.guild}: user {member} connect in channel {before.channel}')
+        self.bot.voice.update(member, before, after)
 
 
 def setup(bot: commands.Bot) -> None:
@@ -0,0 +1,221 @@
+import bisect
+import json
+import logging
+import random
+import time
+import typing as t
+from collections import defaultdict
+
+from bot.settings import QUERY_LOG_SAMPLE_RATE, SLOW_QUERY_SECONDS
+
+query_log = logging.getLogger('orm.queries')
+summary_log = logging.getLogger('orm.metrics')
+
+# upper bounds of histogram buckets in seconds: 0.25 ms .. ~8 s
+BUCKETS = tuple(0.00025 * 2 ** i for i in range(16))
+
+
+class Histogram:
+    """Fixed log-scale buckets, percentiles are bucket upper bounds."""
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, amount in enumerate(self.counts):
+            seen += amount
+            if seen >= rank:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'total': self.total,
+            'avg': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+        }
+
+
+class OperationStats:
+    __slots__ = ('wait', 'execution', 'rows', 'errors')
+
+    def __init__(self):
+        self.wait = Histogram()
+        self.execution = Histogram()
+        self.rows = 0
+        self.errors = 0
+
+    def to_dict(self) -> dict:
+        return {
+            'wait': self.wait.to_dict(),
+            'execution': self.execution.to_dict(),
+            'rows': self.rows,
+            'errors': self.errors,
+        }
+
+
+class PoolGauges:
+    __slots__ = ('size', 'in_use', 'waiting', 'max_in_use', 'max_waiting')
+
+    def __init__(self):
+        self.size = None
+        self.in_use = 0
+        self.waiting = 0
+        self.max_in_use = 0
+        self.max_waiting = 0
+
+    @property
+    def saturation(self) -> t.Optional[float]:
+        return self.in_use / self.size if self.size else None
+
+    def to_dict(self) -> dict:
+        return {
+            'size': self.size,
+            'in_use': self.in_use,
+            'waiting': self.waiting,
+            'max_in_use': self.max_in_use,
+            'max_waiting': self.max_waiting,
+            'saturation': self.saturation,
+        }
+
+
+class QueryTimer:
+    """Times one statement, ``rows`` is set by the caller when known."""
+
+    __slots__ = ('metrics', 'key', 'sql', 'rows', 'start')
+
+    def __init__(self, metrics, key, sql):
+        self.metrics = metrics
+        self.key = key
+        self.sql = sql
+        self.rows = 0
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.record(self.key, self.sql, time.perf_counter() - self.start, self.rows, exc)
+
+
+class Metrics:
+    """In-process registry of pool and query statistics keyed by (table, operation).
+
+    Sinks are callables taking ``snapshot()``, ``report()`` passes the snapshot to each of them.
+    """
+
+    def __init__(self, *, sample_rate: float = 0.01, slow_seconds: float = 0.5):
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.operations: t.Dict[t.Tuple[str, str], OperationStats] = defaultdict(OperationStats)
+        self.pool = PoolGauges()
+        self.sinks: t.List[t.Callable[[dict], None]] = []
+        self.started_at = time.time()
+
+    def reset(self) -> None:
+        self.operations.clear()
+        self.pool.max_in_use = self.pool.in_use
+        self.pool.max_waiting = self.pool.waiting
+        self.started_at = time.time()
+
+    def acquire_started(self) -> None:
+        self.pool.waiting += 1
+        self.pool.max_waiting = max(self.pool.max_waiting, self.pool.waiting)
+
+    def acquire_finished(self, key, seconds: float, acquired: bool) -> None:
+        self.pool.waiting -= 1
+        if acquired:
+            self.pool.in_use += 1
+            self.pool.max_in_use = max(self.pool.max_in_use, self.pool.in_use)
+        self.operations[key or ('-', 'acquire')].wait.observe(seconds)
+
+    def released(self) -> None:
+        self.pool.in_use -= 1
+
+    def timed(self, key, sql: str = '') -> QueryTimer:
+        return QueryTimer(self, key, sql)
+
+    def record(self, key, sql: str, seconds: float, rows: int = 0, error: BaseException = None) -> None:
+        stats = self.operations[key]
+        stats.execution.observe(seconds)
+        stats.rows += rows or 0
+        if error is not None:
+            stats.errors += 1
+
+        slow = seconds >= self.slow_seconds
+        if error is not None or slow or random.random() < self.sample_rate:
+            level = logging.WARNING if error is not None or slow else logging.INFO
+            query_log.log(level, json.dumps({
+                'table': key[0],
+                'op': key[1],
+                'ms': round(seconds * 1000, 3),
+                'rows': rows,
+                'error': type(error).__name__ if error is not None else None,
+                'slow': slow,
+                'sql': ' '.join(sql.split()),
+            }, ensure_ascii=False))
+
+    def snapshot(self) -> dict:
+        return {
+            'since': self.started_at,
+            'pool': self.pool.to_dict(),
+            'operations': {f'{table}.{op}': stats.to_dict() for (table, op), stats in self.operations.items()},
+        }
+
+    def top(self, limit: int = 10, by: str = 'total') -> t.List[t.Tuple[str, dict]]:
+        """operations with the biggest execution ``total``, ``p95``, ``max`` or ``count``"""
+
+        items = self.snapshot()['operations'].items()
+        return sorted(items, key=lambda item: item[1]['execution'][by], reverse=True)[:limit]
+
+    def add_sink(self, sink: t.Callable[[dict], None]) -> None:
+        self.sinks.append(sink)
+
+    def remove_sink(self, sink: t.Callable[[dict], None]) -> None:
+        self.sinks.remove(sink)
+
+    def report(self) -> None:
+        snapshot = self.snapshot()
+        for sink in self.sinks:
+            try:
+                sink(snapshot)
+            except Exception as ex:
+                summary_log.error(f'metrics sink {sink} failed: {ex}')
+
+
+def log_sink(snapshot: dict, limit: int = 5) -> None:
+    """summary of the pool and the slowest operations in the log"""
+
+    pool = snapshot['pool']
+    summary_log.info(f"pool in_use={pool['in_use']}/{pool['size']} waiting={pool['waiting']} "
+                     f"max_in_use={pool['max_in_use']} max_waiting={pool['max_waiting']}")
+    operations = sorted(snapshot['operations'].items(), key=lambda item: item[1]['execution']['total'], reverse=True)
+    for name, stats in operations[:limit]:
+        execution, wait = stats['execution'], stats['wait']
+        summary_log.info(f"{name} count={execution['count']} total={execution['total']:.3f}s "
+                         f"p95={execution['p95'] * 1000:.1f}ms wait_p95={wait['p95'] * 1000:.1f}ms "
+                         f"rows={stats['rows']} errors={stats['errors']}")
+
+
+metrics = Metrics(sample_rate=QUERY_LOG_SAMPLE_RATE, slow_seconds=SLOW_QUERY_SECONDS)
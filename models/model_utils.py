@@ -2,13 +2,15 @@ import discord
 from discord import TextChannel
 from discord.ext import commands
 from .models import *
-from typing import List
+from .reports import take_baseline
+from typing import Dict, List
 
 
 async def add_role_in_db(rol: discord.Role) -> None:
     await Roles.insert(
         role_id=rol.id,
-        guild_id=rol.guild.id
+        guild_id=rol.guild.id,
+        on_conflict='ignore'
     )
 
 
@@ -16,7 +18,8 @@ async def add_channel_in_db(channel: discord.channel) -> None:
     await Channels.insert(
         channel_id=channel.id,
         type_channel=channel.type.name,
-        guild_id=channel.guild.id
+        guild_id=channel.guild.id,
+        on_conflict='ignore'
     )
 
 
@@ -28,9 +31,12 @@ async def del_channel(channel: discord.channel) -> None:
 
 async def add_user_in_db(mem: discord.Member, guild: discord.Guild) -> None:
     await Users.insert(user_id=mem.id,
-                       created_at=mem.created_at)
+                       created_at=mem.created_at,
+                       on_conflict='ignore')
     await Profiles.insert(user_id=mem.id,
-                          guild_id=guild.id,)
+                          guild_id=guild.id,
+                          joined_at=mem.joined_at,
+                          on_conflict='ignore')
 
 
 async def add_invite_in_db(inv) -> None:
@@ -39,7 +45,9 @@ async def add_invite_in_db(inv) -> None:
         uses=inv.uses,
         max_uses=inv.max_uses,
         guild_id=inv.guild.id,
-        user_id=inv.inviter.id,
+        user_id=inv.inviter.id if inv.inviter else None,
+        on_conflict='update',
+        conflict_target=['id']
     )
 
 
@@ -51,14 +59,29 @@ async def get_all_guild_from_db() -> List[Guilds]:
     return await Guilds.get_many()
 
 
-async def get_permissions_from_db(ctx: commands.Context) -> List[Permissions]:
-    return await Permissions.get_many(guild_id=ctx.guild.id, command=ctx.command.name)
-
-
 async def get_user_roles(member: discord.Member) -> List[UserRoles]:
     return await UserRoles.get_many(guild_id=member.guild.id, user_id=member.id)
 
 
+async def get_top_users(guild: discord.Guild, column_name: str, limit: int) -> Dict[int, int]:
+    column = getattr(Profiles, column_name)
+    rows = await Profiles.select(Profiles.user_id, column) \
+        .where(Profiles.guild_id == guild.id) \
+        .order_by(column.desc(nulls_last=True)) \
+        .limit(limit).fetch()
+    return {row['user_id']: row[column_name] for row in rows}
+
+
+async def get_top_channels(guild: discord.Guild, type_channel: str, limit: int,
+                           column_name: str = 'all_statistic') -> Dict[int, int]:
+    column = getattr(Channels, column_name)
+    rows = await Channels.select(Channels.channel_id, column) \
+        .where(Channels.guild_id == guild.id, Channels.type_channel == type_channel, column > 0) \
+        .order_by(column.desc()) \
+        .limit(limit).fetch()
+    return {row['channel_id']: row[column_name] for row in rows}
+
+
 async def del_role(rol: discord.Role) -> None:
     await Roles.delete_(
         role_id=rol.id,
@@ -70,26 +93,44 @@ async def guild_init(guild: discord.guild, bot) -> None:
     log_channels = [c for c in text_channels if 'log' in c.name]
     log_channel_id = log_channels[0].id if log_channels else text_channels[-1].id
 
-    await Guilds.insert(guild_id=guild.id, user_count=guild.member_count, log_channel_id=log_channel_id)
-
-    for rol in guild.roles:
-        await add_role_in_db(rol)
-
-    for channel in guild.channels:
-        await add_channel_in_db(channel)
+    await Guilds.insert(guild_id=guild.id, user_count=guild.member_count, log_channel_id=log_channel_id,
+                        on_conflict='ignore')
 
-    for mem in guild.members:
-        await add_user_in_db(mem, guild)
-
-        for member_rol in mem.roles:
-            await UserRoles.insert(user_id=mem.id, guild_id=guild.id, role_id=member_rol.id)
+    await Roles.insert_many(
+        ({'role_id': rol.id, 'guild_id': guild.id} for rol in guild.roles),
+        on_conflict='ignore'
+    )
+    await Channels.insert_many(
+        ({'channel_id': channel.id, 'type_channel': channel.type.name, 'guild_id': guild.id}
+         for channel in guild.channels),
+        on_conflict='ignore'
+    )
+    await Users.insert_many(
+        ({'user_id': mem.id, 'created_at': mem.created_at} for mem in guild.members),
+        on_conflict='ignore'
+    )
+    await Profiles.insert_many(
+        ({'user_id': mem.id, 'guild_id': guild.id, 'joined_at': mem.joined_at} for mem in guild.members),
+        on_conflict='ignore'
+    )
+    await UserRoles.insert_many(
+        ({'user_id': mem.id, 'guild_id': guild.id, 'role_id': member_rol.id}
+         for mem in guild.members for member_rol in mem.roles),
+        on_conflict='ignore'
+    )
 
+    invites = []
     for inv in await guild.invites():
         if inv.max_uses == 1:
             await inv.delete(reason='initial delete invite when max_uses == 1')
             continue
-        await add_invite_in_db(inv)
+        invites.append(inv)
+    await Invites.insert_many(
+        ({'id': inv.id, 'uses': inv.uses, 'max_uses': inv.max_uses, 'guild_id': guild.id,
+          'user_id': inv.inviter.id if inv.inviter else None} for inv in invites),
+        on_conflict='update',
+        conflict_target=['id']
+    )
+    bot.invites.seed(guild.id, invites)
 
-    for command in bot.commands:
-        await Permissions.insert(guild_id=guild.id,
-                                 command=command.name)
+    await take_baseline(guild.id)
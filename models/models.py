@@ -11,9 +11,11 @@ class Guilds(Table, table_name='guilds'):
     id = Column(Integer(auto_increment=True), index=True, unique=True)
     guild_id = Column(Integer(big=True), primary_key=True)
     created_at = Column(Datetime)
-    day_joins = Column(Integer(big=True))
-    day_removes = Column(Integer(big=True))
-    bot_prefix = Column(String(length=20), default='!')
+    # totals, the counts of a day are differences of daily_stats snapshots
+    joins = Column(Integer(big=True), default=0)
+    removes = Column(Integer(big=True), default=0)
+    bot_prefix = Column(String(length=20), default=bot.settings.DEFAULT_PREFIX)
+    extra_prefixes = Column(Array(String(length=20)))
     log_channel_id = Column(Integer(big=True))
     trophy_channel_id = Column(Integer(big=True))
     user_count_channel_id = Column(Integer(big=True))
@@ -21,9 +23,14 @@ class Guilds(Table, table_name='guilds'):
     price_messages = Column(Integer(), default=5)
     user_count = Column(Integer())
     role_saver = Column(Boolean(), default=True)
+    # the day statistic is posted at statistic_minute of the local day, utc_offset in minutes
+    statistic_minute = Column(Integer(small=True), default=720)
+    utc_offset = Column(Integer(small=True), default=0)
+    # the local day of the last posted day statistic
+    statistic_sent = Column(Date)
 
 
-class Profiles(Table, table_name='user_profiles'):
+class Profiles(Table, table_name='user_profiles', unique=[('user_id', 'guild_id')]):
     id = PrimaryKeyColumn()
     user_id = Column(ForeignKey('users', 'user_id', sql_type=Integer(big=True)))
     guild_id = Column(ForeignKey('guilds', 'guild_id', sql_type=Integer(big=True)))
@@ -35,8 +42,6 @@ class Profiles(Table, table_name='user_profiles'):
     level = Column(Integer(), default=1)
     joins = Column(Integer(), default=0)
     invites = Column(Integer(big=True), default=0)
-    day_minutes = Column(Integer(), default=0)
-    day_messages = Column(Integer(), default=0)
     joined_at = Column(Datetime)
 
 
@@ -46,7 +51,6 @@ class Channels(Table, table_name='channels'):
     guild_id = Column(ForeignKey('guilds', 'guild_id', sql_type=Integer(big=True)))
     type_channel = Column(String(length=20))
     all_statistic = Column(Integer)
-    day_statistic = Column(Integer)
     delete = Column(Datetime)
     name_after_delete = Column(String)
 
@@ -58,7 +62,7 @@ class Roles(Table, table_name='roles'):
     name_after_delete = Column(String)
 
 
-class UserRoles(Table, table_name='user_roles'):
+class UserRoles(Table, table_name='user_roles', unique=[('user_id', 'guild_id', 'role_id')]):
     id = PrimaryKeyColumn()
     user_id = Column(ForeignKey('users', 'user_id', sql_type=Integer(big=True)))
     guild_id = Column(ForeignKey('guilds', 'guild_id', sql_type=Integer(big=True)))
@@ -74,7 +78,7 @@ class Invites(Table, table_name='invites'):
     user_id = Column(ForeignKey('users', 'user_id', sql_type=Integer(big=True)))
 
 
-class Permissions(Table, table_name='permissions'):
+class Permissions(Table, table_name='permissions', unique=[('guild_id', 'command', 'role_id')]):
     id = PrimaryKeyColumn()
     command = Column(String(length=100))
     guild_id = Column(ForeignKey('guilds', 'guild_id', sql_type=Integer(big=True)))
@@ -87,6 +91,48 @@ class UserCountNames(Table, table_name='user_count_names'):
     name = Column(String(length=255))
 
 
+class ActivitySeriesRows(Table, table_name='activity_series',
+                         unique=[('resolution', 'bucket', 'guild_id', 'scope', 'scope_id')]):
+    # 0 - minute, 1 - hour, 2 - day buckets
+    resolution = Column(Integer(small=True))
+    bucket = Column(Datetime)
+    guild_id = Column(Integer(big=True))
+    # 0 - guild, 1 - channel, 2 - user
+    scope = Column(Integer(small=True))
+    scope_id = Column(Integer(big=True))
+    messages = Column(Integer(), default=0)
+    minutes = Column(Integer(), default=0)
+
+
+class DailyStats(Table, table_name='daily_stats', partition_by='RANGE (day)'):
+    """Totals of guilds, channels and users at the end of a day, never updated.
+
+    A row is written only when the totals changed since the previous one,
+    the guild row every day.
+    """
+    guild_id = Column(Integer(big=True), primary_key=True)
+    # 0 - guild, 1 - channel, 2 - user
+    scope = Column(Integer(small=True), primary_key=True)
+    scope_id = Column(Integer(big=True), primary_key=True)
+    day = Column(Date, primary_key=True)
+    messages = Column(Integer(big=True), default=0)
+    minutes = Column(Integer(big=True), default=0)
+    joins = Column(Integer(big=True), default=0)
+    removes = Column(Integer(big=True), default=0)
+
+
+class ActivitySketches(Table, table_name='activity_sketches'):
+    """HyperLogLog registers of distinct active users of a local day"""
+    guild_id = Column(Integer(big=True), primary_key=True)
+    # 0 - guild, 1 - channel
+    scope = Column(Integer(small=True), primary_key=True)
+    scope_id = Column(Integer(big=True), primary_key=True)
+    # 0 - chat, 1 - voice
+    kind = Column(Integer(small=True), primary_key=True)
+    day = Column(Date, primary_key=True)
+    registers = Column(Binary)
+
+
 async def create_all_tables():
     await Table().create_pool(user=bot.settings.POSTGRES_USER,
                               password=bot.settings.POSTGRES_PASS,
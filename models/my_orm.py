@@ -1,11 +1,19 @@
 import asyncio
+import copy
 import datetime
 import decimal
 import inspect
+import itertools
+import json
+import logging
 import pydoc
+import time
 from collections import OrderedDict
 import asyncpg
 import bot.settings
+from .instrumentation import metrics
+
+log = logging.getLogger('orm')
 
 
 class SchemaError(Exception):
@@ -40,11 +48,19 @@ class SQLType:
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __repr__(self):
+        values = ', '.join(f'{key}={value!r}' for key, value in sorted(self.__dict__.items()))
+        return f'{self.__class__.__name__}({values})'
+
     def to_sql(self):
         raise NotImplementedError()
 
-    # def is_real_type(self):
-    #     return True
+    def base_sql(self):
+        """type without constraints, usable in ALTER COLUMN ... TYPE"""
+        return self.to_sql()
+
+    def is_real_type(self):
+        return True
 
 
 class Binary(SQLType):
@@ -242,6 +258,9 @@ class ForeignKey(SQLType):
     def is_real_type(self):
         return False
 
+    def base_sql(self):
+        return self.sql_type
+
     def to_sql(self):
         fmt = '{0.sql_type} REFERENCES {0.table} ({0.column})' \
               ' ON DELETE {0.on_delete} ON UPDATE {0.on_update}'
@@ -271,8 +290,10 @@ class Array(SQLType):
 
 
 class Column:
-    __slots__ = ('column_type', 'index', 'primary_key', 'nullable',
-                 'default', 'unique', 'name', 'index_name')
+    # attributes stored in schema snapshots
+    _serialized = ('column_type', 'index', 'primary_key', 'nullable',
+                   'default', 'unique', 'name', 'index_name')
+    __slots__ = _serialized + ('table',)
 
     def __init__(self, column_type, *, index=False, primary_key=False,
                  nullable=True, unique=False, default=None, name=None):
@@ -291,6 +312,7 @@ class Column:
         self.default = default
         self.name = name
         self.index_name = None  # to be filled later
+        self.table = None  # to be filled later
 
         if sum(map(bool, (unique, primary_key, default is not None))) > 1:
             raise SchemaError("'unique', 'primary_key', and 'default' are mutually exclusive.")
@@ -306,12 +328,12 @@ class Column:
 
     @property
     def _comparable_id(self):
-        return '-'.join(f'{attr}:{getattr(self, attr)}' for attr in self.__slots__)
+        return '-'.join(f'{attr}:{getattr(self, attr)}' for attr in self._serialized)
 
     def _to_dict(self):
         d = {
             attr: getattr(self, attr)
-            for attr in self.__slots__
+            for attr in self._serialized
         }
         d['column_type'] = self.column_type.to_dict()
         return d
@@ -325,20 +347,59 @@ class Column:
 
         return self.unique == other.unique and self.primary_key == other.primary_key
 
+    # query expressions: Profiles.guild_id == x, Profiles.messages > 10, Profiles.user_id.in_([...])
+
+    __hash__ = object.__hash__
+
+    def __eq__(self, other):
+        return BinaryExpression(self, '=', other)
+
+    def __ne__(self, other):
+        return BinaryExpression(self, '<>', other)
+
+    def __lt__(self, other):
+        return BinaryExpression(self, '<', other)
+
+    def __le__(self, other):
+        return BinaryExpression(self, '<=', other)
+
+    def __gt__(self, other):
+        return BinaryExpression(self, '>', other)
+
+    def __ge__(self, other):
+        return BinaryExpression(self, '>=', other)
+
+    def in_(self, values):
+        return InExpression(self, list(values))
+
+    def between(self, low, high):
+        return (self >= low) & (self <= high)
+
+    def asc(self, *, nulls_last=False):
+        return Ordering(self, 'ASC', nulls_last)
+
+    def desc(self, *, nulls_last=False):
+        return Ordering(self, 'DESC', nulls_last)
+
+    def _sql(self) -> str:
+        return f'{self.table}.{self.name}' if self.table else self.name
+
+    def _default_sql(self) -> str:
+        default = self.default
+        if isinstance(default, str) and isinstance(self.column_type, String):
+            return f"'{default}'"
+        elif isinstance(default, bool):
+            return str(default).upper()
+        return f"({default})"
+
     def _create_table(self) -> str:
         builder = []
         builder.append(self.name)
         builder.append(self.column_type.to_sql())
 
-        default = self.default
-        if default is not None:
+        if self.default is not None:
             builder.append('DEFAULT')
-            if isinstance(default, str) and isinstance(self.column_type, String):
-                builder.append(f"'{default}'")
-            elif isinstance(default, bool):
-                builder.append(str(default).upper())
-            else:
-                builder.append(f"({default})")
+            builder.append(self._default_sql())
         elif self.unique:
             builder.append('UNIQUE')
         if not self.nullable:
@@ -354,23 +415,368 @@ class PrimaryKeyColumn(Column):
         super().__init__(Integer(auto_increment=True), primary_key=True)
 
 
+class Expression:
+    """Part of a WHERE clause, combined with ``&``, ``|`` and ``~``."""
+
+    def compile(self, args: list) -> str:
+        raise NotImplementedError()
+
+    def __and__(self, other):
+        return BooleanExpression('AND', self, other)
+
+    def __or__(self, other):
+        return BooleanExpression('OR', self, other)
+
+    def __invert__(self):
+        return NotExpression(self)
+
+    def __bool__(self):
+        raise TypeError('query expressions have no truth value, use & and | instead of "and" and "or"')
+
+
+class BinaryExpression(Expression):
+    def __init__(self, left, op, right):
+        self.left = left
+        self.op = op
+        self.right = right
+
+    def __bool__(self):
+        # keeps "column in columns" and list.remove(column) working
+        if isinstance(self.right, Column) and self.op in ('=', '<>'):
+            return (self.left is self.right) == (self.op == '=')
+        return super().__bool__()
+
+    def compile(self, args: list) -> str:
+        left = self.left._sql()
+        if isinstance(self.right, Column):
+            return f'{left} {self.op} {self.right._sql()}'
+        if self.right is None and self.op in ('=', '<>'):
+            return f'{left} IS {"" if self.op == "=" else "NOT "}NULL'
+        args.append(self.right)
+        return f'{left} {self.op} ${len(args)}'
+
+
+class InExpression(Expression):
+    def __init__(self, column, values):
+        self.column = column
+        self.values = values
+
+    def compile(self, args: list) -> str:
+        # one array parameter keeps the statement text the same for any list length
+        args.append(self.values)
+        return f'{self.column._sql()} = ANY(${len(args)})'
+
+
+class BooleanExpression(Expression):
+    def __init__(self, op, *parts):
+        self.op = op
+        self.parts = parts
+
+    def compile(self, args: list) -> str:
+        return '(' + f' {self.op} '.join(part.compile(args) for part in self.parts) + ')'
+
+
+class NotExpression(Expression):
+    def __init__(self, expression):
+        self.expression = expression
+
+    def compile(self, args: list) -> str:
+        return f'NOT {self.expression.compile(args)}'
+
+
+class Ordering:
+    def __init__(self, column, direction, nulls_last=False):
+        self.column = column
+        self.direction = direction
+        self.nulls_last = nulls_last
+
+    def compile(self) -> str:
+        sql = f'{self.column._sql()} {self.direction}'
+        if self.nulls_last:
+            sql += ' NULLS LAST'
+        return sql
+
+
+class Select:
+    """SELECT composed from column expressions, every call returns a new query.
+
+        await Profiles.select(Profiles.user_id, Profiles.messages)
+            .where(Profiles.guild_id == guild.id, Profiles.messages > 10)
+            .order_by(Profiles.messages.desc(), Profiles.user_id)
+            .limit(10).fetch()
+
+    Without columns the rows come as ``table.record_class``, otherwise as asyncpg Records.
+    """
+
+    def __init__(self, table, columns=()):
+        self.table = table
+        self.columns = tuple(columns)
+        self._where = ()
+        self._order_by = ()
+        self._limit = None
+        self._offset = None
+
+    def _clone(self, **changes):
+        query = copy.copy(self)
+        for key, value in changes.items():
+            setattr(query, key, value)
+        return query
+
+    def where(self, *expressions):
+        return self._clone(_where=self._where + expressions)
+
+    def order_by(self, *orderings):
+        orderings = tuple(o if isinstance(o, Ordering) else o.asc() for o in orderings)
+        return self._clone(_order_by=self._order_by + orderings)
+
+    def limit(self, limit: int):
+        return self._clone(_limit=limit)
+
+    def offset(self, offset: int):
+        return self._clone(_offset=offset)
+
+    def compile(self, *, count=False):
+        """return sql with $n placeholders and its arguments"""
+
+        args = []
+        if count:
+            columns = 'COUNT(*)'
+        elif self.columns:
+            columns = ', '.join(column._sql() for column in self.columns)
+        else:
+            columns = self.table._select_columns()
+
+        sql = f'SELECT {columns} FROM {self.table.__tablename__}'
+        if self._where:
+            sql += ' WHERE ' + ' AND '.join(expression.compile(args) for expression in self._where)
+        if count:
+            return sql, args
+
+        if self._order_by:
+            sql += ' ORDER BY ' + ', '.join(ordering.compile() for ordering in self._order_by)
+        if self._limit is not None:
+            args.append(self._limit)
+            sql += f' LIMIT ${len(args)}'
+        if self._offset is not None:
+            args.append(self._offset)
+            sql += f' OFFSET ${len(args)}'
+        return sql, args
+
+    @property
+    def _key(self):
+        return self.table.__tablename__, 'select'
+
+    async def fetch(self, connection=None, *, raw=False) -> list:
+        sql, args = self.compile()
+        async with MaybeAcquire(connection, pool=self.table._pool, key=self._key) as con:
+            with metrics.timed(self._key, sql) as timer:
+                rows = await con.fetch(sql, *args)
+                timer.rows = len(rows)
+        if raw or self.columns:
+            return rows
+        record_class = self.table.record_class
+        return [record_class(row) for row in rows]
+
+    async def fetchrow(self, connection=None, *, raw=False):
+        sql, args = self.limit(1).compile()
+        async with MaybeAcquire(connection, pool=self.table._pool, key=self._key) as con:
+            with metrics.timed(self._key, sql) as timer:
+                row = await con.fetchrow(sql, *args)
+                timer.rows = int(row is not None)
+        if row is None or raw or self.columns:
+            return row
+        return self.table.record_class(row)
+
+    async def fetchval(self, connection=None):
+        sql, args = self.limit(1).compile()
+        async with MaybeAcquire(connection, pool=self.table._pool, key=self._key) as con:
+            with metrics.timed(self._key, sql) as timer:
+                value = await con.fetchval(sql, *args)
+                timer.rows = int(value is not None)
+                return value
+
+    async def iterate(self, connection=None, *, batch_size=500, batches=False, raw=False):
+        """Async generator over a server-side cursor, memory holds one batch at most.
+
+            async for profile in Profiles.select().where(Profiles.guild_id == guild.id).iterate():
+                ...
+
+        ``batches=True`` yields lists of ``batch_size`` rows instead of single rows.
+        """
+
+        sql, args = self.compile()
+        record_class = None if raw or self.columns else self.table.record_class
+        key = (self.table.__tablename__, 'iterate')
+        async with MaybeAcquire(connection, pool=self.table._pool, key=key) as con:
+            async with con.transaction():
+                cursor = await con.cursor(sql, *args)
+                while True:
+                    with metrics.timed(key, sql) as timer:
+                        rows = await cursor.fetch(batch_size)
+                        timer.rows = len(rows)
+                    if not rows:
+                        break
+                    if record_class is not None:
+                        rows = [record_class(row) for row in rows]
+                    if batches:
+                        yield rows
+                    else:
+                        for row in rows:
+                            yield row
+
+    async def count(self, connection=None) -> int:
+        sql, args = self.compile(count=True)
+        key = (self.table.__tablename__, 'count')
+        async with MaybeAcquire(connection, pool=self.table._pool, key=key) as con:
+            with metrics.timed(key, sql) as timer:
+                timer.rows = 1
+                return await con.fetchval(sql, *args)
+
+
+class Batch:
+    """Unit of work holding one connection and one transaction.
+
+        async with Table.batch() as b:
+            b.insert(Profiles, user_id=..., guild_id=..., on_conflict='ignore')
+            b.update(Guilds, guild_id=..., increments={'joins': 1})
+
+    Writes are queued and sent on exit (or on ``flush()``) in their order,
+    runs of the same statement go as one ``executemany``. Reads use
+    ``b.connection`` and do not see queued writes until ``flush()``.
+    Any exception rolls everything back.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.connection = None
+        self._acquire = MaybeAcquire(None, pool=pool, key=('batch', 'transaction'))
+        self._transaction = None
+        self._queue = []
+        # update listeners run only after commit
+        self._updates = []
+
+    async def __aenter__(self):
+        self.connection = await self._acquire.__aenter__()
+        try:
+            self._transaction = self.connection.transaction()
+            await self._transaction.start()
+        except Exception:
+            await self._acquire.__aexit__()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                try:
+                    await self.flush()
+                except Exception:
+                    await self._transaction.rollback()
+                    raise
+                await self._transaction.commit()
+                for table, filters, values, increments in self._updates:
+                    table._notify_update(filters, values, increments)
+            else:
+                await self._transaction.rollback()
+        finally:
+            self._queue.clear()
+            self._updates.clear()
+            await self._acquire.__aexit__()
+
+    def insert(self, table, *, on_conflict=None, conflict_target=None, **kwargs) -> None:
+        self._queue.append(table._compile_insert(kwargs, on_conflict, conflict_target))
+
+    def update(self, table, *, values=None, increments=None, **kwargs) -> None:
+        self._queue.append(table._compile_update(kwargs, values, increments))
+        if table._update_listeners:
+            self._updates.append((table, table._filter_columns(kwargs), values, increments))
+
+    def delete(self, table, **kwargs) -> None:
+        self._queue.append(table._compile_delete(kwargs))
+
+    async def flush(self) -> None:
+        """send queued statements, consecutive equal statements in one executemany"""
+
+        queue, self._queue = self._queue, []
+        for sql, group in itertools.groupby(queue, key=lambda item: item[0]):
+            args = [item[1] for item in group]
+            with metrics.timed(('batch', 'flush'), sql) as timer:
+                timer.rows = len(args)
+                if len(args) == 1:
+                    await self.connection.execute(sql, *args[0])
+                else:
+                    await self.connection.executemany(sql, args)
+
+
+SNAPSHOT_TABLE = 'schema_snapshots'
+SCHEMA_LOCK_ID = 704981
+
+
 class MaybeAcquire:
+    """Uses the given connection or acquires one from the pool.
+
+    Time waited for a pool connection goes to the ``key`` (table, operation) wait histogram.
+    """
 
-    def __init__(self, connection, *, pool):
+    def __init__(self, connection, *, pool, key=None):
         self.connection = connection
         self.pool = pool
+        self.key = key
         self._cleanup = False
 
     async def __aenter__(self):
         if self.connection is None:
+            metrics.acquire_started()
+            start = time.perf_counter()
+            acquired = False
+            try:
+                self._connection = c = await self.pool.acquire()
+                acquired = True
+            finally:
+                metrics.acquire_finished(self.key, time.perf_counter() - start, acquired)
             self._cleanup = True
-            self._connection = c = await self.pool.acquire()
             return c
         return self.connection
 
     async def __aexit__(self, *args):
         if self._cleanup:
-            await self.pool.release(self._connection)
+            self._cleanup = False
+            try:
+                await self.pool.release(self._connection)
+            finally:
+                metrics.released()
+
+
+class Record:
+    """Base of the slotted row classes generated for every table."""
+
+    __slots__ = ()
+
+    def __repr__(self):
+        values = ' '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'<{self.__class__.__name__} {values}>'
+
+    def __eq__(self, other):
+        if not isinstance(other, self.__class__):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    __hash__ = None
+
+
+def _make_record_class(table_name, names):
+    """generate a slotted class filled from a row of the table columns in order"""
+
+    if names:
+        body = f"    {', '.join(f'self.{name}' for name in names)}, = row"
+    else:
+        body = '    pass'
+    namespace = {}
+    exec(f'def __init__(self, row):\n{body}', namespace)
+    return type(f'{table_name}_obj', (Record,), {
+        '__slots__': tuple(names),
+        '__init__': namespace['__init__'],
+    })
 
 
 class TableMeta(type):
@@ -391,6 +797,7 @@ class TableMeta(type):
         for elem, value in dct.items():
             if isinstance(value, Column):
                 value.name = elem
+                value.table = table_name
 
                 if value.index:
                     value.index_name = f'{table_name}_{value.name}_idx'
@@ -398,6 +805,13 @@ class TableMeta(type):
                 columns.append(value)
 
         dct['columns'] = columns
+        dct['unique_together'] = tuple(tuple(names) for names in kwargs.get('unique', ()))
+        # new column name -> old one, migrations rename only what is listed here
+        dct['renamed'] = dict(kwargs.get('renamed', {}))
+        # e.g. 'RANGE (day)', partitions are created by the code which writes the table
+        dct['partition_by'] = kwargs.get('partition_by')
+        dct['record_class'] = _make_record_class(table_name, [column.name for column in columns])
+        dct['_update_listeners'] = []
         return super().__new__(cls, name, parents, dct)
 
     def __init__(self, name, parents, dct, **kwargs):
@@ -405,13 +819,18 @@ class TableMeta(type):
 
 
 class Table(metaclass=TableMeta):
+    # (table, operation, filter columns, set shape) -> sql with $n placeholders,
+    # the same text lets asyncpg reuse its prepared statement of a connection
+    _query_cache = {}
+
     @classmethod
     async def create_pool(cls, **kwargs):
         cls._pool = pool = await asyncpg.create_pool(**kwargs)
+        metrics.pool.size = kwargs.get('max_size', 10)
         return pool
 
     @classmethod
-    async def create_table(cls, *, exists_ok=True, connection=None):
+    def _create_table_sql(cls, *, exists_ok=True) -> str:
         statements = []
         builder = ['CREATE TABLE']
 
@@ -426,8 +845,13 @@ class Table(metaclass=TableMeta):
             if col.primary_key:
                 primary_keys.append(col.name)
 
-        column_creations.append(f'PRIMARY KEY ({", ".join(primary_keys)})')
+        if primary_keys:
+            column_creations.append(f'PRIMARY KEY ({", ".join(primary_keys)})')
+        for names in cls.unique_together:
+            column_creations.append(f'CONSTRAINT {cls._unique_name(names)} UNIQUE ({", ".join(names)})')
         builder.append(f'({", ".join(column_creations)})')
+        if cls.partition_by:
+            builder.append(f'PARTITION BY {cls.partition_by}')
         statements.append(' '.join(builder) + ';')
 
         # handle the index creations
@@ -436,22 +860,110 @@ class Table(metaclass=TableMeta):
                 fmt = f'CREATE INDEX IF NOT EXISTS {column.index_name} ON {cls.__tablename__} ({column.name});'
                 statements.append(fmt)
 
-        sql = '\n'.join(statements)
+        return '\n'.join(statements)
+
+    @classmethod
+    async def create_table(cls, *, exists_ok=True, connection=None):
+        sql = cls._create_table_sql(exists_ok=exists_ok)
 
-        async with MaybeAcquire(connection, pool=cls._pool) as con:
-            print(sql)
+        async with MaybeAcquire(connection, pool=cls._pool, key=(cls.__tablename__, 'create_table')) as con:
+            log.info(sql)
             await con.execute(sql)
 
     @classmethod
     async def drop_table(cls, *, connection=None):
-        async with MaybeAcquire(connection, pool=cls._pool) as con:
+        async with MaybeAcquire(connection, pool=cls._pool, key=(cls.__tablename__, 'drop_table')) as con:
             sql = f'DROP TABLE IF EXISTS {cls.__tablename__} CASCADE;'
-            print(sql)
+            log.info(sql)
             await con.execute(sql)
 
     @classmethod
-    async def insert(cls, connection=None, **kwargs):
-        """Inserts an element to the table."""
+    def _cached_query(cls, key, build) -> str:
+        """return sql of a query shape, compile it only on the first call"""
+
+        key = (cls.__tablename__,) + key
+        try:
+            return cls._query_cache[key]
+        except KeyError:
+            sql = cls._query_cache[key] = build()
+            return sql
+
+    @classmethod
+    def _filter_columns(cls, kwargs) -> OrderedDict:
+        """pick filter values of known columns in the column order"""
+
+        verified = OrderedDict()
+        for column in cls.columns:
+            try:
+                verified[column.name] = kwargs[column.name]
+            except KeyError:
+                continue
+        return verified
+
+    @classmethod
+    def _select_columns(cls) -> str:
+        """columns in the order of the record class slots"""
+        return ', '.join(f'{cls.__tablename__}.{column.name}' for column in cls.columns)
+
+    @staticmethod
+    def _where(names, start=1) -> str:
+        return ' and '.join(f'{name} = ${i}' for i, name in enumerate(names, start))
+
+    @staticmethod
+    def _conflict_clause(names, on_conflict, conflict_target) -> str:
+        """ON CONFLICT clause for inserted column names"""
+
+        if on_conflict is None:
+            return ''
+        if on_conflict not in ('ignore', 'update'):
+            raise ValueError(f'unknown on_conflict {on_conflict!r}')
+
+        target = f' ({", ".join(conflict_target)})' if conflict_target else ''
+        updates = [f'{name} = EXCLUDED.{name}' for name in names if name not in (conflict_target or ())]
+        if on_conflict == 'ignore' or not updates:
+            return f' ON CONFLICT{target} DO NOTHING'
+        if not conflict_target:
+            raise ValueError("on_conflict='update' needs a conflict_target")
+        return f' ON CONFLICT{target} DO UPDATE SET {", ".join(updates)}'
+
+    @classmethod
+    def add_update_listener(cls, listener) -> None:
+        """call ``listener(filters, values, increments)`` after every successful update of this table"""
+        cls._update_listeners.append(listener)
+
+    @classmethod
+    def remove_update_listener(cls, listener) -> None:
+        cls._update_listeners.remove(listener)
+
+    @classmethod
+    def _notify_update(cls, filters, values, increments) -> None:
+        for listener in cls._update_listeners:
+            try:
+                listener(dict(filters), dict(values or {}), dict(increments or {}))
+            except Exception as e:
+                log.error(f'{cls.__tablename__} update listener {listener} failed: {e}')
+
+    @classmethod
+    def batch(cls) -> Batch:
+        """unit of work on one connection, see ``Batch``"""
+        return Batch(cls._pool)
+
+    @classmethod
+    def select(cls, *columns) -> Select:
+        """query builder, see ``Select``"""
+        return Select(cls, columns)
+
+    @classmethod
+    def iterate(cls, *expressions, connection=None, batch_size=500, batches=False, raw=False, **kwargs):
+        """stream rows matching expressions and equality kwargs, see ``Select.iterate``"""
+
+        filters = tuple(getattr(cls, name) == value for name, value in cls._filter_columns(kwargs).items())
+        query = cls.select().where(*expressions, *filters)
+        return query.iterate(connection, batch_size=batch_size, batches=batches, raw=raw)
+
+    @classmethod
+    def _compile_insert(cls, kwargs, on_conflict=None, conflict_target=None, returning=None):
+        """return sql and arguments of an insert"""
 
         verified = {}
         for column in cls.columns:
@@ -468,139 +980,416 @@ class Table(metaclass=TableMeta):
             #     raise TypeError(fmt)
 
             verified[column.name] = value
-        tab_rows = ', '.join(verified)
-        tab_values = ', '.join(f'${str(i)}' for i, _ in enumerate(verified, 1))
-        sql = f"INSERT INTO {cls.__tablename__} ({tab_rows}) VALUES ({tab_values});"
 
-        async with MaybeAcquire(connection, pool=cls._pool) as con:
+        conflict_target = tuple(conflict_target) if conflict_target else None
+        if returning is not None and returning != '*':
+            returning = tuple(returning)
+
+        def build():
+            tab_rows = ', '.join(verified)
+            tab_values = ', '.join(f'${str(i)}' for i, _ in enumerate(verified, 1))
+            sql = f"INSERT INTO {cls.__tablename__} ({tab_rows}) VALUES ({tab_values})"
+            sql += cls._conflict_clause(verified, on_conflict, conflict_target)
+            if returning == '*':
+                sql += f" RETURNING {cls._select_columns()}"
+            elif returning:
+                sql += f" RETURNING {', '.join(returning)}"
+            return sql + ';'
+
+        sql = cls._cached_query(('insert', tuple(verified), on_conflict, conflict_target, returning), build)
+        return sql, list(verified.values())
+
+    @classmethod
+    async def insert(cls, connection=None, *, on_conflict=None, conflict_target=None, returning=None, **kwargs):
+        """Inserts an element to the table.
+
+        ``on_conflict='ignore'`` skips a duplicate, ``on_conflict='update'`` overwrites
+        the row found by ``conflict_target`` columns with the passed values.
+        ``returning='*'`` returns the row as ``cls.record_class``, a list of column names
+        returns an asyncpg Record, None is returned when a duplicate was skipped.
+        """
+
+        sql, args = cls._compile_insert(kwargs, on_conflict, conflict_target, returning)
+        key = (cls.__tablename__, 'insert')
+
+        async with MaybeAcquire(connection, pool=cls._pool, key=key) as con:
+            if returning:
+                with metrics.timed(key, sql) as timer:
+                    row = await con.fetchrow(sql, *args)
+                    timer.rows = int(row is not None)
+                if row is not None and returning == '*':
+                    return cls.record_class(row)
+                return row
+
             try:
-                # print(sql)
-                await con.execute(sql, *verified.values())
-                print(f"{verified} add in {cls.__tablename__}")
+                with metrics.timed(key, sql) as timer:
+                    status = await con.execute(sql, *args)
+                    timer.rows = int(status.split()[-1])
             except asyncpg.exceptions.UniqueViolationError:
-                print(f'уже есть в бд {verified}')
+                log.debug(f'уже есть в бд {cls.__tablename__} {dict(cls._filter_columns(kwargs))}')
 
     @classmethod
-    async def get(cls, connection=None, **kwargs):
-        """get an element to the table."""
-        verified = {}
-        joins_list = []
-        for column in cls.columns:
-            try:
-                value = kwargs[column.name]
-                if isinstance(column.column_type, ForeignKey):
-                    foreign_key = column.column_type.column
-                    table = column.column_type.table
-                    join_string = f' LEFT JOIN {table} ON {cls.__tablename__}.{foreign_key} = {table}.{foreign_key}'
-                    joins_list.append(join_string)
-                    verified[f'{table}.{column.name}'] = value
-                    continue
-            except KeyError:
-                continue
-            verified[column.name] = value
-        
-        where = ' and '.join(f"{key}={value}" for key, value in verified.items())
-        joins = ' '.join(joins_list)
-        sql = f"SELECT * FROM {cls.__tablename__} {joins} where {where}"
-        async with MaybeAcquire(connection, pool=cls._pool) as con:
+    async def insert_many(cls, rows, *, on_conflict=None, conflict_target=None, connection=None) -> int:
+        """Inserts many elements to the table in a few round trips.
+
+        ``rows`` are dicts with the same keys. Without ``on_conflict`` they are sent
+        with COPY, otherwise they are copied in a temp table and moved by one
+        ``INSERT ... SELECT ... ON CONFLICT``, see ``insert`` for the modes.
+        Returns a number of inserted rows.
+        """
+
+        rows = list(rows)
+        if not rows:
+            return 0
+        conflict_target = tuple(conflict_target) if conflict_target else None
+
+        names = tuple(column.name for column in cls.columns if column.name in rows[0])
+        records = [tuple(row[name] for name in names) for row in rows]
+
+        key = (cls.__tablename__, 'insert_many')
+        async with MaybeAcquire(connection, pool=cls._pool, key=key) as con:
+            if on_conflict is None:
+                with metrics.timed(key, f'COPY {cls.__tablename__} ({", ".join(names)})') as timer:
+                    await con.copy_records_to_table(cls.__tablename__, records=records, columns=names)
+                    timer.rows = len(records)
+                return len(records)
+
+            tmp_name = f'tmp_{cls.__tablename__}'
+            create_sql = cls._cached_query(
+                ('insert_many_tmp', names),
+                lambda: f"CREATE TEMP TABLE {tmp_name} AS SELECT {', '.join(names)} "
+                        f"FROM {cls.__tablename__} WITH NO DATA;"
+            )
+            insert_sql = cls._cached_query(
+                ('insert_many', names, on_conflict, conflict_target),
+                lambda: f"INSERT INTO {cls.__tablename__} ({', '.join(names)}) "
+                        f"SELECT {', '.join(names)} FROM {tmp_name}"
+                        f"{cls._conflict_clause(names, on_conflict, conflict_target)};"
+            )
+            with metrics.timed(key, insert_sql) as timer:
+                async with con.transaction():
+                    await con.execute(create_sql)
+                    await con.copy_records_to_table(tmp_name, records=records, columns=names)
+                    status = await con.execute(insert_sql)
+                    await con.execute(f'DROP TABLE {tmp_name};')
+                timer.rows = inserted = int(status.split()[-1])
+
+        return inserted
+
+    @classmethod
+    async def get(cls, connection=None, raw=False, **kwargs):
+        """get an element to the table.
+
+        The row comes as ``cls.record_class``, ``raw=True`` returns the asyncpg Record as is.
+        """
+        verified = cls._filter_columns(kwargs)
+
+        sql = cls._cached_query(
+            ('get', tuple(verified)),
+            lambda: f"SELECT {cls._select_columns()} FROM {cls.__tablename__} where {cls._where(verified)} LIMIT 1"
+        )
+        fetch_result = None
+        key = (cls.__tablename__, 'get')
+        async with MaybeAcquire(connection, pool=cls._pool, key=key) as con:
             try:
-                print(sql)
-                fetch_result = await con.fetchrow(sql)
+                with metrics.timed(key, sql) as timer:
+                    fetch_result = await con.fetchrow(sql, *verified.values())
+                    timer.rows = int(fetch_result is not None)
             except Exception as e:
-                print(e)
+                log.error(f'{cls.__tablename__} get failed: {e}')
         if fetch_result:
-            obj = type(f'{cls.__tablename__}_obj', tuple(cls.mro()), dict(fetch_result))
-            return obj()
+            return fetch_result if raw else cls.record_class(fetch_result)
         else:
-            print('записи нет в бд')
+            log.debug(f'записи нет в бд {cls.__tablename__} {dict(verified)}')
 
     @classmethod
-    async def get_many(cls, connection=None, ordered_by=None, limit=None, desc=False, **kwargs) -> list:
-        """get an elements to the table."""
+    async def get_many(cls, connection=None, ordered_by=None, limit=None, desc=False, raw=False, **kwargs) -> list:
+        """get an elements to the table.
+
+        Rows come as ``cls.record_class``, ``raw=True`` returns the asyncpg Records for bulk readers.
+        """
+
+        names = [i.name for i in cls.columns]
+        for key in kwargs:
+            if key not in names:
+                raise Exception('такой строки нет у модели')
+        verified = cls._filter_columns(kwargs)
+        args = list(verified.values())
+        if limit:
+            args.append(limit)
+
+        def build():
+            sql = f"SELECT {cls._select_columns()} FROM {cls.__tablename__}"
+            if verified:
+                sql += f" where {cls._where(verified)} "
+            if ordered_by:
+                arg = 'ASC' if not desc else 'DESC'
+                sql += f" ORDER BY {ordered_by.name} {arg} "
+            if limit:
+                sql += f" LIMIT ${len(args)} "
+            return sql
+
+        order_key = (ordered_by.name, desc) if ordered_by else None
+        sql = cls._cached_query(('get_many', tuple(verified), order_key, bool(limit)), build)
+
+        key = (cls.__tablename__, 'get_many')
+        async with MaybeAcquire(connection, pool=cls._pool, key=key) as con:
+            with metrics.timed(key, sql) as timer:
+                fetch_result = await con.fetch(sql, *args)
+                timer.rows = len(fetch_result)
+        if fetch_result:
+            if raw:
+                return fetch_result
+            record_class = cls.record_class
+            return [record_class(row) for row in fetch_result]
+        else:
+            log.debug(f'записи нет в бд {cls.__tablename__} {dict(verified)}')
 
-        sql = f"SELECT * FROM {cls.__tablename__}"
+    @classmethod
+    def _compile_update(cls, kwargs, values=None, increments=None, set=None):
+        """return sql and arguments of an update"""
 
-        if kwargs:
-            par = []
-            for key, value in kwargs.items():
-                if key not in [i.name for i in cls.columns]:
-                    raise Exception('такой строки нет у модели')
-                if type(value) is str:
-                    value = f"'{value}'"
-                par.append(f"{key}={value}")
+        values = values or {}
+        increments = increments or {}
+        raw = tuple(set or ())
+        verified = cls._filter_columns(kwargs)
+        args = [*values.values(), *increments.values(), *verified.values()]
 
-            params = ' and '.join(par)
-            sql += f" where {params} "
-        if ordered_by:
-            arg = 'ASC' if not desc else 'DESC'
-            sql += f" ORDER BY {ordered_by.name} {arg} "
-        if limit:
-            sql += f" LIMIT {limit} "
+        def build():
+            sets = [f'{name} = ${i}' for i, name in enumerate(values, 1)]
+            sets.extend(f'{name} = COALESCE({name}, 0) + ${i}' for i, name in enumerate(increments, len(sets) + 1))
+            sets.extend(raw)
+            where = cls._where(verified, len(values) + len(increments) + 1)
+            return f"UPDATE {cls.__tablename__} SET {', '.join(sets)} WHERE {where};"
 
-        async with MaybeAcquire(connection, pool=cls._pool) as con:
-            print(sql)
-            fetch_result = await con.fetch(sql)
-        if fetch_result:
-            objects = []
-            for row in fetch_result:
-                obj = type(f'{cls.__tablename__}_obj', tuple(cls.mro()), dict(row))
-                objects.append(obj())
-            return objects
-        else:
-            print('записи нет в бд')
+        sql = cls._cached_query(('update', tuple(verified), tuple(values), tuple(increments), raw), build)
+        return sql, args
 
     @classmethod
-    async def update(cls, connection=None, **kwargs):
-        """update an element to the table."""
+    async def update(cls, connection=None, *, values=None, increments=None, set=None, **kwargs):
+        """update an element to the table.
 
-        verified = {}
-        for column in cls.columns:
-            try:
-                check = column.column_type.python
-                if check is str:
-                    value = f"'{kwargs[column.name]}'"
-                else:
-                    value = kwargs[column.name]
-            except KeyError:
-                continue
-            verified[column.name] = value
+        ``values`` assigns columns, ``increments`` adds to them: ``increments={'messages': 1}``.
+        ``set`` takes raw sql assignments, it is left for a hand written sql only.
+        """
 
-        tab_name = cls.__tablename__
-        sets = ', '.join(kwargs['set'])
-        where = ' and '.join(f"{key}={value}" for key, value in verified.items())
-        sql = f"UPDATE {tab_name} SET {sets} WHERE {where};"
+        sql, args = cls._compile_update(kwargs, values, increments, set)
+        key = (cls.__tablename__, 'update')
 
-        async with MaybeAcquire(connection, pool=cls._pool) as con:
+        async with MaybeAcquire(connection, pool=cls._pool, key=key) as con:
             try:
-                print(sql)
-                await con.execute(sql)
+                with metrics.timed(key, sql) as timer:
+                    status = await con.execute(sql, *args)
+                    timer.rows = int(status.split()[-1])
             except asyncpg.exceptions.UniqueViolationError:
-                print(f'UniqueViolationError')
+                log.warning(f'UniqueViolationError {sql}')
+                return
+
+        if cls._update_listeners:
+            cls._notify_update(cls._filter_columns(kwargs), values, increments)
+
+    @classmethod
+    def _compile_delete(cls, kwargs):
+        """return sql and arguments of a delete"""
+
+        verified = cls._filter_columns(kwargs)
+        sql = cls._cached_query(
+            ('delete', tuple(verified)),
+            lambda: f"DELETE FROM {cls.__tablename__} WHERE {cls._where(verified)};"
+        )
+        return sql, list(verified.values())
 
     @classmethod
     async def delete_(cls, connection=None, **kwargs):
         """delete an element to the table."""
-        verified = {}
-        for column in cls.columns:
-            try:
-                if column.column_type.python is str:
-                    value = f"'{kwargs[column.name]}'"
-                else:
-                    value = kwargs[column.name]
-            except KeyError:
-                continue
-            verified[column.name] = value
 
-        tab_name = cls.__tablename__
-        where = ' and '.join(f"{key}={value}" for key, value in verified.items())
-        sql = f"DELETE FROM {tab_name} WHERE {where};"
+        sql, args = cls._compile_delete(kwargs)
+        key = (cls.__tablename__, 'delete')
 
-        async with MaybeAcquire(connection, pool=cls._pool) as con:
+        async with MaybeAcquire(connection, pool=cls._pool, key=key) as con:
             try:
-                await con.execute(sql)
-                print(f"delete {where} from {tab_name}")
+                with metrics.timed(key, sql) as timer:
+                    status = await con.execute(sql, *args)
+                    timer.rows = int(status.split()[-1])
             except asyncpg.exceptions.UniqueViolationError:
-                print(f'UniqueViolationError')
+                log.warning(f'UniqueViolationError {sql}')
+
+    @classmethod
+    def _unique_name(cls, names) -> str:
+        return f'{cls.__tablename__}_{"_".join(names)}_key'
+
+    @classmethod
+    def _snapshot(cls) -> dict:
+        """serializable schema of the table, stored after a migration"""
+        return {
+            'columns': [column._to_dict() for column in cls.columns],
+            'unique': [list(names) for names in cls.unique_together],
+        }
+
+    @classmethod
+    def _alter_column_sql(cls, old, new) -> list:
+        """statements changing a column of the same name from the old definition"""
+
+        table = cls.__tablename__
+        name = new.name
+        statements = []
+
+        if old.primary_key != new.primary_key:
+            raise SchemaError(f'cannot migrate primary key of {table}.{name}, write a migration by hand')
+
+        if old.column_type != new.column_type:
+            old_type, new_type = old.column_type, new.column_type
+            auto_increment = any(getattr(t, 'auto_increment', False) for t in (old_type, new_type))
+            if auto_increment and type(old_type) is type(new_type) is Integer:
+                if old_type.auto_increment != new_type.auto_increment:
+                    raise SchemaError(f'cannot migrate auto increment of {table}.{name}')
+
+            if isinstance(old_type, ForeignKey):
+                statements.append(f'ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_{name}_fkey;')
+            if old_type.base_sql() != new_type.base_sql():
+                base = new_type.base_sql()
+                if auto_increment:
+                    base = {'SERIAL': 'INTEGER', 'BIGSERIAL': 'BIGINT', 'SMALLSERIAL': 'SMALLINT'}[base]
+                statements.append(f'ALTER TABLE {table} ALTER COLUMN {name} TYPE {base} USING {name}::{base};')
+            if isinstance(new_type, ForeignKey):
+                statements.append(
+                    f'ALTER TABLE {table} ADD CONSTRAINT {table}_{name}_fkey FOREIGN KEY ({name}) '
+                    f'REFERENCES {new_type.table} ({new_type.column}) '
+                    f'ON DELETE {new_type.on_delete} ON UPDATE {new_type.on_update};'
+                )
+
+        if old.default != new.default:
+            if new.default is None:
+                statements.append(f'ALTER TABLE {table} ALTER COLUMN {name} DROP DEFAULT;')
+            else:
+                statements.append(f'ALTER TABLE {table} ALTER COLUMN {name} SET DEFAULT {new._default_sql()};')
+
+        if old.nullable != new.nullable:
+            action = 'DROP' if new.nullable else 'SET'
+            statements.append(f'ALTER TABLE {table} ALTER COLUMN {name} {action} NOT NULL;')
+
+        if old.unique != new.unique:
+            if new.unique:
+                statements.append(f'ALTER TABLE {table} ADD CONSTRAINT {table}_{name}_key UNIQUE ({name});')
+            else:
+                statements.append(f'ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_{name}_key;')
+
+        if old.index != new.index:
+            if new.index:
+                statements.append(f'CREATE INDEX IF NOT EXISTS {new.index_name} ON {table} ({name});')
+            else:
+                statements.append(f'DROP INDEX IF EXISTS {old.index_name};')
+
+        return statements
+
+    @classmethod
+    def _migration_sql(cls, snapshot) -> list:
+        """statements bringing the table from the stored snapshot to the current definition"""
+
+        table = cls.__tablename__
+        if snapshot is None:
+            return [cls._create_table_sql()]
+
+        old_columns = [Column.from_dict(data) for data in snapshot['columns']]
+        old_ids = {column._comparable_id for column in old_columns}
+        new_ids = {column._comparable_id for column in cls.columns}
+
+        removed = [column for column in old_columns if column._comparable_id not in new_ids]
+        added = [column for column in cls.columns if column._comparable_id not in old_ids]
+        removed_by_name = {column.name: column for column in removed}
+
+        statements = []
+        for column in list(added):
+            old = removed_by_name.pop(column.name, None)
+            if old is not None:
+                statements.extend(cls._alter_column_sql(old, column))
+                added.remove(column)
+
+        for column in list(added):
+            old = removed_by_name.pop(cls.renamed.get(column.name), None)
+            if old is None:
+                continue
+            statements.append(f'ALTER TABLE {table} RENAME COLUMN {old.name} TO {column.name};')
+            if old.index:
+                statements.append(f'DROP INDEX IF EXISTS {old.index_name};')
+            if column.index:
+                statements.append(f'CREATE INDEX IF NOT EXISTS {column.index_name} ON {table} ({column.name});')
+            old.name = column.name
+            statements.extend(cls._alter_column_sql(old, column))
+            added.remove(column)
+
+        # a column which is not listed in ``renamed`` is dropped and the new one added
+        for column in removed_by_name.values():
+            statements.append(f'ALTER TABLE {table} DROP COLUMN IF EXISTS {column.name};')
+
+        for column in added:
+            if column.primary_key:
+                raise SchemaError(f'cannot add primary key column {table}.{column.name}, write a migration by hand')
+            statements.append(f'ALTER TABLE {table} ADD COLUMN {column._create_table()};')
+            if column.index:
+                statements.append(f'CREATE INDEX IF NOT EXISTS {column.index_name} ON {table} ({column.name});')
+
+        old_unique = {tuple(names) for names in snapshot.get('unique', [])}
+        new_unique = set(cls.unique_together)
+        for names in old_unique - new_unique:
+            statements.append(f'ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {cls._unique_name(names)};')
+        for names in cls.unique_together:
+            if names not in old_unique:
+                # rows written while nothing was unique, the oldest one of each group is kept
+                matches = ' AND '.join(f'a.{name} IS NOT DISTINCT FROM b.{name}' for name in names)
+                statements.append(f'DELETE FROM {table} AS a USING {table} AS b WHERE a.ctid > b.ctid AND {matches};')
+                statements.append(
+                    f'ALTER TABLE {table} ADD CONSTRAINT {cls._unique_name(names)} UNIQUE ({", ".join(names)});'
+                )
+
+        return statements
+
+    @classmethod
+    async def migrate_all_tables(cls, *, connection=None):
+        """Brings the database to the current Table subclasses.
+
+        The schema of every table is stored in ``schema_snapshots`` after a migration,
+        an unchanged table costs a comparison only. A database without snapshots
+        was recreated on every startup before, so it is recreated one last time.
+        """
+
+        async with MaybeAcquire(connection, pool=cls._pool, key=('schema', 'migrate')) as con:
+            async with con.transaction():
+                await con.execute('SELECT pg_advisory_xact_lock($1);', SCHEMA_LOCK_ID)
+                first_run = await con.fetchval('SELECT to_regclass($1) IS NULL;', SNAPSHOT_TABLE)
+                await con.execute(
+                    f'CREATE TABLE IF NOT EXISTS {SNAPSHOT_TABLE} '
+                    f'(table_name TEXT PRIMARY KEY, snapshot JSONB NOT NULL, applied_at TIMESTAMP NOT NULL);'
+                )
+
+                if first_run:
+                    for tab in reversed(cls.__subclasses__()):
+                        await tab.drop_table(connection=con)
+                    snapshots = {}
+                else:
+                    rows = await con.fetch(f'SELECT table_name, snapshot FROM {SNAPSHOT_TABLE};')
+                    snapshots = {row['table_name']: json.loads(row['snapshot']) for row in rows}
+
+                for tab in cls.__subclasses__():
+                    current = tab._snapshot()
+                    stored = snapshots.pop(tab.__tablename__, None)
+                    if stored is not None and json.dumps(stored, sort_keys=True) == json.dumps(current, sort_keys=True):
+                        continue
+
+                    for sql in tab._migration_sql(stored):
+                        log.info(sql)
+                        await con.execute(sql)
+
+                    await con.execute(
+                        f'INSERT INTO {SNAPSHOT_TABLE} (table_name, snapshot, applied_at) VALUES ($1, $2::jsonb, $3) '
+                        f'ON CONFLICT (table_name) DO UPDATE SET snapshot = EXCLUDED.snapshot, '
+                        f'applied_at = EXCLUDED.applied_at;',
+                        tab.__tablename__, json.dumps(current), datetime.datetime.utcnow()
+                    )
+
+                for table_name in snapshots:
+                    log.warning(f'table {table_name} has no model anymore, its data is left as is')
+                    await con.execute(f'DELETE FROM {SNAPSHOT_TABLE} WHERE table_name = $1;', table_name)
 
     @classmethod
     async def create_all_tables(cls):
@@ -635,7 +1424,7 @@ class Table(metaclass=TableMeta):
 #     for i in range(1, 33):
 #         await Mem.insert(id=i, num=i+i*2, pk=i, name=f'{"n"*i}')
 #     new_name = 'syka'
-#     await Mem.update(id=22, pk=22, set=['num=num+1', f"name='{new_name}'"])
+#     await Mem.update(id=22, pk=22, increments={'num': 1}, values={'name': new_name})
 #
 #     objs = await Mem.get_many(ordered_by=Mem.id)
 #     print(objs)
@@ -0,0 +1,344 @@
+import datetime
+import json
+import typing as t
+
+from .instrumentation import metrics
+from .my_orm import SCHEMA_LOCK_ID, MaybeAcquire, Table
+
+# the latest snapshot of a scope row up to a day, joined LATERAL to the current totals
+_LAST_SNAPSHOT = """
+    SELECT messages, minutes, joins, removes FROM daily_stats AS d
+    WHERE d.guild_id = $1 AND d.scope = {scope} AND d.scope_id = {scope_id} AND d.day <= {day}
+    ORDER BY d.day DESC LIMIT 1
+"""
+
+DAY_REPORT_SQL = f"""
+WITH guild AS (
+    SELECT COALESCE(g.joins, 0) - COALESCE(l.joins, 0) AS joins,
+           COALESCE(g.removes, 0) - COALESCE(l.removes, 0) AS removes
+    FROM guilds AS g
+    LEFT JOIN LATERAL ({_LAST_SNAPSHOT.format(scope=0, scope_id='g.guild_id', day='$4')}) AS l ON true
+    WHERE g.guild_id = $1
+), profiles AS (
+    SELECT * FROM (
+        SELECT p.user_id,
+               COALESCE(p.minutes, 0) - COALESCE(l.minutes, 0) AS day_minutes,
+               COALESCE(p.messages, 0) - COALESCE(l.messages, 0) AS day_messages,
+               p.joined_at >= $2 AS is_new
+        FROM user_profiles AS p
+        LEFT JOIN LATERAL ({_LAST_SNAPSHOT.format(scope=2, scope_id='p.user_id', day='$4')}) AS l ON true
+        WHERE p.guild_id = $1
+    ) AS d WHERE day_minutes > 0 OR day_messages > 0
+), channels AS (
+    SELECT * FROM (
+        SELECT c.channel_id, c.type_channel, c.name_after_delete,
+               COALESCE(c.all_statistic, 0)
+               - COALESCE(CASE WHEN c.type_channel = 'voice' THEN l.minutes ELSE l.messages END, 0) AS day_statistic
+        FROM channels AS c
+        LEFT JOIN LATERAL ({_LAST_SNAPSHOT.format(scope=1, scope_id='c.channel_id', day='$4')}) AS l ON true
+        WHERE c.guild_id = $1
+    ) AS d WHERE day_statistic > 0
+)
+SELECT
+    (SELECT joins FROM guild) AS joins,
+    (SELECT removes FROM guild) AS removes,
+    (SELECT json_build_array(user_id, day_minutes) FROM profiles
+     WHERE is_new AND day_minutes > 0 ORDER BY day_minutes DESC LIMIT 1) AS best_new_voice,
+    (SELECT json_build_array(user_id, day_messages) FROM profiles
+     WHERE is_new AND day_messages > 0 ORDER BY day_messages DESC LIMIT 1) AS best_new_chat,
+    (SELECT count(*) FROM profiles WHERE day_minutes > 0) AS voice_users,
+    (SELECT count(*) FROM profiles WHERE day_messages > 0) AS chat_users,
+    (SELECT COALESCE(sum(day_statistic), 0) FROM channels WHERE type_channel = 'voice') AS total_minutes,
+    (SELECT COALESCE(sum(day_statistic), 0) FROM channels WHERE type_channel = 'text') AS total_messages,
+    (SELECT json_agg(json_build_array(user_id, day_minutes)) FROM (
+        SELECT user_id, day_minutes FROM profiles WHERE day_minutes > 0
+        ORDER BY day_minutes DESC LIMIT $3) AS top) AS top_voice_users,
+    (SELECT json_agg(json_build_array(user_id, day_messages)) FROM (
+        SELECT user_id, day_messages FROM profiles WHERE day_messages > 0
+        ORDER BY day_messages DESC LIMIT $3) AS top) AS top_chat_users,
+    (SELECT json_agg(json_build_array(channel_id, day_statistic, name_after_delete)) FROM (
+        SELECT * FROM channels WHERE type_channel = 'voice'
+        ORDER BY day_statistic DESC LIMIT $3) AS top) AS top_voice_channels,
+    (SELECT json_agg(json_build_array(channel_id, day_statistic, name_after_delete)) FROM (
+        SELECT * FROM channels WHERE type_channel = 'text'
+        ORDER BY day_statistic DESC LIMIT $3) AS top) AS top_text_channels
+"""
+
+USER_DAY_SQL = f"""
+SELECT COALESCE(p.messages, 0) - COALESCE(l.messages, 0), COALESCE(p.minutes, 0) - COALESCE(l.minutes, 0)
+FROM user_profiles AS p
+LEFT JOIN LATERAL ({_LAST_SNAPSHOT.format(scope=2, scope_id='p.user_id', day='$3')}) AS l ON true
+WHERE p.guild_id = $1 AND p.user_id = $2
+"""
+
+# totals of a guild, its channels and users at the end of the day $2, a row of a channel or a user
+# only when it differs from its latest snapshot; the snapshot of a day is written once
+SNAPSHOT_SQL = """
+INSERT INTO daily_stats (guild_id, scope, scope_id, day, messages, minutes, joins, removes)
+SELECT $1, t.scope, t.scope_id, $2, t.messages, t.minutes, t.joins, t.removes
+FROM (
+    SELECT 0::smallint AS scope, guild_id AS scope_id, 0::bigint AS messages, 0::bigint AS minutes,
+           COALESCE(joins, 0)::bigint AS joins, COALESCE(removes, 0)::bigint AS removes
+    FROM guilds WHERE guild_id = $1
+    UNION ALL
+    SELECT 1, channel_id,
+           CASE WHEN type_channel = 'voice' THEN 0 ELSE COALESCE(all_statistic, 0) END,
+           CASE WHEN type_channel = 'voice' THEN COALESCE(all_statistic, 0) ELSE 0 END, 0, 0
+    FROM channels WHERE guild_id = $1
+    UNION ALL
+    SELECT 2, user_id, COALESCE(messages, 0), COALESCE(minutes, 0), COALESCE(joins, 0), 0
+    FROM user_profiles WHERE guild_id = $1
+) AS t
+LEFT JOIN LATERAL (
+    SELECT messages, minutes, joins, removes FROM daily_stats AS d
+    WHERE d.guild_id = $1 AND d.scope = t.scope AND d.scope_id = t.scope_id AND d.day < $2
+    ORDER BY d.day DESC LIMIT 1
+) AS l ON true
+WHERE t.scope = 0
+   OR (t.messages, t.minutes, t.joins, t.removes) IS DISTINCT FROM (l.messages, l.minutes, l.joins, l.removes)
+ON CONFLICT (guild_id, scope, scope_id, day) DO NOTHING
+"""
+
+# differences of the latest snapshots up to the day $3 and before the day $2, the start is moved
+# past the first snapshot of the guild, which holds the totals from before the snapshots
+PERIOD_REPORT_SQL = """
+WITH bounds AS (
+    SELECT GREATEST($2::date, min(day) + 1) AS start FROM daily_stats
+    WHERE guild_id = $1 AND scope = 0 AND scope_id = $1
+), last AS (
+    SELECT DISTINCT ON (scope, scope_id) scope, scope_id, messages, minutes, joins, removes
+    FROM daily_stats WHERE guild_id = $1 AND day <= $3
+    ORDER BY scope, scope_id, day DESC
+), first AS (
+    SELECT DISTINCT ON (scope, scope_id) scope, scope_id, messages, minutes, joins, removes
+    FROM daily_stats WHERE guild_id = $1 AND day < (SELECT start FROM bounds)
+    ORDER BY scope, scope_id, day DESC
+), delta AS (
+    SELECT l.scope, l.scope_id,
+           l.messages - COALESCE(f.messages, 0) AS messages,
+           l.minutes - COALESCE(f.minutes, 0) AS minutes,
+           l.joins - COALESCE(f.joins, 0) AS joins,
+           l.removes - COALESCE(f.removes, 0) AS removes
+    FROM last AS l LEFT JOIN first AS f USING (scope, scope_id)
+), channels AS (
+    SELECT d.scope_id AS channel_id, c.type_channel, c.name_after_delete,
+           CASE WHEN c.type_channel = 'voice' THEN d.minutes ELSE d.messages END AS value
+    FROM delta AS d JOIN channels AS c ON c.channel_id = d.scope_id
+    WHERE d.scope = 1
+)
+SELECT
+    (SELECT start FROM bounds) AS start,
+    (SELECT joins FROM delta WHERE scope = 0) AS joins,
+    (SELECT removes FROM delta WHERE scope = 0) AS removes,
+    (SELECT count(*) FROM delta WHERE scope = 2 AND minutes > 0) AS voice_users,
+    (SELECT count(*) FROM delta WHERE scope = 2 AND messages > 0) AS chat_users,
+    (SELECT COALESCE(sum(minutes), 0) FROM delta WHERE scope = 2) AS total_minutes,
+    (SELECT COALESCE(sum(messages), 0) FROM delta WHERE scope = 2) AS total_messages,
+    (SELECT json_agg(json_build_array(scope_id, minutes)) FROM (
+        SELECT scope_id, minutes FROM delta WHERE scope = 2 AND minutes > 0
+        ORDER BY minutes DESC LIMIT $4) AS top) AS top_voice_users,
+    (SELECT json_agg(json_build_array(scope_id, messages)) FROM (
+        SELECT scope_id, messages FROM delta WHERE scope = 2 AND messages > 0
+        ORDER BY messages DESC LIMIT $4) AS top) AS top_chat_users,
+    (SELECT json_agg(json_build_array(channel_id, value, name_after_delete)) FROM (
+        SELECT * FROM channels WHERE type_channel = 'voice' AND value > 0
+        ORDER BY value DESC LIMIT $4) AS top) AS top_voice_channels,
+    (SELECT json_agg(json_build_array(channel_id, value, name_after_delete)) FROM (
+        SELECT * FROM channels WHERE type_channel = 'text' AND value > 0
+        ORDER BY value DESC LIMIT $4) AS top) AS top_text_channels
+"""
+
+
+class UserEntry(t.NamedTuple):
+    user_id: int
+    value: int
+
+
+class ChannelEntry(t.NamedTuple):
+    channel_id: int
+    value: int
+    # the name of a deleted channel
+    name: t.Optional[str] = None
+
+
+class DayReport(t.NamedTuple):
+    joins: int
+    removes: int
+    best_new_voice: t.Optional[UserEntry]
+    best_new_chat: t.Optional[UserEntry]
+    voice_users: int
+    chat_users: int
+    total_minutes: int
+    total_messages: int
+    top_voice_users: t.List[UserEntry]
+    top_chat_users: t.List[UserEntry]
+    top_voice_channels: t.List[ChannelEntry]
+    top_text_channels: t.List[ChannelEntry]
+
+    @property
+    def members_change(self) -> int:
+        return self.joins - self.removes
+
+
+class PeriodReport(t.NamedTuple):
+    start: t.Optional[datetime.date]
+    end: datetime.date
+    joins: int
+    removes: int
+    voice_users: int
+    chat_users: int
+    total_minutes: int
+    total_messages: int
+    top_voice_users: t.List[UserEntry]
+    top_chat_users: t.List[UserEntry]
+    top_voice_channels: t.List[ChannelEntry]
+    top_text_channels: t.List[ChannelEntry]
+
+    @property
+    def members_change(self) -> int:
+        return self.joins - self.removes
+
+
+def _entries(value: t.Optional[str], entry_type):
+    return [entry_type(*item) for item in json.loads(value)] if value else []
+
+
+def _entry(value: t.Optional[str], entry_type):
+    return entry_type(*json.loads(value)) if value else None
+
+
+def _snapshot_bound(day: datetime.date, include_day: bool) -> datetime.date:
+    """the latest day of a snapshot subtracted by a report of ``day``"""
+    return day if include_day else day - datetime.timedelta(days=1)
+
+
+async def get_day_report(guild_id: int, limit: int = 3, day: datetime.date = None,
+                         connection=None, *, include_day: bool = True) -> DayReport:
+    """Every section of the day statistic of a guild in one query, ``day`` is the local date of the guild.
+
+    The figures are the change since the latest snapshot. The scheduled report has just
+    taken the snapshot of ``day``, it passes ``include_day=False`` to subtract the one before.
+    """
+
+    today = datetime.datetime.combine(day or datetime.date.today(), datetime.time())
+    key = ('reports', 'day')
+    async with MaybeAcquire(connection, pool=Table._pool, key=key) as con:
+        with metrics.timed(key, DAY_REPORT_SQL) as timer:
+            row = await con.fetchrow(DAY_REPORT_SQL, guild_id, today, limit,
+                                     _snapshot_bound(today.date(), include_day))
+            timer.rows = 1
+
+    return DayReport(
+        joins=row['joins'] or 0,
+        removes=row['removes'] or 0,
+        best_new_voice=_entry(row['best_new_voice'], UserEntry),
+        best_new_chat=_entry(row['best_new_chat'], UserEntry),
+        voice_users=row['voice_users'],
+        chat_users=row['chat_users'],
+        total_minutes=row['total_minutes'],
+        total_messages=row['total_messages'],
+        top_voice_users=_entries(row['top_voice_users'], UserEntry),
+        top_chat_users=_entries(row['top_chat_users'], UserEntry),
+        top_voice_channels=_entries(row['top_voice_channels'], ChannelEntry),
+        top_text_channels=_entries(row['top_text_channels'], ChannelEntry),
+    )
+
+
+async def get_user_day(guild_id: int, user_id: int, day: datetime.date = None,
+                       connection=None, *, include_day: bool = True) -> t.Tuple[int, int]:
+    """(messages, minutes) of a user since the latest snapshot up to ``day``, see ``get_day_report``"""
+
+    day = day or datetime.date.today()
+    key = ('reports', 'user_day')
+    async with MaybeAcquire(connection, pool=Table._pool, key=key) as con:
+        with metrics.timed(key, USER_DAY_SQL) as timer:
+            row = await con.fetchrow(USER_DAY_SQL, guild_id, user_id, _snapshot_bound(day, include_day))
+            timer.rows = 1
+    return (row[0], row[1]) if row else (0, 0)
+
+
+def _partition(day: datetime.date) -> t.Tuple[str, datetime.date, datetime.date]:
+    """name and bounds of the monthly daily_stats partition holding the day"""
+
+    start = day.replace(day=1)
+    end = (start + datetime.timedelta(days=32)).replace(day=1)
+    return f'daily_stats_{start:%Y_%m}', start, end
+
+
+async def ensure_partitions(days: t.Iterable[datetime.date], connection=None) -> None:
+    """Create the monthly daily_stats partitions of the days and of the months after them.
+
+    Called once before snapshots are taken, not by every snapshot, concurrent
+    ``CREATE TABLE IF NOT EXISTS`` of one partition fails, so the schema lock is held.
+    """
+
+    partitions = set()
+    for day in days:
+        partitions.add(_partition(day))
+        partitions.add(_partition(_partition(day)[2]))
+
+    key = ('daily_stats', 'partitions')
+    async with MaybeAcquire(connection, pool=Table._pool, key=key) as con:
+        async with con.transaction():
+            await con.execute('SELECT pg_advisory_xact_lock($1);', SCHEMA_LOCK_ID)
+            for name, start, end in sorted(partitions):
+                await con.execute(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF daily_stats "
+                                  f"FOR VALUES FROM ('{start}') TO ('{end}')")
+
+
+async def take_snapshot(guild_id: int, day: datetime.date = None, connection=None) -> None:
+    """Store the current totals of a guild as the snapshot of ``day`` (today by default).
+
+    The scheduler takes it at the statistic time of the guild, not at the end of the day.
+    The counters are not reset, later day reports subtract this snapshot.
+    Taking a snapshot of the same day again changes nothing. The partition of the day
+    must exist, see ``ensure_partitions``.
+    """
+
+    day = day or datetime.date.today()
+    key = ('daily_stats', 'snapshot')
+    async with MaybeAcquire(connection, pool=Table._pool, key=key) as con:
+        with metrics.timed(key, SNAPSHOT_SQL) as timer:
+            status = await con.execute(SNAPSHOT_SQL, guild_id, day)
+            timer.rows = int(status.split()[-1])
+
+
+async def take_baseline(guild_id: int, connection=None) -> None:
+    """the first snapshot of a guild, dated yesterday of its local date, so the first day report counts only today"""
+
+    key = ('daily_stats', 'baseline')
+    async with MaybeAcquire(connection, pool=Table._pool, key=key) as con:
+        exists = await con.fetchval('SELECT 1 FROM daily_stats WHERE guild_id = $1 AND scope = 0 AND scope_id = $1 LIMIT 1',
+                                    guild_id)
+        if not exists:
+            utc_offset = await con.fetchval('SELECT utc_offset FROM guilds WHERE guild_id = $1', guild_id)
+            today = (datetime.datetime.utcnow() + datetime.timedelta(minutes=utc_offset or 0)).date()
+            yesterday = today - datetime.timedelta(days=1)
+            await ensure_partitions([yesterday], connection=con)
+            await take_snapshot(guild_id, yesterday, connection=con)
+
+
+async def get_period_report(guild_id: int, start: datetime.date, end: datetime.date,
+                            limit: int = 3, connection=None) -> PeriodReport:
+    """activity of the days [start, end] from daily_stats snapshots only"""
+
+    key = ('reports', 'period')
+    async with MaybeAcquire(connection, pool=Table._pool, key=key) as con:
+        with metrics.timed(key, PERIOD_REPORT_SQL) as timer:
+            row = await con.fetchrow(PERIOD_REPORT_SQL, guild_id, start, end, limit)
+            timer.rows = 1
+
+    return PeriodReport(
+        start=row['start'],
+        end=end,
+        joins=row['joins'] or 0,
+        removes=row['removes'] or 0,
+        voice_users=row['voice_users'],
+        chat_users=row['chat_users'],
+        total_minutes=row['total_minutes'],
+        total_messages=row['total_messages'],
+        top_voice_users=_entries(row['top_voice_users'], UserEntry),
+        top_chat_users=_entries(row['top_chat_users'], UserEntry),
+        top_voice_channels=_entries(row['top_voice_channels'], ChannelEntry),
+        top_text_channels=_entries(row['top_text_channels'], ChannelEntry),
+    )
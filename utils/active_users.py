@@ -0,0 +1,167 @@
+import asyncio
+import datetime
+import time
+import typing as t
+
+from models.instrumentation import metrics
+from models.my_orm import MaybeAcquire, Table
+from utils.hyperloglog import HyperLogLog
+from utils.logger import logger
+
+# scopes of a sketch, as in activity_series
+GUILD, CHANNEL = 0, 1
+# kinds of activity
+CHAT, VOICE = 0, 1
+
+_KEY_ARRAYS = "$1::bigint[], $2::smallint[], $3::bigint[], $4::smallint[], $5::date[]"
+
+FETCH_SQL = f"""
+SELECT guild_id, scope, scope_id, kind, day, registers
+FROM activity_sketches
+JOIN unnest({_KEY_ARRAYS}) AS k(guild_id, scope, scope_id, kind, day)
+    USING (guild_id, scope, scope_id, kind, day)
+"""
+
+UPSERT_SQL = f"""
+INSERT INTO activity_sketches (guild_id, scope, scope_id, kind, day, registers)
+SELECT * FROM unnest({_KEY_ARRAYS}, $6::bytea[])
+ON CONFLICT (guild_id, scope, scope_id, kind, day) DO UPDATE SET registers = EXCLUDED.registers
+"""
+
+RANGE_SQL = """
+SELECT scope_id, registers FROM activity_sketches
+WHERE guild_id = $1 AND scope = $2 AND scope_id = ANY($3::bigint[]) AND kind = $4 AND day BETWEEN $5 AND $6
+"""
+
+PRUNE_SQL = "DELETE FROM activity_sketches WHERE day < $1"
+
+Key = t.Tuple[int, int, int, int, datetime.date]
+
+
+class ActiveUsers:
+    """Distinct chatting and voice users of guilds and channels by local day.
+
+    Every (guild or channel, kind, day) has a ``HyperLogLog`` sketch. Sketches
+    change in memory as messages and voice sessions are credited and changed
+    ones are written to ``activity_sketches`` every ``interval`` seconds.
+    A window of days is the merge of its day sketches, so a count costs one
+    sketch of memory and no scan of profiles.
+    """
+
+    def __init__(self, guild_cache, *, interval: float = 60.0,
+                 retention: datetime.timedelta = datetime.timedelta(days=62)):
+        self.guild_cache = guild_cache
+        self.interval = interval
+        self.retention = retention
+        self._sketches: t.Dict[Key, HyperLogLog] = {}
+        # sketches which hold their stored registers too and may overwrite them
+        self._loaded: t.Set[Key] = set()
+        self._dirty: t.Set[Key] = set()
+        self._flush_lock = asyncio.Lock()
+        self._last_prune = 0.0
+
+    def _day(self, guild_id: int, when: float) -> datetime.date:
+        guild_config = self.guild_cache.get(guild_id)
+        offset = (guild_config.utc_offset or 0) if guild_config else 0
+        return datetime.datetime.utcfromtimestamp(when + offset * 60).date()
+
+    def _add(self, guild_id: int, channel_id: int, user_id: int, kind: int, when: t.Optional[float]) -> None:
+        day = self._day(guild_id, when or time.time())
+        for scope, scope_id in ((GUILD, guild_id), (CHANNEL, channel_id)):
+            key = (guild_id, scope, scope_id, kind, day)
+            sketch = self._sketches.get(key)
+            if sketch is None:
+                sketch = self._sketches[key] = HyperLogLog()
+            if sketch.add(user_id):
+                self._dirty.add(key)
+
+    def record_message(self, guild_id: int, channel_id: int, user_id: int, when: float = None) -> None:
+        self._add(guild_id, channel_id, user_id, CHAT, when)
+
+    def record_voice(self, guild_id: int, channel_id: int, user_id: int, end: float = None) -> None:
+        self._add(guild_id, channel_id, user_id, VOICE, end)
+
+    async def flush(self, connection=None) -> int:
+        """write changed sketches, the stored registers are merged in first, return a number of rows"""
+
+        async with self._flush_lock:
+            dirty, self._dirty = self._dirty, set()
+            if not dirty:
+                return 0
+
+            keys = list(dirty)
+            try:
+                key = ('activity_sketches', 'flush')
+                async with MaybeAcquire(connection, pool=Table._pool, key=key) as con:
+                    unloaded = [k for k in keys if k not in self._loaded]
+                    if unloaded:
+                        with metrics.timed(('activity_sketches', 'load'), FETCH_SQL) as timer:
+                            rows = await con.fetch(FETCH_SQL, *map(list, zip(*unloaded)))
+                            timer.rows = len(rows)
+                        for row in rows:
+                            self._sketches[tuple(row[:5])].merge(HyperLogLog.from_bytes(row['registers']))
+                    with metrics.timed(key, UPSERT_SQL) as timer:
+                        await con.execute(UPSERT_SQL, *map(list, zip(*keys)),
+                                          [self._sketches[k].to_bytes() for k in keys])
+                        timer.rows = len(keys)
+            except Exception:
+                self._dirty |= dirty
+                raise
+
+            self._loaded.update(keys)
+            self._evict()
+            return len(keys)
+
+    def _evict(self) -> None:
+        """forget written sketches of past days, counts read them from the table"""
+
+        cutoff = datetime.datetime.utcnow().date() - datetime.timedelta(days=2)
+        for key in [key for key in self._sketches if key[4] < cutoff and key not in self._dirty]:
+            del self._sketches[key]
+            self._loaded.discard(key)
+
+    async def count(self, guild_id: int, scope: int, scope_ids: t.Sequence[int], kind: int,
+                    start: datetime.date, end: datetime.date, connection=None) -> t.Dict[int, int]:
+        """approximate distinct users of every scope id over the local days [start, end]"""
+
+        key = ('activity_sketches', 'range')
+        async with MaybeAcquire(connection, pool=Table._pool, key=key) as con:
+            with metrics.timed(key, RANGE_SQL) as timer:
+                rows = await con.fetch(RANGE_SQL, guild_id, scope, list(scope_ids), kind, start, end)
+                timer.rows = len(rows)
+
+        merged: t.Dict[int, HyperLogLog] = {}
+        for scope_id, registers in rows:
+            merged.setdefault(scope_id, HyperLogLog()).merge(HyperLogLog.from_bytes(registers))
+        # sketches not written yet
+        wanted = set(scope_ids)
+        for (g, s, scope_id, k, day), sketch in list(self._sketches.items()):
+            if g == guild_id and s == scope and k == kind and scope_id in wanted and start <= day <= end:
+                merged.setdefault(scope_id, HyperLogLog()).merge(sketch)
+        return {scope_id: merged[scope_id].count() if scope_id in merged else 0 for scope_id in scope_ids}
+
+    async def guild_users(self, guild_id: int, kind: int, start: datetime.date, end: datetime.date) -> int:
+        return (await self.count(guild_id, GUILD, [guild_id], kind, start, end))[guild_id]
+
+    async def prune(self, connection=None) -> None:
+        cutoff = datetime.datetime.utcnow().date() - self.retention
+        key = ('activity_sketches', 'prune')
+        async with MaybeAcquire(connection, pool=Table._pool, key=key) as con:
+            with metrics.timed(key, PRUNE_SQL):
+                await con.execute(PRUNE_SQL, cutoff)
+
+    async def run(self) -> None:
+        """flush every ``interval`` seconds, drop sketches older than ``retention`` once an hour"""
+
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+                if time.monotonic() - self._last_prune >= 3600:
+                    await self.prune()
+                    self._last_prune = time.monotonic()
+            except Exception as ex:
+                logger.error(f'active users flush failed, {len(self._dirty)} sketches kept: {ex}')
+
+    async def close(self) -> None:
+        await self.flush()
@@ -0,0 +1,181 @@
+import asyncio
+import time
+import typing as t
+
+from models.instrumentation import metrics
+from models.my_orm import MaybeAcquire, Table
+from utils.logger import logger
+
+PROFILES_FLUSH_SQL = """
+UPDATE user_profiles AS p
+SET messages = p.messages + d.messages,
+    coins = p.coins + d.coins,
+    minutes = p.minutes + d.minutes
+FROM unnest($1::bigint[], $2::bigint[], $3::int[], $4::int[], $5::int[])
+    AS d(guild_id, user_id, messages, coins, minutes)
+WHERE p.guild_id = d.guild_id AND p.user_id = d.user_id
+"""
+
+CHANNELS_FLUSH_SQL = """
+UPDATE channels AS c
+SET all_statistic = COALESCE(c.all_statistic, 0) + d.amount
+FROM unnest($1::bigint[], $2::int[]) AS d(channel_id, amount)
+WHERE c.channel_id = d.channel_id
+"""
+
+
+class ActivityAggregator:
+    """Write-behind accumulator for message and voice counters of profiles and channels.
+
+    Deltas are summed in memory and written by a background task every
+    ``interval`` seconds or as soon as ``max_pending`` keys are pending,
+    each table in a single set-based UPDATE. Credits are also passed to
+    ``leaderboards`` right away.
+    """
+
+    def __init__(self, *, interval: float = 10.0, max_pending: int = 1000, leaderboards=None):
+        self.interval = interval
+        self.max_pending = max_pending
+        self.leaderboards = leaderboards
+
+        # (guild_id, user_id) -> [messages, coins, minutes]
+        self._profiles: t.Dict[t.Tuple[int, int], t.List[int]] = {}
+        # channel_id -> messages of a text channel, minutes of a voice channel
+        self._channels: t.Dict[int, int] = {}
+
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._closed = False
+
+        self.flush_count = 0
+        self.flushed_rows = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.last_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    @property
+    def pending(self) -> int:
+        return len(self._profiles) + len(self._channels)
+
+    def add_message(self, guild_id: int, user_id: int, channel_id: int, coins: int = 0) -> None:
+        """account one message of a user in a channel"""
+
+        delta = self._profiles.get((guild_id, user_id))
+        if delta is None:
+            self._profiles[(guild_id, user_id)] = [1, coins, 0]
+        else:
+            delta[0] += 1
+            delta[1] += coins
+
+        self._channels[channel_id] = self._channels.get(channel_id, 0) + 1
+        if self.leaderboards is not None:
+            self.leaderboards.credit(guild_id, user_id, messages=1, coins=coins)
+
+        if self.pending >= self.max_pending:
+            self._wakeup.set()
+
+    def add_voice(self, guild_id: int, user_id: int, minutes: int, coins: int = 0, channel_id: int = None) -> None:
+        """account minutes of a finished voice session"""
+
+        delta = self._profiles.get((guild_id, user_id))
+        if delta is None:
+            self._profiles[(guild_id, user_id)] = [0, coins, minutes]
+        else:
+            delta[1] += coins
+            delta[2] += minutes
+        if channel_id is not None:
+            self._channels[channel_id] = self._channels.get(channel_id, 0) + minutes
+        if self.leaderboards is not None:
+            self.leaderboards.credit(guild_id, user_id, minutes=minutes, coins=coins)
+
+        if self.pending >= self.max_pending:
+            self._wakeup.set()
+
+    def _merge_back(self, profiles, channels) -> None:
+        """return not written deltas to the pending state"""
+
+        for key, (messages, coins, minutes) in profiles.items():
+            delta = self._profiles.setdefault(key, [0, 0, 0])
+            delta[0] += messages
+            delta[1] += coins
+            delta[2] += minutes
+
+        for channel_id, amount in channels.items():
+            self._channels[channel_id] = self._channels.get(channel_id, 0) + amount
+
+    async def flush(self, connection=None) -> int:
+        """write all pending deltas, return a number of flushed keys"""
+
+        async with self._flush_lock:
+            profiles, self._profiles = self._profiles, {}
+            channels, self._channels = self._channels, {}
+            batch_size = len(profiles) + len(channels)
+            if not batch_size:
+                return 0
+
+            start = time.perf_counter()
+            try:
+                async with MaybeAcquire(connection, pool=Table._pool, key=('activity', 'flush')) as con:
+                    async with con.transaction():
+                        if profiles:
+                            guild_ids, user_ids = map(list, zip(*profiles.keys()))
+                            messages, coins, minutes = map(list, zip(*profiles.values()))
+                            with metrics.timed(('user_profiles', 'activity_flush'), PROFILES_FLUSH_SQL) as timer:
+                                await con.execute(PROFILES_FLUSH_SQL, guild_ids, user_ids, messages, coins, minutes)
+                                timer.rows = len(profiles)
+                        if channels:
+                            with metrics.timed(('channels', 'activity_flush'), CHANNELS_FLUSH_SQL) as timer:
+                                await con.execute(CHANNELS_FLUSH_SQL, list(channels.keys()), list(channels.values()))
+                                timer.rows = len(channels)
+            except Exception:
+                self._merge_back(profiles, channels)
+                raise
+
+            elapsed = time.perf_counter() - start
+            self.flush_count += 1
+            self.flushed_rows += batch_size
+            self.last_batch_size = batch_size
+            self.max_batch_size = max(self.max_batch_size, batch_size)
+            self.last_flush_seconds = elapsed
+            self.total_flush_seconds += elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+            return batch_size
+
+    def stats(self) -> dict:
+        avg_seconds = self.total_flush_seconds / self.flush_count if self.flush_count else 0.0
+        avg_batch = self.flushed_rows / self.flush_count if self.flush_count else 0.0
+        return {
+            'pending': self.pending,
+            'flush_count': self.flush_count,
+            'flushed_rows': self.flushed_rows,
+            'last_batch_size': self.last_batch_size,
+            'max_batch_size': self.max_batch_size,
+            'avg_batch_size': avg_batch,
+            'last_flush_seconds': self.last_flush_seconds,
+            'max_flush_seconds': self.max_flush_seconds,
+            'avg_flush_seconds': avg_seconds,
+        }
+
+    async def run(self) -> None:
+        """background loop, flush on interval or when size threshold reached"""
+
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+            except Exception as ex:
+                logger.error(f'activity flush failed, {self.pending} keys kept: {ex}')
+
+    async def close(self) -> None:
+        """stop background loop and write everything left"""
+
+        self._closed = True
+        self._wakeup.set()
+        await self.flush()
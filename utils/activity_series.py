@@ -0,0 +1,271 @@
+import asyncio
+import datetime
+import time
+import typing as t
+
+import numpy as np
+
+from models.instrumentation import metrics
+from models.my_orm import MaybeAcquire, Table
+from utils.logger import logger
+
+# scopes of a series
+GUILD, CHANNEL, USER = 0, 1, 2
+# resolutions of stored buckets
+MINUTE, HOUR, DAY = 0, 1, 2
+
+# minutes held in memory for a series of each scope
+RING_MINUTES = {GUILD: 24 * 60, CHANNEL: 24 * 60, USER: 60}
+
+FLUSH_SQL = """
+INSERT INTO activity_series AS s (resolution, bucket, guild_id, scope, scope_id, messages, minutes)
+SELECT 0, d.* FROM unnest($1::timestamp[], $2::bigint[], $3::smallint[], $4::bigint[], $5::int[], $6::int[])
+    AS d(bucket, guild_id, scope, scope_id, messages, minutes)
+ON CONFLICT (resolution, bucket, guild_id, scope, scope_id)
+DO UPDATE SET messages = s.messages + EXCLUDED.messages, minutes = s.minutes + EXCLUDED.minutes
+"""
+
+# moves buckets of resolution $1 older than $4 into buckets of resolution $2 truncated by $3
+ROLLUP_SQL = """
+WITH moved AS (
+    DELETE FROM activity_series WHERE resolution = $1 AND bucket < $4
+    RETURNING bucket, guild_id, scope, scope_id, messages, minutes
+)
+INSERT INTO activity_series AS s (resolution, bucket, guild_id, scope, scope_id, messages, minutes)
+SELECT $2::smallint, date_trunc($3, bucket), guild_id, scope, scope_id, sum(messages)::int, sum(minutes)::int
+FROM moved GROUP BY 2, 3, 4, 5
+ON CONFLICT (resolution, bucket, guild_id, scope, scope_id)
+DO UPDATE SET messages = s.messages + EXCLUDED.messages, minutes = s.minutes + EXCLUDED.minutes
+"""
+
+RANGE_SQL = """
+SELECT array_agg(extract(epoch FROM bucket)::bigint), array_agg(messages), array_agg(minutes)
+FROM activity_series
+WHERE guild_id = $1 AND scope = $2 AND scope_id = $3 AND bucket >= $4 AND bucket < $5 AND resolution <= $6
+"""
+
+
+def _bucket(minute: int) -> datetime.datetime:
+    """naive utc start of an epoch minute"""
+    return datetime.datetime.utcfromtimestamp(minute * 60)
+
+
+class MinuteRing:
+    """Messages and voice minutes of the last ``size`` minutes of one series.
+
+    Slot ``minute % size`` holds an epoch minute, slots are zeroed as time moves on.
+    """
+
+    __slots__ = ('size', 'messages', 'minutes', 'last')
+
+    def __init__(self, size: int):
+        self.size = size
+        self.messages = np.zeros(size, dtype=np.uint32)
+        self.minutes = np.zeros(size, dtype=np.uint32)
+        # the latest epoch minute the ring holds
+        self.last = None
+
+    def _advance(self, minute: int) -> None:
+        if self.last is None:
+            self.last = minute
+            return
+        if minute <= self.last:
+            return
+        if minute - self.last >= self.size:
+            self.messages[:] = 0
+            self.minutes[:] = 0
+        else:
+            stale = np.arange(self.last + 1, minute + 1) % self.size
+            self.messages[stale] = 0
+            self.minutes[stale] = 0
+        self.last = minute
+
+    def add_message(self, minute: int, amount: int = 1) -> None:
+        self._advance(minute)
+        if minute > self.last - self.size:
+            self.messages[minute % self.size] += amount
+
+    def add_voice(self, start: int, end: int) -> None:
+        """one voice minute to every minute of [start, end)"""
+        self._advance(end - 1)
+        start = max(start, self.last - self.size + 1)
+        if start < end:
+            self.minutes[np.arange(start, end) % self.size] += 1
+
+    def window(self, start: int, end: int) -> t.Tuple[np.ndarray, np.ndarray]:
+        """per-minute arrays of [start, end) which are still in the ring"""
+        if self.last is None:
+            return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint32)
+        start = max(start, self.last - self.size + 1)
+        end = min(end, self.last + 1)
+        slots = np.arange(start, max(start, end)) % self.size
+        return self.messages[slots], self.minutes[slots]
+
+
+class ActivitySeries:
+    """Per-minute message and voice-minute counts of guilds, channels and users.
+
+    Recent minutes are kept in ``MinuteRing`` arrays for in-memory range sums,
+    new counts wait in a pending dict and are added to ``activity_series`` every
+    ``interval`` seconds. ``downsample()`` rolls old minute rows into hours and
+    old hour rows into days.
+    """
+
+    def __init__(self, *, interval: float = 60.0, minute_retention: datetime.timedelta = datetime.timedelta(hours=48),
+                 hour_retention: datetime.timedelta = datetime.timedelta(days=60)):
+        self.interval = interval
+        self.minute_retention = minute_retention
+        self.hour_retention = hour_retention
+        # (guild_id, scope, scope_id) -> ring
+        self._rings: t.Dict[t.Tuple[int, int, int], MinuteRing] = {}
+        # (epoch minute, guild_id, scope, scope_id) -> [messages, minutes]
+        self._pending: t.Dict[t.Tuple[int, int, int, int], t.List[int]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._last_downsample = 0.0
+
+    def ring(self, guild_id: int, scope: int, scope_id: int) -> MinuteRing:
+        key = (guild_id, scope, scope_id)
+        ring = self._rings.get(key)
+        if ring is None:
+            ring = self._rings[key] = MinuteRing(RING_MINUTES[scope])
+        return ring
+
+    @staticmethod
+    def _keys(guild_id: int, channel_id: int, user_id: int):
+        return (guild_id, GUILD, guild_id), (guild_id, CHANNEL, channel_id), (guild_id, USER, user_id)
+
+    def record_message(self, guild_id: int, channel_id: int, user_id: int, when: float = None) -> None:
+        minute = int((when or time.time()) // 60)
+        for key in self._keys(guild_id, channel_id, user_id):
+            self.ring(*key).add_message(minute)
+            delta = self._pending.setdefault((minute, *key), [0, 0])
+            delta[0] += 1
+
+    def record_voice(self, guild_id: int, channel_id: int, user_id: int, minutes: int, end: float = None) -> None:
+        """``minutes`` of a voice session which ended at ``end``
+
+        The rings get every minute, the pending buckets get the minutes of each hour
+        in the bucket of its first minute, a long session is a few rows, not one per minute.
+        """
+        if minutes < 1:
+            return
+        end_minute = int((end or time.time()) // 60)
+        start_minute = end_minute - minutes
+        keys = self._keys(guild_id, channel_id, user_id)
+        for key in keys:
+            self.ring(*key).add_voice(start_minute, end_minute)
+
+        minute = start_minute
+        while minute < end_minute:
+            hour_end = min((minute // 60 + 1) * 60, end_minute)
+            for key in keys:
+                delta = self._pending.setdefault((minute - minute % 60, *key), [0, 0])
+                delta[1] += hour_end - minute
+            minute = hour_end
+
+    def prune(self) -> None:
+        """forget rings without a count in their window"""
+        now = int(time.time() // 60)
+        self._rings = {key: ring for key, ring in self._rings.items() if ring.last is not None and ring.last > now - ring.size}
+
+    def recent(self, guild_id: int, scope: int, scope_id: int, minutes: int = 60) -> t.Tuple[int, int]:
+        """(messages, voice minutes) of the last ``minutes`` from memory"""
+        ring = self._rings.get((guild_id, scope, scope_id))
+        if ring is None:
+            return 0, 0
+        now = int(time.time() // 60)
+        messages, voice = ring.window(now - minutes + 1, now + 1)
+        return int(messages.sum()), int(voice.sum())
+
+    async def flush(self, connection=None) -> int:
+        """add pending minute buckets to the table, return a number of rows"""
+
+        async with self._flush_lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            minutes, guild_ids, scopes, scope_ids = zip(*pending.keys())
+            messages, voice = zip(*pending.values())
+            try:
+                key = ('activity_series', 'flush')
+                async with MaybeAcquire(connection, pool=Table._pool, key=key) as con:
+                    with metrics.timed(key, FLUSH_SQL) as timer:
+                        await con.execute(FLUSH_SQL, [_bucket(m) for m in minutes], list(guild_ids),
+                                          list(scopes), list(scope_ids), list(messages), list(voice))
+                        timer.rows = len(pending)
+            except Exception:
+                for k, (m, v) in pending.items():
+                    delta = self._pending.setdefault(k, [0, 0])
+                    delta[0] += m
+                    delta[1] += v
+                raise
+            return len(pending)
+
+    async def downsample(self, connection=None) -> None:
+        """roll minute rows older than minute_retention into hours, hour rows older than hour_retention into days"""
+
+        now = datetime.datetime.utcnow()
+        hour_cutoff = (now - self.minute_retention).replace(minute=0, second=0, microsecond=0)
+        day_cutoff = (now - self.hour_retention).replace(hour=0, minute=0, second=0, microsecond=0)
+        key = ('activity_series', 'downsample')
+        async with MaybeAcquire(connection, pool=Table._pool, key=key) as con:
+            async with con.transaction():
+                with metrics.timed(key, ROLLUP_SQL):
+                    await con.execute(ROLLUP_SQL, MINUTE, HOUR, 'hour', hour_cutoff)
+                    await con.execute(ROLLUP_SQL, HOUR, DAY, 'day', day_cutoff)
+
+    async def fetch_range(self, guild_id: int, scope: int, scope_id: int,
+                          start: datetime.datetime, end: datetime.datetime,
+                          max_resolution: int = DAY, connection=None) -> t.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(bucket epoch seconds, messages, minutes) arrays of stored buckets in [start, end), utc"""
+
+        key = ('activity_series', 'range')
+        async with MaybeAcquire(connection, pool=Table._pool, key=key) as con:
+            with metrics.timed(key, RANGE_SQL) as timer:
+                row = await con.fetchrow(RANGE_SQL, guild_id, scope, scope_id, start, end, max_resolution)
+                timer.rows = len(row[0] or ())
+        buckets, messages, minutes = (np.asarray(column or (), dtype=np.int64) for column in row)
+        return buckets, messages, minutes
+
+    async def totals(self, guild_id: int, scope: int, scope_id: int,
+                     start: datetime.datetime, end: datetime.datetime) -> t.Tuple[int, int]:
+        _, messages, minutes = await self.fetch_range(guild_id, scope, scope_id, start, end)
+        return int(messages.sum()), int(minutes.sum())
+
+    async def by_hour_of_day(self, guild_id: int, scope: int, scope_id: int,
+                             start: datetime.datetime, end: datetime.datetime) -> t.Tuple[np.ndarray, np.ndarray]:
+        """messages and minutes summed by utc hour of day (24 values each), day buckets are left out"""
+
+        buckets, messages, minutes = await self.fetch_range(guild_id, scope, scope_id, start, end, HOUR)
+        hours = (buckets // 3600) % 24
+        return (np.bincount(hours, weights=messages, minlength=24).astype(np.int64),
+                np.bincount(hours, weights=minutes, minlength=24).astype(np.int64))
+
+    async def by_day(self, guild_id: int, scope: int, scope_id: int,
+                     start: datetime.datetime, end: datetime.datetime) -> t.Tuple[np.ndarray, np.ndarray]:
+        """messages and minutes of every utc day of [start, end)"""
+
+        buckets, messages, minutes = await self.fetch_range(guild_id, scope, scope_id, start, end)
+        first_day = int(start.replace(tzinfo=datetime.timezone.utc).timestamp()) // 86400
+        days = (end - start).days + (1 if (end - start) % datetime.timedelta(days=1) else 0)
+        index = buckets // 86400 - first_day
+        return (np.bincount(index, weights=messages, minlength=days)[:days].astype(np.int64),
+                np.bincount(index, weights=minutes, minlength=days)[:days].astype(np.int64))
+
+    async def run(self) -> None:
+        """flush every ``interval`` seconds, downsample once an hour"""
+
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+                if time.monotonic() - self._last_downsample >= 3600:
+                    self.prune()
+                    await self.downsample()
+                    self._last_downsample = time.monotonic()
+            except Exception as ex:
+                logger.error(f'activity series flush failed, {len(self._pending)} buckets kept: {ex}')
+
+    async def close(self) -> None:
+        await self.flush()
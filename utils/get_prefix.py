@@ -1,18 +1,52 @@
+import re
+import typing as t
+
 import discord
 
 from bot.settings import DEFAULT_PREFIX
-from models.my_orm import MaybeAcquire, Table
+
+
+class PrefixTable:
+    """Compiled prefix matchers by guild id.
+
+    A matcher is rebuilt only when the guild prefixes in ``bot.cached_guilds`` change,
+    so resolving a prefix never touches the database.
+    """
+
+    def __init__(self):
+        # guild_id -> (prefixes, compiled alternation, longest prefix first)
+        self._matchers: t.Dict[int, t.Tuple[t.Tuple[str, ...], t.Pattern]] = {}
+
+    @staticmethod
+    def compile(prefixes: t.Iterable[str]) -> t.Pattern:
+        ordered = sorted(set(prefixes), key=len, reverse=True)
+        return re.compile('|'.join(map(re.escape, ordered)))
+
+    def warm(self, guild_cache) -> None:
+        """compile matchers of every cached guild"""
+
+        self._matchers = {entry.guild_id: (entry.prefixes, self.compile(entry.prefixes)) for entry in guild_cache}
+
+    def invalidate(self, guild_id: int) -> None:
+        self._matchers.pop(guild_id, None)
+
+    def matcher(self, guild_id: int, prefixes: t.Tuple[str, ...]) -> t.Pattern:
+        cached = self._matchers.get(guild_id)
+        if cached is None or cached[0] != prefixes:
+            cached = self._matchers[guild_id] = (prefixes, self.compile(prefixes))
+        return cached[1]
+
+    def resolve(self, guild_id: int, prefixes: t.Tuple[str, ...], content: str) -> t.Union[str, t.List[str]]:
+        """the prefix the message starts with, otherwise all prefixes"""
+
+        match = self.matcher(guild_id, prefixes).match(content)
+        return match.group() if match else list(prefixes)
 
 
 async def get_prefix(bot, msg: discord.message.Message):
     if not msg.guild:
         return DEFAULT_PREFIX
-    else:
-        sql = f"""
-        SELECT bot_prefix FROM guilds WHERE guild_id = {msg.guild.id}
-        """
-        async with MaybeAcquire(connection=None, pool=Table._pool) as con:
-            data = await con.fetchrow(sql)
-        # data = await DB.sql_fetch(sql, True)
-        prefix = data.get('bot_prefix')
-        return prefix
\ No newline at end of file
+    guild_config = bot.cached_guilds.get(msg.guild.id)
+    if guild_config is None:
+        return DEFAULT_PREFIX
+    return bot.prefixes.resolve(msg.guild.id, guild_config.prefixes, msg.content)
@@ -0,0 +1,113 @@
+import asyncio
+import datetime
+import typing as t
+
+from models.models import Guilds
+from utils.logger import logger
+
+
+class GuildConfig(t.NamedTuple):
+    """settings of a guild read by listeners and commands"""
+
+    guild_id: int
+    bot_prefix: str
+    extra_prefixes: t.Optional[t.List[str]]
+    price_minutes: int
+    price_messages: int
+    log_channel_id: t.Optional[int]
+    trophy_channel_id: t.Optional[int]
+    user_count_channel_id: t.Optional[int]
+    role_saver: bool
+    statistic_minute: int
+    utc_offset: int
+
+    @property
+    def prefixes(self) -> t.Tuple[str, ...]:
+        """main prefix first, then the extra ones"""
+        return (self.bot_prefix, *(self.extra_prefixes or ()))
+
+    @property
+    def today(self) -> datetime.date:
+        """the local date of the guild"""
+        return (datetime.datetime.utcnow() + datetime.timedelta(minutes=self.utc_offset or 0)).date()
+
+
+CONFIG_FIELDS = frozenset(GuildConfig._fields) - {'guild_id'}
+
+
+class GuildCache:
+    """Write-through cache of ``GuildConfig`` by guild id.
+
+    Filled by ``load_all()`` at startup and ``load()`` when the bot joins a guild.
+    Every ``Guilds.update`` (also inside ``Table.batch()``) is applied to the entry
+    after it succeeds, so readers never query the guilds table.
+    """
+
+    def __init__(self):
+        self._entries: t.Dict[int, GuildConfig] = {}
+        self._reloads: t.Set[asyncio.Task] = set()
+        Guilds.add_update_listener(self._on_update)
+
+    def get(self, guild_id: int, default: t.Optional[GuildConfig] = None) -> t.Optional[GuildConfig]:
+        return self._entries.get(guild_id, default)
+
+    def __getitem__(self, guild_id: int) -> GuildConfig:
+        return self._entries[guild_id]
+
+    def __contains__(self, guild_id: int) -> bool:
+        return guild_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> t.Iterator[GuildConfig]:
+        return iter(self._entries.values())
+
+    @staticmethod
+    def _select():
+        return Guilds.select(*(getattr(Guilds, name) for name in GuildConfig._fields))
+
+    async def load_all(self, connection=None) -> None:
+        """replace all entries with the guilds table"""
+
+        rows = await self._select().fetch(connection, raw=True)
+        entries = (GuildConfig(*row) for row in rows)
+        self._entries = {entry.guild_id: entry for entry in entries}
+        logger.info(f'guild cache: {len(self._entries)} guilds loaded')
+
+    async def load(self, guild_id: int, connection=None) -> t.Optional[GuildConfig]:
+        """read one guild, e.g. after guild_init"""
+
+        row = await self._select().where(Guilds.guild_id == guild_id).fetchrow(connection, raw=True)
+        if row is None:
+            self._entries.pop(guild_id, None)
+            return None
+        entry = self._entries[guild_id] = GuildConfig(*row)
+        return entry
+
+    def remove(self, guild_id: int) -> None:
+        self._entries.pop(guild_id, None)
+
+    def _reload(self, coro) -> None:
+        task = asyncio.get_event_loop().create_task(coro)
+        self._reloads.add(task)
+        task.add_done_callback(self._reloads.discard)
+
+    def _on_update(self, filters: dict, values: dict, increments: dict) -> None:
+        """Guilds update listener, keeps entries in step with the table"""
+
+        changed = CONFIG_FIELDS.intersection(values) | CONFIG_FIELDS.intersection(increments)
+        if not changed:
+            return
+
+        guild_id = filters.get('guild_id')
+        if guild_id is None or increments.keys() & changed:
+            # the new value is known only to the database
+            self._reload(self.load(guild_id) if guild_id is not None else self.load_all())
+            return
+
+        entry = self._entries.get(guild_id)
+        if entry is None:
+            self._reload(self.load(guild_id))
+            return
+        self._entries[guild_id] = entry._replace(**{name: values[name] for name in changed})
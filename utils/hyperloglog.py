@@ -0,0 +1,67 @@
+import math
+import typing as t
+
+import numpy as np
+
+_MASK = (1 << 64) - 1
+
+
+def _mix64(value: int) -> int:
+    """splitmix64 finalizer, spreads sequential ids over 64 bits"""
+    z = (value + 0x9E3779B97F4A7C15) & _MASK
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK
+    return z ^ (z >> 31)
+
+
+class HyperLogLog:
+    """Approximate count of distinct 64-bit ids in ``2 ** p`` one-byte registers.
+
+    The standard error is about ``1.04 / sqrt(2 ** p)``, 3.3% with the default p=10.
+    Sketches of the same ``p`` merge by a register-wise max, the merge of sketches
+    of two windows is the sketch of their union.
+    """
+
+    __slots__ = ('p', 'registers')
+
+    def __init__(self, p: int = 10, registers: t.Optional[bytes] = None):
+        self.p = p
+        self.registers = bytearray(1 << p) if registers is None else bytearray(registers)
+        if len(self.registers) != 1 << p:
+            raise ValueError(f'{len(self.registers)} registers for p={p}')
+
+    def add(self, value: int) -> bool:
+        """add an id, True if the sketch changed"""
+
+        h = _mix64(value)
+        index = h >> (64 - self.p)
+        rank = 64 - self.p - (h & ((1 << (64 - self.p)) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def merge(self, other: 'HyperLogLog') -> 'HyperLogLog':
+        if other.p != self.p:
+            raise ValueError(f'cannot merge sketches of p={self.p} and p={other.p}')
+        registers = np.frombuffer(self.registers, dtype=np.uint8)
+        np.maximum(registers, np.frombuffer(other.registers, dtype=np.uint8), out=registers)
+        return self
+
+    def count(self) -> int:
+        m = len(self.registers)
+        registers = np.frombuffer(self.registers, dtype=np.uint8)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / float(np.ldexp(1.0, -registers.astype(np.int64)).sum())
+        zeros = m - int(np.count_nonzero(registers))
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for small counts
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'HyperLogLog':
+        return cls(len(data).bit_length() - 1, data)
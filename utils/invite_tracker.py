@@ -0,0 +1,99 @@
+import time
+import typing as t
+
+import discord
+
+from models.models import Invites, Profiles, Table
+from utils.logger import logger
+
+# a deleted invite may still explain a join that is dispatched after the delete
+DELETED_GRACE_SECONDS = 60
+
+
+class TrackedInvite(t.NamedTuple):
+    uses: int
+    max_uses: int
+    inviter_id: t.Optional[int]
+
+    @classmethod
+    def from_invite(cls, invite: discord.Invite) -> 'TrackedInvite':
+        return cls(invite.uses or 0, invite.max_uses or 0, invite.inviter.id if invite.inviter else None)
+
+    @property
+    def exhausted_by_one(self) -> bool:
+        return bool(self.max_uses) and self.uses + 1 >= self.max_uses
+
+
+class InviteTracker:
+    """Invite uses by guild id and invite code.
+
+    Seeded by ``guild_init``, kept by the invite create/delete listeners.
+    A join is attributed with one ``guild.invites()`` call compared to the snapshot.
+    """
+
+    def __init__(self, leaderboards=None):
+        self.leaderboards = leaderboards
+        self._guilds: t.Dict[int, t.Dict[str, TrackedInvite]] = {}
+        # guild_id -> code -> (invite, monotonic time of the delete event)
+        self._deleted: t.Dict[int, t.Dict[str, t.Tuple[TrackedInvite, float]]] = {}
+
+    def seed(self, guild_id: int, invites: t.Iterable[discord.Invite]) -> None:
+        self._guilds[guild_id] = {invite.code: TrackedInvite.from_invite(invite) for invite in invites}
+        self._deleted.pop(guild_id, None)
+
+    def add(self, invite: discord.Invite) -> None:
+        self._guilds.setdefault(invite.guild.id, {})[invite.code] = TrackedInvite.from_invite(invite)
+
+    def remove(self, invite: discord.Invite) -> None:
+        tracked = self._guilds.get(invite.guild.id, {}).pop(invite.code, None)
+        if tracked is not None:
+            self._deleted.setdefault(invite.guild.id, {})[invite.code] = (tracked, time.monotonic())
+
+    def remove_guild(self, guild_id: int) -> None:
+        self._guilds.pop(guild_id, None)
+        self._deleted.pop(guild_id, None)
+
+    def _recently_deleted(self, guild_id: int) -> t.Dict[str, TrackedInvite]:
+        deleted = self._deleted.pop(guild_id, {})
+        deadline = time.monotonic() - DELETED_GRACE_SECONDS
+        return {code: tracked for code, (tracked, deleted_at) in deleted.items() if deleted_at >= deadline}
+
+    async def attribute_join(self, guild: discord.Guild) -> t.Optional[int]:
+        """Return an inviter id of a member who just joined, the snapshot and the database follow the live invites.
+
+        Compares live uses with the snapshot in one pass. An invite which vanished and had one use left
+        (max_uses reached) is the fallback when no live invite counts a new use.
+        """
+
+        live = {invite.code: invite for invite in await guild.invites()}
+        snapshot = self._guilds.get(guild.id, {})
+        vanished = self._recently_deleted(guild.id)
+
+        used_code, used = None, None
+        for code, invite in live.items():
+            tracked = snapshot.get(code)
+            if (invite.uses or 0) > (tracked.uses if tracked else 0):
+                used_code, used = code, TrackedInvite.from_invite(invite)
+                break
+        else:
+            vanished.update((code, tracked) for code, tracked in snapshot.items() if code not in live)
+            for code, tracked in vanished.items():
+                if tracked.exhausted_by_one:
+                    used_code, used = code, tracked
+                    break
+
+        self._guilds[guild.id] = {code: TrackedInvite.from_invite(invite) for code, invite in live.items()}
+        if used is None:
+            logger.info(f'{guild}: no invite found for a join')
+            return None
+
+        async with Table.batch() as b:
+            if used_code in live:
+                b.update(Invites, id=used_code, values={'uses': used.uses})
+            else:
+                b.delete(Invites, id=used_code)
+            if used.inviter_id is not None:
+                b.update(Profiles, user_id=used.inviter_id, guild_id=guild.id, increments={'invites': 1})
+        if used.inviter_id is not None and self.leaderboards is not None:
+            self.leaderboards.credit(guild.id, used.inviter_id, invites=1)
+        return used.inviter_id
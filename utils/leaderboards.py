@@ -0,0 +1,122 @@
+import asyncio
+import typing as t
+
+from sortedcontainers import SortedList
+
+from models.models import Profiles
+from utils.logger import logger
+
+METRICS = ('messages', 'minutes', 'coins', 'invites')
+
+
+class Leaderboard:
+    """Scores of users ordered by score descending, user id ascending on ties.
+
+    ``top`` costs O(log n + limit), ``rank`` and updates O(log n).
+    """
+
+    __slots__ = ('_scores', '_order')
+
+    def __init__(self, scores: t.Optional[t.Dict[int, int]] = None):
+        self._scores: t.Dict[int, int] = dict(scores or {})
+        self._order = SortedList((-score, user_id) for user_id, score in self._scores.items())
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def score(self, user_id: int) -> t.Optional[int]:
+        return self._scores.get(user_id)
+
+    def set(self, user_id: int, score: int) -> None:
+        old = self._scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            self._order.remove((-old, user_id))
+        self._scores[user_id] = score
+        self._order.add((-score, user_id))
+
+    def add(self, user_id: int, delta: int) -> None:
+        if delta:
+            self.set(user_id, self._scores.get(user_id, 0) + delta)
+
+    def remove(self, user_id: int) -> None:
+        old = self._scores.pop(user_id, None)
+        if old is not None:
+            self._order.remove((-old, user_id))
+
+    def top(self, limit: int) -> t.List[t.Tuple[int, int]]:
+        """(user_id, score) of the first ``limit`` users"""
+        return [(user_id, -score) for score, user_id in self._order.islice(0, limit)]
+
+    def rank(self, user_id: int) -> t.Optional[int]:
+        """1-based place of a user"""
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        return self._order.bisect_left((-score, user_id)) + 1
+
+
+class Leaderboards:
+    """Per-guild leaderboards of profile counters, see ``METRICS``.
+
+    Credited in place by the activity aggregator and the invite tracker,
+    ``reconcile()`` replaces them with ``user_profiles`` from time to time.
+    """
+
+    def __init__(self, *, interval: float = 900.0):
+        self.interval = interval
+        self.loaded = False
+        self._boards: t.Dict[t.Tuple[int, str], Leaderboard] = {}
+
+    def board(self, guild_id: int, metric: str) -> Leaderboard:
+        if metric not in METRICS:
+            raise KeyError(metric)
+        board = self._boards.get((guild_id, metric))
+        if board is None:
+            board = self._boards[(guild_id, metric)] = Leaderboard()
+        return board
+
+    def credit(self, guild_id: int, user_id: int, **deltas: int) -> None:
+        """add ``messages=1, coins=5`` like deltas to the boards of a guild"""
+
+        for metric, delta in deltas.items():
+            if delta:
+                self.board(guild_id, metric).add(user_id, delta)
+
+    def top(self, guild_id: int, metric: str, limit: int = 10) -> t.List[t.Tuple[int, int]]:
+        return self.board(guild_id, metric).top(limit)
+
+    def rank(self, guild_id: int, metric: str, user_id: int) -> t.Optional[int]:
+        return self.board(guild_id, metric).rank(user_id)
+
+    def remove_guild(self, guild_id: int) -> None:
+        for metric in METRICS:
+            self._boards.pop((guild_id, metric), None)
+
+    async def reconcile(self, connection=None) -> None:
+        """rebuild every board from user_profiles"""
+
+        scores: t.Dict[t.Tuple[int, str], t.Dict[int, int]] = {}
+        columns = [Profiles.guild_id, Profiles.user_id, *(getattr(Profiles, metric) for metric in METRICS)]
+        async for row in Profiles.select(*columns).iterate(connection, batch_size=5000, raw=True):
+            guild_id, user_id, *values = row
+            for metric, value in zip(METRICS, values):
+                if value:
+                    scores.setdefault((guild_id, metric), {})[user_id] = value
+
+        self._boards = {key: Leaderboard(board) for key, board in scores.items()}
+        self.loaded = True
+        logger.info(f'leaderboards: {len(self._boards)} boards reconciled')
+
+    async def run(self, before_reconcile=None) -> None:
+        """reconcile every ``interval`` seconds, ``before_reconcile`` e.g. flushes pending counters"""
+
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if before_reconcile is not None:
+                    await before_reconcile()
+                await self.reconcile()
+            except Exception as ex:
+                logger.error(f'leaderboards reconcile failed: {ex}')
@@ -0,0 +1,70 @@
+import time
+import typing as t
+from collections import OrderedDict
+
+
+class ExpiringIdSet:
+    """Set of ids with a size cap and a time to live.
+
+    Ids are kept in insertion order, so the oldest ones are evicted first
+    when ``maxlen`` is reached or their ``ttl`` has passed.
+    Membership, ``add`` and ``consume`` are O(1) amortized.
+    """
+
+    __slots__ = ('maxlen', 'ttl', '_items', 'hits', 'misses', 'evicted', 'expired')
+
+    def __init__(self, maxlen: int = 10_000, ttl: float = 600.0):
+        self.maxlen = maxlen
+        self.ttl = ttl
+        # id -> monotonic deadline
+        self._items: t.Dict[int, float] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _expire(self, now: float) -> None:
+        items = self._items
+        while items:
+            item, deadline = next(iter(items.items()))
+            if deadline > now:
+                break
+            del items[item]
+            self.expired += 1
+
+    def add(self, item: int) -> None:
+        now = time.monotonic()
+        self._expire(now)
+        items = self._items
+        items.pop(item, None)
+        items[item] = now + self.ttl
+        while len(items) > self.maxlen:
+            items.popitem(last=False)
+            self.evicted += 1
+
+    def __contains__(self, item: int) -> bool:
+        deadline = self._items.get(item)
+        return deadline is not None and deadline > time.monotonic()
+
+    def consume(self, item: int) -> bool:
+        """remove the id, True if it was there and not expired"""
+
+        deadline = self._items.pop(item, None)
+        if deadline is not None and deadline > time.monotonic():
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._items),
+            'maxlen': self.maxlen,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evicted': self.evicted,
+            'expired': self.expired,
+        }
@@ -0,0 +1,126 @@
+import asyncio
+import time
+import typing as t
+from collections import OrderedDict
+
+import discord
+
+from utils.logger import logger
+
+PREVIOUS, NEXT = '⬅️', '➡️'
+
+PageFactory = t.Callable[[], t.Awaitable[discord.Embed]]
+
+
+class PageCache:
+    """Rendered pages by (guild id, page name) for ``ttl`` seconds.
+
+    A page is held as the task rendering it, so concurrent requests of one
+    page share a single render. Failed renders are not cached.
+    """
+
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        # (guild_id, name) -> (monotonic deadline, task), oldest first
+        self._entries: t.Dict[t.Tuple[int, str], t.Tuple[float, asyncio.Future]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expire(self, now: float) -> None:
+        entries = self._entries
+        while entries:
+            key, (deadline, _) = next(iter(entries.items()))
+            if deadline > now:
+                break
+            del entries[key]
+
+    def render(self, guild_id: int, name: str, factory: PageFactory) -> asyncio.Future:
+        """the cached page or a new render of it"""
+
+        now = time.monotonic()
+        self._expire(now)
+        key = (guild_id, name)
+        entry = self._entries.get(key)
+        if entry is not None:
+            task = entry[1]
+            if not (task.done() and (task.cancelled() or task.exception() is not None)):
+                return task
+            del self._entries[key]
+
+        task = asyncio.ensure_future(factory())
+        self._entries[key] = (now + self.ttl, task)
+        return task
+
+    def invalidate(self, guild_id: int) -> None:
+        for key in [key for key in self._entries if key[0] == guild_id]:
+            del self._entries[key]
+
+
+class LazyPaginator:
+    """Embed pages switched by reactions.
+
+    Page one is sent as soon as it is rendered, the other pages are rendered
+    concurrently in the background with ``asyncio.gather``. A page which is
+    not ready yet is awaited when it is opened.
+    """
+
+    def __init__(self, bot, pages: t.Sequence[PageFactory], *, only: discord.abc.User = None, timeout: float = 60.0):
+        self.bot = bot
+        self.pages = list(pages)
+        self.only = only
+        self.timeout = timeout
+        self._rendered: t.List[t.Optional[asyncio.Future]] = [None] * len(self.pages)
+
+    def _page(self, index: int) -> asyncio.Future:
+        task = self._rendered[index]
+        if task is None:
+            task = self._rendered[index] = asyncio.ensure_future(self.pages[index]())
+        return task
+
+    def _check(self, message: discord.Message):
+        def check(reaction, user):
+            return (reaction.message.id == message.id and str(reaction.emoji) in (PREVIOUS, NEXT)
+                    and not user.bot and (self.only is None or user.id == self.only.id))
+        return check
+
+    async def start(self, destination: discord.abc.Messageable) -> discord.Message:
+        """send page one and switch pages until nobody reacts for ``timeout`` seconds"""
+
+        message = await destination.send(embed=await self._page(0))
+        if len(self.pages) < 2:
+            return message
+
+        # exceptions stay in the page tasks, they are raised when the page is opened
+        asyncio.ensure_future(asyncio.gather(*(self._page(i) for i in range(1, len(self.pages))),
+                                             return_exceptions=True))
+        for emoji in (PREVIOUS, NEXT):
+            await message.add_reaction(emoji)
+
+        index = 0
+        while True:
+            try:
+                reaction, user = await self.bot.wait_for('reaction_add', timeout=self.timeout,
+                                                         check=self._check(message))
+            except asyncio.TimeoutError:
+                break
+
+            index = (index + (-1 if str(reaction.emoji) == PREVIOUS else 1)) % len(self.pages)
+            try:
+                embed = await self._page(index)
+            except Exception as ex:
+                logger.error(f'page {index} of a paginator failed: {ex}')
+                self._rendered[index] = None
+                continue
+
+            await message.edit(embed=embed)
+            try:
+                await message.remove_reaction(reaction.emoji, user)
+            except discord.HTTPException:
+                pass
+
+        try:
+            await message.clear_reactions()
+        except discord.HTTPException:
+            pass
+        return message
@@ -0,0 +1,67 @@
+import typing as t
+
+from models.models import Permissions
+from utils.logger import logger
+
+EMPTY = frozenset()
+
+
+class PermissionIndex:
+    """Role ids allowed to run a command, by guild id and command name.
+
+    Built from the permissions table at startup, changed only through
+    ``grant``/``revoke`` (written to the table first) and ``remove_role``
+    when a role is deleted, so checks never query the database.
+    """
+
+    def __init__(self):
+        self._guilds: t.Dict[int, t.Dict[str, t.FrozenSet[int]]] = {}
+
+    def allowed(self, guild_id: int, command: str) -> t.FrozenSet[int]:
+        return self._guilds.get(guild_id, {}).get(command, EMPTY)
+
+    def is_allowed(self, guild_id: int, command: str, role_ids: t.Iterable[int]) -> bool:
+        return not self.allowed(guild_id, command).isdisjoint(role_ids)
+
+    def _add(self, guild_id: int, command: str, role_id: int) -> None:
+        commands = self._guilds.setdefault(guild_id, {})
+        commands[command] = commands.get(command, EMPTY) | {role_id}
+
+    async def load_all(self, connection=None) -> None:
+        """replace the index with the permissions table"""
+
+        guilds = {}
+        query = Permissions.select(Permissions.guild_id, Permissions.command, Permissions.role_id) \
+            .where(Permissions.role_id != None)
+        async for guild_id, command, role_id in query.iterate(connection, raw=True):
+            guilds.setdefault(guild_id, {}).setdefault(command, set()).add(role_id)
+
+        self._guilds = {
+            guild_id: {command: frozenset(role_ids) for command, role_ids in commands.items()}
+            for guild_id, commands in guilds.items()
+        }
+        logger.info(f'permission index: {sum(map(len, self._guilds.values()))} commands loaded')
+
+    async def grant(self, guild_id: int, command: str, role_id: int) -> None:
+        if role_id in self.allowed(guild_id, command):
+            return
+        await Permissions.insert(guild_id=guild_id, command=command, role_id=role_id,
+                                 on_conflict='ignore', conflict_target=['guild_id', 'command', 'role_id'])
+        self._add(guild_id, command, role_id)
+
+    async def revoke(self, guild_id: int, command: str, role_id: int) -> None:
+        await Permissions.delete_(guild_id=guild_id, command=command, role_id=role_id)
+        commands = self._guilds.get(guild_id, {})
+        if command in commands:
+            commands[command] = commands[command] - {role_id}
+
+    def remove_role(self, guild_id: int, role_id: int) -> None:
+        """drop a deleted role, its rows go with the role by ON DELETE CASCADE"""
+
+        commands = self._guilds.get(guild_id, {})
+        for command, role_ids in commands.items():
+            if role_id in role_ids:
+                commands[command] = role_ids - {role_id}
+
+    def remove_guild(self, guild_id: int) -> None:
+        self._guilds.pop(guild_id, None)
@@ -1,24 +1,193 @@
 import asyncio
 import datetime
+import heapq
+import typing as t
 
 from cogs.statistic import get_embed_day_statistic
+from models.instrumentation import metrics
+from models.models import Guilds
+from models.my_orm import MaybeAcquire, Table
+from models.reports import ensure_partitions, take_snapshot
+from utils.logger import logger
 
+# a failed delivery is tried again after
+RETRY_SECONDS = 300
+# the longest sleep, a guard against wall clock jumps
+MAX_SLEEP_SECONDS = 3600
 
-async def send_day_statistic(bot):
-    """loop send day statistic in trophy channel"""
-
-    await bot.wait_until_ready()
-    while not bot.is_closed():
-        now = datetime.datetime.today().time()
-        start = datetime.time(12, 0, 0, 0)
-        end = datetime.time(13, 0, 0, 0)
-        for guild in bot.guilds:
-            channel = await DB.get_info_about_guilds(guild)
-            channel = channel['trophy_channel_id']
-            if channel:
-                if start < now < end:
-                    emb = await get_embed_day_statistic(bot, guild)
-                    await bot.get_channel(channel).send(embed=emb)
-                    await DB.restart_day_statistic(guild)
-
-        await asyncio.sleep(60)
+# marks the day as sent unless it already is, returns nothing when another run was first
+CLAIM_SQL = """
+UPDATE guilds SET statistic_sent = $2
+WHERE guild_id = $1 AND (statistic_sent IS NULL OR statistic_sent < $2)
+RETURNING guild_id
+"""
+
+UNCLAIM_SQL = "UPDATE guilds SET statistic_sent = $3 WHERE guild_id = $1 AND statistic_sent = $2"
+
+
+def next_fire(now: datetime.datetime, minute: int, utc_offset: int,
+              last_sent: t.Optional[datetime.date]) -> t.Tuple[datetime.datetime, datetime.date]:
+    """(naive utc time, local day) of the next day statistic of a guild.
+
+    The time is past when a day after ``last_sent`` is overdue. A guild which was never
+    reported starts on the next statistic time, not at once with an almost empty report.
+    """
+
+    offset = datetime.timedelta(minutes=utc_offset)
+    day = (now + offset).date()
+    if last_sent is not None and last_sent >= day:
+        day = last_sent + datetime.timedelta(days=1)
+    at = datetime.datetime.combine(day, datetime.time()) + datetime.timedelta(minutes=minute) - offset
+    if last_sent is None and at <= now:
+        day += datetime.timedelta(days=1)
+        at += datetime.timedelta(days=1)
+    return at, day
+
+
+class DayStatisticScheduler:
+    """Posts the day statistic of every guild once a day at its local time.
+
+    Next fire times are kept in a min-heap and the loop sleeps until the earliest
+    one or until a guild is rescheduled. ``guilds.statistic_sent`` is claimed before
+    a report is posted, so a restart never posts the same day twice. At most
+    ``concurrency`` guilds are reported at the same time.
+    """
+
+    def __init__(self, bot, *, concurrency: int = 5):
+        self.bot = bot
+        # (naive utc fire time, guild_id, local day)
+        self._heap: t.List[t.Tuple[datetime.datetime, int, datetime.date]] = []
+        # guild_id -> fire time of its live heap entry, other entries of the guild are stale
+        self._due: t.Dict[int, datetime.datetime] = {}
+        # guild_id -> local day of the last posted statistic
+        self._sent: t.Dict[int, datetime.date] = {}
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._jobs: t.Set[asyncio.Task] = set()
+        Guilds.add_update_listener(self._on_update)
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    async def load_all(self, connection=None) -> None:
+        """read the sent days and schedule every guild of the bot"""
+
+        rows = await Guilds.select(Guilds.guild_id, Guilds.statistic_sent).fetch(connection, raw=True)
+        self._sent = {guild_id: sent for guild_id, sent in rows if sent is not None}
+        for guild in self.bot.guilds:
+            self.schedule(guild.id)
+        logger.info(f'day statistic: {len(self._due)} guilds scheduled')
+
+    def schedule(self, guild_id: int, at: datetime.datetime = None, day: datetime.date = None) -> None:
+        """(re)schedule a guild by its config, or at ``at`` for ``day``"""
+
+        if at is None:
+            guild_config = self.bot.cached_guilds.get(guild_id)
+            if guild_config is None:
+                self._due.pop(guild_id, None)
+                return
+            minute = 720 if guild_config.statistic_minute is None else guild_config.statistic_minute
+            at, day = next_fire(datetime.datetime.utcnow(), minute, guild_config.utc_offset or 0,
+                                self._sent.get(guild_id))
+
+        self._due[guild_id] = at
+        heapq.heappush(self._heap, (at, guild_id, day))
+        if self._heap[0][1] == guild_id:
+            self._wakeup.set()
+
+    def unschedule(self, guild_id: int) -> None:
+        self._due.pop(guild_id, None)
+        self._sent.pop(guild_id, None)
+
+    def _on_update(self, filters: dict, values: dict, increments: dict) -> None:
+        """Guilds update listener, a changed time or offset moves the next fire"""
+
+        guild_id = filters.get('guild_id')
+        if guild_id in self._due and {'statistic_minute', 'utc_offset'} & values.keys():
+            self.schedule(guild_id)
+
+    def _pop_due(self, now: datetime.datetime) -> t.List[t.Tuple[int, datetime.date]]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            at, guild_id, day = heapq.heappop(self._heap)
+            if self._due.get(guild_id) == at:
+                del self._due[guild_id]
+                due.append((guild_id, day))
+        return due
+
+    async def run(self) -> None:
+        """sleep until the earliest fire time, start the due guilds"""
+
+        await self.bot.wait_until_ready()
+        while not self.bot.is_closed():
+            self._wakeup.clear()
+            now = datetime.datetime.utcnow()
+            due = self._pop_due(now)
+            if due:
+                try:
+                    # reports read the totals from the database
+                    await self.bot.activity.flush()
+                except Exception as ex:
+                    logger.error(f'day statistic: activity flush failed: {ex}')
+                try:
+                    # once here, not in every snapshot transaction of the guilds
+                    await ensure_partitions({day for _, day in due})
+                except Exception as ex:
+                    logger.error(f'day statistic: daily_stats partitions failed: {ex}')
+                for guild_id, day in due:
+                    task = asyncio.get_event_loop().create_task(self._deliver(guild_id, day))
+                    self._jobs.add(task)
+                    task.add_done_callback(self._jobs.discard)
+
+            timeout = None
+            if self._heap:
+                timeout = min(max((self._heap[0][0] - now).total_seconds(), 0), MAX_SLEEP_SECONDS)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, guild_id: int, day: datetime.date) -> None:
+        async with self._semaphore:
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                return
+            try:
+                await self._send(guild, day)
+            except Exception as ex:
+                logger.error(f'{guild}: day statistic of {day} failed, retry in {RETRY_SECONDS} s: {ex}')
+                self.schedule(guild_id, datetime.datetime.utcnow() + datetime.timedelta(seconds=RETRY_SECONDS), day)
+                return
+            self._sent[guild_id] = max(day, self._sent.get(guild_id, day))
+            self.schedule(guild_id)
+
+    async def _send(self, guild, day: datetime.date) -> None:
+        """snapshot the totals, claim the day and post the report to the trophy channel
+
+        The snapshot goes first so a failed one is retried with the delivery, the report
+        of the day subtracts only snapshots of earlier days and is not changed by it.
+        """
+
+        await take_snapshot(guild.id, day)
+
+        previous = self._sent.get(guild.id)
+        key = ('guilds', 'statistic_claim')
+        async with MaybeAcquire(None, pool=Table._pool, key=key) as con:
+            with metrics.timed(key, CLAIM_SQL) as timer:
+                claimed = await con.fetchval(CLAIM_SQL, guild.id, day)
+                timer.rows = int(claimed is not None)
+        if claimed is None:
+            logger.info(f'{guild}: day statistic of {day} is already sent')
+            return
+
+        guild_config = self.bot.cached_guilds.get(guild.id)
+        channel = self.bot.get_channel(guild_config.trophy_channel_id) if guild_config else None
+        if channel is not None:
+            try:
+                # the snapshot of the day is taken above, the report subtracts the one before it
+                emb = await get_embed_day_statistic(self.bot, guild, day, include_day=False)
+                await channel.send(embed=emb)
+            except Exception:
+                async with MaybeAcquire(None, pool=Table._pool, key=('guilds', 'statistic_unclaim')) as con:
+                    await con.execute(UNCLAIM_SQL, guild.id, day, previous)
+                raise
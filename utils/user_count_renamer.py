@@ -0,0 +1,97 @@
+import asyncio
+import collections
+import random
+import time
+import typing as t
+
+import discord
+
+from models.models import UserCountNames
+from utils.logger import logger
+
+# discord allows 2 renames of a channel per 10 minutes
+RENAMES_PER_WINDOW = 2
+RENAME_WINDOW_SECONDS = 600
+
+
+class UserCountRenamer:
+    """Renames user count channels no faster than the discord rate limit allows.
+
+    Requests are coalesced per guild: while a rename waits for the window only the
+    latest member count is kept, the name pool is read from the database once.
+    """
+
+    def __init__(self, guild_cache):
+        self.guild_cache = guild_cache
+        self._names: t.Dict[int, t.List[str]] = {}
+        self._pending: t.Dict[int, discord.Guild] = {}
+        self._renames: t.Dict[int, t.Deque[float]] = collections.defaultdict(
+            lambda: collections.deque(maxlen=RENAMES_PER_WINDOW))
+        self._workers: t.Dict[int, asyncio.Task] = {}
+        self.coalesced = 0
+
+    async def load_names(self, connection=None) -> None:
+        """read the name pools of all guilds"""
+
+        names = collections.defaultdict(list)
+        async for guild_id, name in UserCountNames.select(UserCountNames.guild_id, UserCountNames.name) \
+                .iterate(connection, raw=True):
+            names[guild_id].append(name)
+        self._names = dict(names)
+
+    def set_names(self, guild_id: int, names: t.List[str]) -> None:
+        self._names[guild_id] = list(names)
+
+    def request(self, guild: discord.Guild) -> None:
+        """schedule a rename to the member count the guild has when the window opens"""
+
+        guild_config = self.guild_cache.get(guild.id)
+        if guild_config is None or not guild_config.user_count_channel_id:
+            return
+
+        if guild.id in self._pending:
+            self.coalesced += 1
+        self._pending[guild.id] = guild
+
+        worker = self._workers.get(guild.id)
+        if worker is None or worker.done():
+            self._workers[guild.id] = asyncio.get_event_loop().create_task(self._worker(guild.id))
+
+    def _delay(self, guild_id: int) -> float:
+        renames = self._renames[guild_id]
+        if len(renames) < RENAMES_PER_WINDOW:
+            return 0.0
+        return max(0.0, renames[0] + RENAME_WINDOW_SECONDS - time.monotonic())
+
+    async def _worker(self, guild_id: int) -> None:
+        while guild_id in self._pending:
+            delay = self._delay(guild_id)
+            if delay:
+                await asyncio.sleep(delay)
+
+            guild = self._pending.pop(guild_id, None)
+            if guild is None:
+                return
+            try:
+                await self._rename(guild)
+            except Exception as ex:
+                logger.error(f'{guild}: user count channel rename failed: {ex}')
+
+    async def _rename(self, guild: discord.Guild) -> None:
+        guild_config = self.guild_cache.get(guild.id)
+        channel = guild.get_channel(guild_config.user_count_channel_id) if guild_config else None
+        if channel is None:
+            return
+
+        if channel.name.endswith(f': {guild.member_count}'):
+            return
+        names = self._names.get(guild.id)
+        name = random.choice(names) if names else ''
+        await channel.edit(name=f'{name}: {guild.member_count}')
+        self._renames[guild.id].append(time.monotonic())
+
+    def close(self) -> None:
+        for worker in self._workers.values():
+            worker.cancel()
+        self._workers.clear()
+        self._pending.clear()
@@ -0,0 +1,105 @@
+import time
+import typing as t
+
+import discord
+
+from utils.logger import logger
+
+# coins are paid for at most this many minutes of one session
+MAX_PAID_MINUTES = 180
+
+
+class VoiceSession:
+    __slots__ = ('channel_id', 'started', 'afk')
+
+    def __init__(self, channel_id: int, started: float, afk: bool):
+        self.channel_id = channel_id
+        self.started = started
+        self.afk = afk
+
+
+class VoiceSessionTracker:
+    """Open voice sessions by (guild_id, member_id).
+
+    A session starts when a member enters a channel and ends when they leave or move,
+    only then its minutes and coins go to the activity aggregator. Mute, deafen, stream
+    and other changes within one channel are ignored.
+    """
+
+    def __init__(self, activity, guild_cache, series=None, active_users=None):
+        self.activity = activity
+        self.guild_cache = guild_cache
+        self.series = series
+        self.active_users = active_users
+        self._sessions: t.Dict[t.Tuple[int, int], VoiceSession] = {}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def rebuild(self, guilds: t.Iterable[discord.Guild]) -> None:
+        """Open a session for every member already sitting in a voice channel.
+
+        Sessions still in the same channel (``on_ready`` after a reconnect) keep their start,
+        the ones which ended or moved while the gateway was disconnected are credited up to now.
+        """
+
+        now = time.monotonic()
+        sessions = {}
+        for guild in guilds:
+            for channel in guild.voice_channels:
+                for member in channel.members:
+                    if member.bot:
+                        continue
+                    key = (guild.id, member.id)
+                    session = self._sessions.get(key)
+                    if session is None or session.channel_id != channel.id:
+                        session = VoiceSession(channel.id, now, channel == guild.afk_channel)
+                    sessions[key] = session
+        for key, session in self._sessions.items():
+            if sessions.get(key) is not session:
+                self._credit(key, session, now)
+        self._sessions = sessions
+        logger.info(f'voice sessions: {len(self._sessions)} members in voice channels')
+
+    def update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState) -> None:
+        if member.bot:
+            return
+
+        channel_before = before.channel.id if before.channel else None
+        channel_after = after.channel.id if after.channel else None
+        if channel_before == channel_after:
+            return
+
+        now = time.monotonic()
+        key = (member.guild.id, member.id)
+        session = self._sessions.pop(key, None)
+        if session is not None:
+            self._credit(key, session, now)
+
+        if channel_after is not None:
+            self._sessions[key] = VoiceSession(channel_after, now, after.afk)
+
+    def _credit(self, key: t.Tuple[int, int], session: VoiceSession, now: float) -> int:
+        minutes = int((now - session.started) // 60)
+        if session.afk or minutes < 1:
+            return 0
+
+        guild_id, member_id = key
+        guild_config = self.guild_cache.get(guild_id)
+        price = guild_config.price_minutes if guild_config else 0
+        self.activity.add_voice(guild_id, member_id, minutes, min(minutes, MAX_PAID_MINUTES) * price,
+                                session.channel_id)
+        end = time.time() - (time.monotonic() - now)
+        if self.series is not None:
+            self.series.record_voice(guild_id, session.channel_id, member_id, minutes, end)
+        if self.active_users is not None:
+            self.active_users.record_voice(guild_id, session.channel_id, member_id, end)
+        return minutes
+
+    def close(self) -> None:
+        """credit every open session, e.g. before shutdown"""
+
+        now = time.monotonic()
+        sessions, self._sessions = self._sessions, {}
+        for key, session in sessions.items():
+            self._credit(key, session, now)
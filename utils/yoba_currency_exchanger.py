@@ -1,13 +1,25 @@
 import aiohttp
 import asyncio
+import json
+import os
 import re
+import time
+import typing as t
 from decimal import Decimal
 
+from bot.settings import CURRENCY_API_URL, CURRENCY_RATES_TTL, CURRENCY_SNAPSHOT_PATH
+from utils.logger import logger
+
 
 class CurrencyExchanger:
-    api_key = '9c8736a2c2fb0f26f7bd448155798db6'
-    url = f'http://data.fixer.io/api/latest?access_key={api_key}'
-    cur_list = ['AED', 'AFN', 'ALL', 'AMD', 'ANG', 'AOA', 'ARS', 'AUD', 'AWG', 'AZN', 'BAM', 'BBD', 'BDT', 'BGN', 'BHD',
+    """Converts amounts with fixer.io rates (EUR based).
+
+    The rate table is kept for ``ttl`` seconds and fetched through one persistent
+    session, concurrent calls wait for the same fetch. Every fetched table is saved
+    to ``snapshot_path``, it is used when the api can not be reached.
+    """
+
+    cur_list = frozenset(['AED', 'AFN', 'ALL', 'AMD', 'ANG', 'AOA', 'ARS', 'AUD', 'AWG', 'AZN', 'BAM', 'BBD', 'BDT', 'BGN', 'BHD',
                 'BIF',
                 'BMD', 'BND', 'BOB', 'BRL', 'BSD', 'BTC', 'BTN', 'BWP', 'BYN', 'BYR', 'BZD', 'CAD', 'CDF', 'CHF', 'CLF',
                 'CLP',
@@ -27,19 +39,82 @@ class CurrencyExchanger:
                 'TRY',
                 'TTD', 'TWD', 'TZS', 'UAH', 'UGX', 'USD', 'UYU', 'UZS', 'VEF', 'VND', 'VUV', 'WST', 'XAF', 'XAG', 'XAU',
                 'XCD',
-                'XDR', 'XOF', 'XPF', 'YER', 'ZAR', 'ZMK', 'ZMW', 'ZWL']
-
-    @classmethod
-    async def get_rates(cls) -> dict:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f'{cls.url}') as resp:
-                if resp.status == 200:
-                    return await resp.json()
-                else:
-                    raise ConnectionError
-
-    @classmethod
-    async def exchange(cls, string: str) -> str:
+                'XDR', 'XOF', 'XPF', 'YER', 'ZAR', 'ZMK', 'ZMW', 'ZWL'])
+
+    def __init__(self, url: str = CURRENCY_API_URL, *, ttl: float = CURRENCY_RATES_TTL,
+                 snapshot_path: t.Optional[str] = CURRENCY_SNAPSHOT_PATH, timeout: float = 10.0):
+        self.url = url
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self.timeout = timeout
+        self._session: t.Optional[aiohttp.ClientSession] = None
+        self._rates: t.Optional[dict] = None
+        self._fetched_at = 0.0
+        self._refresh: t.Optional[asyncio.Task] = None
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _fetch(self) -> dict:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        async with self._session.get(self.url) as resp:
+            if resp.status != 200:
+                raise ConnectionError(f'currency api status {resp.status}')
+            data = await resp.json()
+        if not data.get('rates'):
+            raise ConnectionError(f"currency api error {data.get('error')}")
+        return data
+
+    def _save_snapshot(self, data: dict) -> None:
+        os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+        tmp_path = f'{self.snapshot_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def _load_snapshot(self) -> t.Optional[dict]:
+        try:
+            with open(self.snapshot_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    async def _refresh_rates(self) -> dict:
+        loop = asyncio.get_event_loop()
+        try:
+            data = await self._fetch()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError, ValueError) as ex:
+            logger.warning(f'currency rates fetch failed: {ex}')
+            if self._rates is None and self.snapshot_path:
+                data = await loop.run_in_executor(None, self._load_snapshot)
+                if data is not None:
+                    # keep the snapshot for a ttl, the api is retried after it
+                    self._rates, self._fetched_at = data['rates'], time.monotonic()
+            if self._rates is None:
+                raise ConnectionError('currency rates are not available') from ex
+            return self._rates
+
+        self._rates, self._fetched_at = data['rates'], time.monotonic()
+        if self.snapshot_path:
+            try:
+                await loop.run_in_executor(None, self._save_snapshot, data)
+            except OSError as ex:
+                logger.warning(f'currency rates snapshot not saved: {ex}')
+        return self._rates
+
+    async def get_rates(self) -> dict:
+        """rates by currency code, refreshed when older than ttl"""
+
+        if self._rates is not None and time.monotonic() - self._fetched_at < self.ttl:
+            return self._rates
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.get_event_loop().create_task(self._refresh_rates())
+        return await asyncio.shield(self._refresh)
+
+    async def exchange(self, string: str) -> str:
         try:
             value = re.search(r'\d+', string)[0]
             cur_list = string.split('/')
@@ -48,11 +123,16 @@ class CurrencyExchanger:
         except:
             return 'не правильный ввод'
 
-        if not (from_cur in cls.cur_list and to_cur in cls.cur_list):
+        if from_cur not in self.cur_list or to_cur not in self.cur_list:
+            return 'такой валюты нету в апи'
+
+        try:
+            rate = await self.get_rates()
+        except ConnectionError:
+            return 'апи валют недоступно'
+        if from_cur not in rate or to_cur not in rate:
             return 'такой валюты нету в апи'
 
-        data = await cls.get_rates()
-        rate = data['rates']
         if from_cur != 'EUR':
             eur = Decimal(value) / Decimal(rate[from_cur])
             if to_cur == 'EUR':
@@ -69,7 +149,7 @@ class CurrencyExchanger:
 #     while True:
 #         string = input()
 #         # string = '100 EUR/USD'
-#         res = await CurrencyExchanger.exchange(string)
+#         res = await CurrencyExchanger().exchange(string)
 #         print(res)
 #
 #